@@ -0,0 +1,45 @@
+''' Compare the STRtree matching engine in country_boundary.match_datasets against the original row-by-row loop
+
+    python benchmarks/bench_match_datasets.py --fine 200 --coarse 12
+'''
+import sys, os, time, argparse, tempfile
+
+import numpy as np
+import geopandas as gpd
+
+from synthetic import make_grid
+from GOSTboundaries.boundary_helper import country_boundary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark match_datasets engines')
+    parser.add_argument('--fine', type=int, default=100, help='number of fine cells along each side')
+    parser.add_argument('--coarse', type=int, default=10, help='number of admin units along each side')
+    parser.add_argument('--skip_loop', action='store_true', help='only time the strtree engine')
+    args = parser.parse_args()
+    
+    fine = make_grid(args.fine, id_prefix='CELL')
+    coarse = make_grid(args.coarse, id_prefix='ADM', offset=0.013)
+    coarse = coarse.rename(columns={'shape_id':'ADM_ID'})
+    
+    with tempfile.TemporaryDirectory() as out_folder:
+        cb = country_boundary('XXX', coarse, 'ADM_ID', out_folder=out_folder, geoBounds=coarse.copy(), geoBounds_id_col='ADM_ID')
+        
+        start = time.perf_counter()
+        fast_res = cb.match_datasets(fine.copy(), coarse, 'shape_id', 'ADM_ID', method='strtree')
+        fast_time = time.perf_counter() - start
+        print(f"strtree: {fine.shape[0]} x {coarse.shape[0]} features in {round(fast_time, 3)} seconds")
+        
+        if not args.skip_loop:
+            start = time.perf_counter()
+            loop_res = cb.match_datasets(fine.copy(), coarse, 'shape_id', 'ADM_ID', method='loop')
+            loop_time = time.perf_counter() - start
+            print(f"loop:    {fine.shape[0]} x {coarse.shape[0]} features in {round(loop_time, 3)} seconds")
+            print(f"speedup: {round(loop_time/fast_time, 1)}x")
+            
+            same_id = (fast_res['geo_match_id'] == loop_res['geo_match_id']).all()
+            same_per = np.allclose(fast_res['geo_match_per'], loop_res['geo_match_per'])
+            print(f"identical geo_match_id: {same_id}; identical geo_match_per: {same_per}")
+    
+if __name__ == "__main__":
+    main()
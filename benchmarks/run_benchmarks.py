@@ -0,0 +1,120 @@
+''' Time and memory profile each stage of country_boundary on synthetic data at several scales
+
+    python benchmarks/run_benchmarks.py --scales 10 25 50 --output bench_results.json
+    python benchmarks/run_benchmarks.py --scales 10 25 --baseline bench_results.json --threshold 1.5
+
+    Each scale n creates an n x n grid of admin units. Results are written as json; when a baseline is
+    provided, any stage slower than threshold x the baseline (or slower than --max_seconds), or whose peak
+    memory grew beyond threshold x the baseline, is reported and the script exits with status 1.
+'''
+import sys, os, json, argparse, tempfile, platform
+
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from synthetic import make_admin_datasets, make_raster
+from GOSTboundaries.boundary_helper import country_boundary
+from GOSTboundaries.instrument import stage_recorder
+
+STAGES = ['match_datasets', 'generate_boundary_difference', 'generate_h3_grid', 'match_h3', 'run_zonal']
+
+
+def time_stage(func, recorder):
+    ''' run func, a single instrumented stage of country_boundary, returning its result, the wall time, and
+        the increase of the peak resident memory over the memory at the start of the stage, as recorded by the
+        stage_recorder; this includes the memory of GEOS, GDAL and numpy
+    '''
+    res = func()
+    record = recorder.records[-1]
+    return([res, record['seconds'], record['peak_rss_increase_mb']])
+
+def run_scale(n_admins, vertices_per_edge, h3_level, stages, out_folder):
+    ''' run all selected stages for a single synthetic country
+    '''
+    wb, geo = make_admin_datasets(n_admins, vertices_per_edge=vertices_per_edge)
+    recorder = stage_recorder(memory_interval=0.01)
+    cb = country_boundary('XXX', wb, 'WB_ID', out_folder=out_folder, geoBounds=geo, recorder=recorder)
+    n_vertices = int(shapely.get_num_coordinates(np.asarray(wb['geometry'])).sum())
+    ntl_file = make_raster(os.path.join(out_folder, 'ntl.tif'), wb, rastType='N')
+    lc_file = make_raster(os.path.join(out_folder, 'lc.tif'), wb, rastType='C')
+    runs = {
+        'match_datasets': lambda: cb.match_datasets(cb.geoBounds, cb.wb_bounds, 'shapeID', 'WB_ID'),
+        'generate_boundary_difference': lambda: cb.generate_boundary_difference(big_thresh=1000),
+        'generate_h3_grid': lambda: cb.generate_h3_grid(level=h3_level),
+        'match_h3': lambda: cb.match_datasets(cb.h3_grid.copy(), cb.wb_bounds, 'shape_id', 'WB_ID', method='centroid'),
+        'run_zonal': lambda: cb.run_zonal([[ntl_file, 'NTL', 'N'], [lc_file, 'LC', 'C', [10, 20, 30, 40]]], z_corB=True, z_h3=True),
+    }
+    all_res = []
+    for stage in STAGES:
+        if not stage in stages:
+            continue
+        res, seconds, peak = time_stage(runs[stage], recorder)
+        if stage == 'match_datasets':
+            cb.geoBounds = res
+        n_rows = res.shape[0] if hasattr(res, 'shape') else len(res)
+        all_res.append({'scale':n_admins, 'n_admins':wb.shape[0], 'n_vertices':n_vertices, 'stage':stage,
+                            'output_rows':n_rows, 'seconds':round(seconds, 4), 'peak_rss_increase_mb':peak})
+        print(f"{n_admins:>4} {stage:<30} {seconds:>9.3f}s {peak:>9.1f}MB")
+    return(all_res)
+
+def compare_baseline(results, baseline, threshold, max_seconds=None, min_memory_mb=10):
+    ''' identify stages that are slower than threshold x baseline, or slower than max_seconds, and stages whose
+        peak memory increase is larger than threshold x baseline; memory differences smaller than min_memory_mb
+        are measurement noise and are not reported
+    '''
+    cur = pd.DataFrame(results)
+    failures = []
+    if baseline is not None:
+        base = pd.DataFrame(baseline['results'])
+        base = base.loc[:,[x for x in ['scale', 'stage', 'seconds', 'peak_rss_increase_mb'] if x in base.columns]]
+        comp = cur.merge(base, on=['scale', 'stage'], suffixes=['', '_baseline'])
+        for idx, row in comp.loc[comp['seconds'] > comp['seconds_baseline'] * threshold].iterrows():
+            failures.append(f"{row['stage']} at scale {row['scale']}: {row['seconds']}s vs baseline {row['seconds_baseline']}s")
+        if 'peak_rss_increase_mb_baseline' in comp.columns:
+            mem, base_mem = comp['peak_rss_increase_mb'], comp['peak_rss_increase_mb_baseline']
+            for idx, row in comp.loc[(mem > base_mem * threshold) & (mem - base_mem > min_memory_mb)].iterrows():
+                failures.append(f"{row['stage']} at scale {row['scale']}: peak memory +{row['peak_rss_increase_mb']}MB vs baseline +{row['peak_rss_increase_mb_baseline']}MB")
+    if max_seconds is not None:
+        for idx, row in cur.loc[cur['seconds'] > max_seconds].iterrows():
+            failures.append(f"{row['stage']} at scale {row['scale']}: {row['seconds']}s exceeds {max_seconds}s")
+    return(failures)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the boundary comparison pipeline on synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 25, 50], help='number of admin units along each side')
+    parser.add_argument('--vertices', type=int, default=20, help='vertices along each side of each admin unit')
+    parser.add_argument('--h3_level', type=int, default=6, help='level of h3 grid')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='stages to benchmark')
+    parser.add_argument('--output', default=None, help='json file to write results')
+    parser.add_argument('--baseline', default=None, help='json results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='allowed slowdown and memory growth relative to the baseline')
+    parser.add_argument('--max_seconds', type=float, default=None, help='maximum allowed seconds for any stage')
+    parser.add_argument('--min_memory_mb', type=float, default=10, help='memory growth relative to the baseline ignored as noise')
+    args = parser.parse_args(args)
+
+    results = []
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as out_folder:
+            results = results + run_scale(scale, args.vertices, args.h3_level, args.stages, out_folder)
+
+    output = {'environment':{'python':platform.python_version(), 'shapely':shapely.__version__,
+                                'geopandas':gpd.__version__, 'pandas':pd.__version__, 'numpy':np.__version__},
+                'parameters':{'vertices':args.vertices, 'h3_level':args.h3_level},
+                'results':results}
+    if args.output is not None:
+        with open(args.output, 'w') as out_file:
+            json.dump(output, out_file, indent=2)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as in_file:
+            baseline = json.load(in_file)
+    failures = compare_baseline(results, baseline, args.threshold, args.max_seconds, args.min_memory_mb)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    return(1 if len(failures) > 0 else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+''' Synthetic admin boundaries and rasters for benchmarking the boundary comparison without network access
+'''
+import numpy as np
+import geopandas as gpd
+import rasterio, shapely
+
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+
+def make_grid(n_cells, extent=(30.0, -5.0, 40.0, 5.0), id_prefix='ID', offset=0.0):
+    ''' create an n_cells x n_cells grid of square polygons covering extent
+    '''
+    xmin, ymin, xmax, ymax = extent
+    xs = np.linspace(xmin, xmax, n_cells + 1) + offset
+    ys = np.linspace(ymin, ymax, n_cells + 1) + offset
+    geoms = []
+    for i in range(n_cells):
+        for j in range(n_cells):
+            geoms.append(box(xs[i], ys[j], xs[i+1], ys[j+1]))
+    ids = [f'{id_prefix}_{x}' for x in range(len(geoms))]
+    return(gpd.GeoDataFrame({'shape_id':ids}, geometry=geoms, crs=4326))
+
+def displace(geoms, amplitude, wavelength, phase):
+    ''' move every vertex with a smooth displacement field; vertices shared by neighbouring polygons move
+        identically, so the polygons stay a clean partition without gaps or overlaps
+    '''
+    def shift(coords):
+        x, y = coords[:,0], coords[:,1]
+        dx = amplitude * np.sin(y * 2 * np.pi / wavelength + phase)
+        dy = amplitude * np.cos(x * 2 * np.pi / wavelength + phase * 2)
+        return(np.column_stack([x + dx, y + dy]))
+    return(shapely.transform(geoms, shift))
+
+def make_admin_datasets(n_admins, vertices_per_edge=10, cell_size=0.1, origin=(36.0, 0.0), seed=0):
+    ''' Generate a pair of synthetic admin datasets covering the same area, similar to the WB bounds and
+        geoboundaries. Both are an n_admins x n_admins grid of admin units with detailed, wavy edges; the
+        edges of the second dataset are displaced differently, creating slivers and holes between them
+
+        :param n_admins: number of admin units along each side of the country
+        :type n_admins: int
+        :param vertices_per_edge: number of vertices along each side of each admin unit
+        :type vertices_per_edge: int
+        :param cell_size: size of each admin unit in degrees
+        :type cell_size: float
+        :return: WB style bounds (id column WB_ID) and geoboundaries style bounds (id column shapeID)
+        :rtype: list of class:`geopandas.GeoDataFrame`
+    '''
+    rng = np.random.default_rng(seed)
+    extent = (origin[0], origin[1], origin[0] + n_admins * cell_size, origin[1] + n_admins * cell_size)
+    grid = make_grid(n_admins, extent=extent)
+    geoms = shapely.segmentize(np.asarray(grid['geometry']), cell_size / vertices_per_edge)
+    amplitude = cell_size / 20
+    wb_geoms = displace(geoms, amplitude, cell_size * 3, rng.random() * np.pi)
+    geo_geoms = displace(geoms, amplitude, cell_size * 2.5, rng.random() * np.pi)
+    wb = gpd.GeoDataFrame({'WB_ID':[f'WB_{x}' for x in range(len(geoms))]}, geometry=wb_geoms, crs=4326)
+    geo = gpd.GeoDataFrame({'shapeID':[f'GEO_{x}' for x in range(len(geoms))]}, geometry=geo_geoms, crs=4326)
+    return([wb, geo])
+
+def make_raster(out_file, inD, resolution=0.005, rastType='N', categories=[10, 20, 30, 40], seed=0):
+    ''' Write a synthetic single band raster covering inD
+
+        :param out_file: path of GeoTIFF to create
+        :type out_file: string
+        :param inD: dataset defining the extent of the raster
+        :type inD: class:`geopandas.GeoDataFrame`
+        :param rastType: 'N' for a continuous float raster, 'C' for a categorical raster of categories
+        :type rastType: string
+    '''
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = inD.total_bounds
+    width = int(np.ceil((xmax - xmin) / resolution)) + 2
+    height = int(np.ceil((ymax - ymin) / resolution)) + 2
+    if rastType == 'N':
+        data = (rng.random((height, width)) * 100).astype(np.float32)
+    else:
+        data = rng.choice(categories, size=(height, width)).astype(np.uint8)
+    transform = from_origin(xmin - resolution, ymax + resolution, resolution, resolution)
+    with rasterio.open(out_file, 'w', driver='GTiff', height=height, width=width, count=1, dtype=data.dtype,
+                            crs='EPSG:4326', transform=transform, compress='lzw', tiled=True) as out_r:
+        out_r.write(data, 1)
+    return(out_file)
@@ -0,0 +1,246 @@
+import sys, os, json, argparse, traceback
+
+import shapely
+import pandas as pd
+import geopandas as gpd
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import GOSTRocks.ntlMisc as ntl
+from GOSTRocks.misc import tPrint
+
+from GOSTboundaries.boundary_helper import country_boundary
+from GOSTboundaries.geobounds_cache import geobounds_cache, GEOBOUNDS_URL
+from GOSTboundaries.prefetch import prefetch, geobounds_fetcher
+from GOSTboundaries.sources import boundary_source, open_source
+
+SUMMARY_COLUMNS = ['wb_area', 'geo_area', 'wb_features', 'geo_features', 'wb_sliver_area', 'wb_holes_area']
+STATUS_FILE = 'batch_status.json'
+
+
+def read_status(out_folder):
+    ''' read the batch status file written for a single country, returns None if the country has not been run
+    '''
+    status_file = os.path.join(out_folder, STATUS_FILE)
+    if not os.path.exists(status_file):
+        return(None)
+    with open(status_file, 'r') as in_file:
+        return(json.load(in_file))
+
+def write_status(out_folder, status):
+    ''' write the batch status for a single country; written to a temporary file and renamed so a crash
+        never leaves a partial status file behind
+    '''
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    status_file = os.path.join(out_folder, STATUS_FILE)
+    with open(f'{status_file}.tmp', 'w') as out_file:
+        json.dump(status, out_file)
+    os.replace(f'{status_file}.tmp', status_file)
+
+def run_country(iso3, wb_bounds, wb_id_col, out_folder, geoBounds_id_col='shapeID', run_kwargs=None, write_output=True, cache=None, geoBounds='',
+                geobounds_url=GEOBOUNDS_URL):
+    ''' run the boundary comparison for a single country; all errors are caught and recorded in the
+        returned status so one failing country does not stop the batch
+
+        :param iso3: 3-character iso3 string for country
+        :type iso3: string
+        :param wb_bounds: official World Bank boundaries for the selected country, or a source of global boundaries
+        :type wb_bounds: class:`geopandas.GeoDataFrame` or class:`GOSTboundaries.sources.boundary_source`
+        :param out_folder: folder to write results and batch status
+        :type out_folder: string
+        :param run_kwargs: additional arguments passed to country_boundary.run_all
+        :type run_kwargs: dict, optional
+        :param cache: local cache of geoboundaries downloads
+        :type cache: class:`GOSTboundaries.geobounds_cache.geobounds_cache`, optional
+        :param geoBounds: geoboundaries already downloaded for the country, default is '' (downloaded, through cache
+            if it is defined; processes sharing a cache take turns updating it)
+        :type geoBounds: class:`geopandas.GeoDataFrame`, optional
+        :param geobounds_url: url template for the geoboundaries api, used when geoBounds is not defined
+        :type geobounds_url: string, optional
+    '''
+    if run_kwargs is None:
+        run_kwargs = {}
+    status = {'ISO3':iso3, 'status':'failed', 'error':''}
+    try:
+        if not isinstance(geoBounds, gpd.GeoDataFrame):
+            geoBounds = geobounds_fetcher(geobounds_url=geobounds_url, cache=cache)(iso3)
+        cb = country_boundary(iso3, wb_bounds, wb_id_col, out_folder=out_folder, geoBounds=geoBounds, geoBounds_id_col=geoBounds_id_col,
+                                geobounds_cache=cache)
+        cb.run_all(run_comparison=True, **run_kwargs)
+        summary = cb.generate_summary_difference(verbose=False)
+        status.update(dict(zip(SUMMARY_COLUMNS, [float(x) for x in summary[:-1]])))
+        if write_output:
+            cb.write_output(cb.out_folder)
+        status['status'] = 'complete'
+    except Exception:
+        status['error'] = traceback.format_exc()
+    write_status(out_folder, status)
+    return(status)
+
+def run_batch(iso3_list, wb_bounds, wb_id_col, out_folder, summary_file, iso_col='ISO_A3', geoBounds_id_col='shapeID',
+                max_workers=None, resume=True, run_kwargs=None, write_output=True, cache=None, prefetch_workers=4,
+                geobounds_url=GEOBOUNDS_URL, verbose=False):
+    ''' Run country_boundary comparisons for a list of countries in a process pool and write a single
+        consolidated comp_summary table. The geoboundaries of upcoming countries, and the nighttime lights
+        listing used by zonal statistics, are downloaded in threads while earlier countries are processed
+
+        :param iso3_list: list of 3-character iso3 codes to process
+        :type iso3_list: list of strings
+        :param wb_bounds: official World Bank boundaries for all countries, a source of global boundaries, or the path to 
+            a file readable by geopandas or a folder written by sources.partition_boundaries. Paths and sources 
+            are read one country at a time in the worker processes
+        :type wb_bounds: class:`geopandas.GeoDataFrame`, class:`GOSTboundaries.sources.boundary_source` or string
+        :param wb_id_col: name of column in wb_bounds with unique id
+        :type wb_id_col: string
+        :param out_folder: output folder template for each country; {sel_iso3} is replaced by the iso3 code
+        :type out_folder: string
+        :param summary_file: path to csv file for the consolidated comparison summary
+        :type summary_file: string
+        :param iso_col: column in wb_bounds with the iso3 code, default is 'ISO_A3'
+        :type iso_col: string, optional
+        :param max_workers: number of processes to run, default is None (number of processors)
+        :type max_workers: int, optional
+        :param resume: skip countries already marked as complete in their output folder, default is True
+        :type resume: boolean, optional
+        :param run_kwargs: additional arguments passed to country_boundary.run_all
+        :type run_kwargs: dict, optional
+        :param cache: local cache of geoboundaries downloads shared by all workers
+        :type cache: class:`GOSTboundaries.geobounds_cache.geobounds_cache`, optional
+        :param prefetch_workers: number of concurrent geoboundaries downloads; 0 leaves downloading to each
+            worker process when it starts a country, default is 4
+        :type prefetch_workers: int, optional
+        :param geobounds_url: url template for the geoboundaries api
+        :type geobounds_url: string, optional
+        :return: consolidated comparison summary, one row per country
+        :rtype: pandas.DataFrame
+    '''
+    if isinstance(wb_bounds, str):
+        wb_bounds = open_source(wb_bounds, iso_col=iso_col)
+    if isinstance(wb_bounds, boundary_source):
+        source_sizes = wb_bounds.sizes()
+
+    all_res = []
+    to_run = []
+    for iso3 in iso3_list:
+        c_folder = out_folder.format(sel_iso3=iso3)
+        status = read_status(c_folder) if resume else None
+        if status is not None and status['status'] == 'complete':
+            all_res.append(status)
+            continue
+        # Schedule the largest countries first so they do not become the tail of the batch
+        if isinstance(wb_bounds, boundary_source):
+            sel_bounds = wb_bounds
+            n_vertices = int(source_sizes.get(iso3, 0))
+        else:
+            sel_bounds = wb_bounds.loc[wb_bounds[iso_col] == iso3]
+            n_vertices = int(shapely.get_num_coordinates(sel_bounds['geometry'].values).sum())
+        if n_vertices == 0:
+            all_res.append({'ISO3':iso3, 'status':'skipped', 'error':f'No features in {iso_col} for {iso3}'})
+            continue
+        to_run.append([n_vertices, iso3, sel_bounds, c_folder])
+    to_run.sort(key=lambda x: x[0], reverse=True)
+    if verbose:
+        tPrint(f"Running {len(to_run)} countries, {len(all_res)} already processed")
+
+    def write_summary():
+        summary = pd.DataFrame(all_res, columns=['ISO3'] + SUMMARY_COLUMNS + ['status', 'error'])
+        summary.to_csv(summary_file, index=False)
+        return(summary)
+
+    run_kwargs = {} if run_kwargs is None else dict(run_kwargs)
+    ntl_job = None
+    if run_kwargs.get('run_zonal', False) and run_kwargs.get('ntl_files') is None:
+        # the nighttime lights listing is the same for every country, search once for the whole batch
+        ntl_executor = ThreadPoolExecutor(max_workers=1)
+        ntl_job = ntl_executor.submit(ntl.aws_search_ntl)
+        ntl_executor.shutdown(wait=False)
+    if prefetch_workers > 0:
+        fetch = geobounds_fetcher(geobounds_url=geobounds_url, cache=cache)
+    else:
+        fetch = lambda iso3: ''
+    n_slots = os.cpu_count() if max_workers is None else max_workers
+    c_inputs = {iso3:[sel_bounds, c_folder] for n_vertices, iso3, sel_bounds, c_folder in to_run}
+
+    def record(status):
+        all_res.append(status)
+        if verbose:
+            tPrint(f"{status['ISO3']}: {status['status']}")
+        write_summary()
+
+    def collect(done):
+        for fut in done:
+            iso3 = futures.pop(fut)
+            try:
+                status = fut.result()
+            except Exception:
+                # the worker process died (ie - out of memory) before it could record its own status
+                status = {'ISO3':iso3, 'status':'failed', 'error':traceback.format_exc()}
+            record(status)
+
+    futures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for iso3, geo_job in prefetch([x[1] for x in to_run], fetch, max_workers=max(prefetch_workers, 1)):
+            sel_bounds, c_folder = c_inputs[iso3]
+            try:
+                geoBounds = geo_job.result()
+            except Exception:
+                status = {'ISO3':iso3, 'status':'failed', 'error':traceback.format_exc()}
+                write_status(c_folder, status)
+                record(status)
+                continue
+            if ntl_job is not None:
+                try:
+                    run_kwargs['ntl_files'] = ntl_job.result()
+                except Exception:
+                    # leave the search to each country, where the error is recorded in its status
+                    tPrint(f"Nighttime lights search failed: {traceback.format_exc()}")
+                ntl_job = None
+            fut = executor.submit(run_country, iso3, sel_bounds, wb_id_col, c_folder, geoBounds_id_col=geoBounds_id_col,
+                                    run_kwargs=run_kwargs, write_output=write_output, cache=cache, geoBounds=geoBounds,
+                                    geobounds_url=geobounds_url)
+            futures[fut] = iso3
+            # only fetch further countries once a worker is about to be free, so downloads wait in memory for
+            # at most one round of the pool
+            while len(futures) >= n_slots + 1:
+                done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(futures)[0])
+    return(write_summary())
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run boundary comparisons for a list of countries')
+    parser.add_argument('--wb_bounds', required=True, help='path to official World Bank boundaries, or a folder written by gostboundaries-partition')
+    parser.add_argument('--wb_id_col', required=True, help='column in wb_bounds with unique id')
+    parser.add_argument('--iso3', nargs='+', required=True, help='list of iso3 codes to process')
+    parser.add_argument('--out_folder', required=True, help='output folder template, {sel_iso3} is replaced by iso3')
+    parser.add_argument('--summary_file', required=True, help='path to consolidated summary csv')
+    parser.add_argument('--iso_col', default='ISO_A3', help='column in wb_bounds with iso3 code')
+    parser.add_argument('--geobounds_id_col', default='shapeID', help='column in geoboundaries with unique id')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--no_resume', action='store_true', help='rerun countries that are already complete')
+    parser.add_argument('--big_thresh', type=float, default=1000, help='maximum size of sliver to be merged')
+    parser.add_argument('--h3_summary', action='store_true', help='run the h3 summary for each country')
+    parser.add_argument('--h3_level', type=int, default=6, help='level of h3 grid to create')
+    parser.add_argument('--h3_stream', action='store_true', help='write the h3 grid to disk in chunks instead of holding it in memory')
+    parser.add_argument('--geobounds_cache', default=None, help='folder for a local cache of geoboundaries downloads')
+    parser.add_argument('--prefetch', type=int, default=4, help='number of concurrent geoboundaries downloads, 0 to download in each worker')
+    parser.add_argument('--offline', action='store_true', help='only use geoboundaries already in the cache')
+    parser.add_argument('--checkpoint', action='store_true', help='store the results of each stage so failed countries resume where they stopped')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(args)
+
+    run_kwargs = {'big_thresh':args.big_thresh, 'run_h3_summary':args.h3_summary, 'h3_level':args.h3_level, 'h3_stream':args.h3_stream,
+                    'checkpoint':args.checkpoint}
+    cache = None
+    if args.geobounds_cache is not None:
+        cache = geobounds_cache(args.geobounds_cache, offline=args.offline)
+    summary = run_batch(args.iso3, args.wb_bounds, args.wb_id_col, args.out_folder, args.summary_file,
+                            iso_col=args.iso_col, geoBounds_id_col=args.geobounds_id_col, max_workers=args.workers,
+                            resume=not args.no_resume, run_kwargs=run_kwargs, cache=cache, prefetch_workers=args.prefetch,
+                            verbose=args.verbose)
+    failed = summary.loc[summary['status'] == 'failed']
+    return(1 if failed.shape[0] > 0 else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
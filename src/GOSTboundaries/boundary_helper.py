@@ -1,9 +1,10 @@
-import sys, os, importlib, json
+import sys, os, importlib, json, hashlib
 import folium, shapely, rasterio
 
 import contextily as ctx
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 
@@ -12,27 +13,61 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 from h3 import h3
 from shapely.geometry import Polygon, Point, mapping
 from shapely.ops import unary_union
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from folium.plugins import VectorGridProtobuf
 
 import GOSTRocks.rasterMisc as rMisc
 import GOSTRocks.ntlMisc as ntl
 from GOSTRocks.misc import tPrint
 
+from GOSTboundaries.h3_helper import h3_cells, polyfill_cells, chunk_boxes, polyfill_box
+from GOSTboundaries.zonal import zonal_stats_multi
+from GOSTboundaries.instrument import stage_recorder, instrumented_stage
+from GOSTboundaries.checkpoint import checkpoint_store, checkpoint_key, column_hash, file_signature
+from GOSTboundaries.simplify import simplify_geometries, simplification_error, match_error
+from GOSTboundaries.incremental import diff_bounds, patch_rows
+from GOSTboundaries.tiles import write_vector_tiles
+from GOSTboundaries.render import add_basemap, draw_classes, read_esa_legend
+from GOSTboundaries.geobounds_cache import download_geobounds
+from GOSTboundaries.topology import build_edges, map_edges, compare_edges
+from GOSTboundaries.sources import boundary_source
+
 
 class country_boundary():
     ''' Compare and attribute various country boundaries
     
         :param iso3: 3-character iso3 string for country (ie - KEN for Kenya)
         :type iso3: string
-        :param official_wb_bounds: official bounds from the World Bank to be compared
-        :type official_wb_bounds: class:`geopandas.GeoDataFrame`
+        :param official_wb_bounds: official bounds from the World Bank to be compared, or a source of global 
+            bounds from which only the features of iso3 are read
+        :type official_wb_bounds: class:`geopandas.GeoDataFrame` or class:`GOSTboundaries.sources.boundary_source`
         :param official_id_col: name of column in official_wb_bounds with unique id
         :type official_id_col: string
+        :param geobounds_cache: local cache used by get_geobounds instead of downloading geoboundaries on every run, default is None
+        :type geobounds_cache: class:`GOSTboundaries.geobounds_cache.geobounds_cache`, optional
+        :param persist_unions: write the national dissolves of each dataset to out_folder so later runs on the 
+            same data do not recalculate them, default is False
+        :type persist_unions: boolean, optional
+        :param recorder: records time, memory and data sizes of each processing stage; by default a new 
+            stage_recorder without callbacks or profiling is created
+        :type recorder: class:`GOSTboundaries.instrument.stage_recorder`, optional
     '''
+    union_layers = ['wb_bounds', 'geoBounds', 'corrected_geo']
+    # attributes created by each stage of run_all, as stored in checkpoints
+    stage_outputs = {'match':['geoBounds'], 'slivers':['wb_sliver_df', 'big_slivers', 'corrected_geo'], 
+                        'h3':['h3_data'], 'zonal':['zonal_res', 'wb_mapped']}
+    
     def __init__(self, iso3, official_wb_bounds, official_id_col, out_folder = "/home/wb411133/projects/BOUNDARIES/{sel_iso3}", 
-                    geoBounds='', geoBounds_id_col = 'shapeID', verbose=False):
+                    geoBounds='', geoBounds_id_col = 'shapeID', verbose=False, geobounds_cache=None, persist_unions=False, recorder=None):
         self.iso3 = iso3
+        self.stage_recorder = stage_recorder() if recorder is None else recorder
+        self.geobounds_cache = geobounds_cache
+        self.unions = {}
+        self.geometry_hashes = {}
+        self.persist_unions = persist_unions
+        self.checkpoints = None
+        self.original_bounds = {}
         self.out_folder = out_folder.format(sel_iso3 = iso3)
         self.wb_id_col = official_id_col
         self.geoBounds_id_col = geoBounds_id_col
@@ -44,12 +79,85 @@ class country_boundary():
         else:
             self.geoBounds = self.get_geobounds()
         
+        if isinstance(official_wb_bounds, boundary_source):
+            official_wb_bounds = official_wb_bounds.read(iso3)
         self.wb_bounds = official_wb_bounds
         if self.wb_bounds.crs != self.geoBounds.crs:
             raise(ValueError("CRS do not match between Geoboundaris and official boundaries"))
         self.verbose=verbose
+    
+    @property
+    def wb_bounds(self):
+        return(self._wb_bounds)
+    
+    @wb_bounds.setter
+    def wb_bounds(self, value):
+        self._wb_bounds = value
+        self.geometry_hashes.pop('wb_bounds', None)
+    
+    @property
+    def geoBounds(self):
+        return(self._geoBounds)
+    
+    @geoBounds.setter
+    def geoBounds(self, value):
+        self._geoBounds = value
+        self.geometry_hashes.pop('geoBounds', None)
+    
+    @property
+    def corrected_geo(self):
+        return(self._corrected_geo)
+    
+    @corrected_geo.setter
+    def corrected_geo(self, value):
+        self._corrected_geo = value
+        self.geometry_hashes.pop('corrected_geo', None)
+    
+    def geometry_hash(self, layer):
+        ''' hash of the geometries in one of the union_layers; recalculated only after the layer is reassigned
+        
+            :param layer: name of attribute to hash, one of wb_bounds, geoBounds, corrected_geo
+            :type layer: string
+        '''
+        if not layer in self.geometry_hashes:
+            inD = getattr(self, layer)
+            wkb = shapely.to_wkb(np.asarray(inD['geometry']))
+            self.geometry_hashes[layer] = hashlib.sha1(b''.join(wkb)).hexdigest()
+        return(self.geometry_hashes[layer])
+    
+    def get_union(self, layer):
+        ''' return the national dissolve of one of the union_layers. Each dissolve is calculated once and 
+            reused until the geometries of the layer change; geometries edited in place are not detected, 
+            the layer needs to be reassigned (ie - self.wb_bounds = new_bounds)
+        
+            :param layer: name of attribute to dissolve, one of wb_bounds, geoBounds, corrected_geo
+            :type layer: string
+        '''
+        if not layer in self.union_layers:
+            raise(ValueError(f"{layer} is not one of {self.union_layers}"))
+        geom_hash = self.geometry_hash(layer)
+        cur_union = self.unions.get(layer)
+        if cur_union is not None and cur_union[0] == geom_hash:
+            return(cur_union[1])
+        
+        union_file = os.path.join(self.out_folder, 'unions', f'{layer}_{geom_hash}.wkb')
+        if self.persist_unions and os.path.exists(union_file):
+            with open(union_file, 'rb') as in_file:
+                union = shapely.from_wkb(in_file.read())
+        else:
+            if self.verbose:
+                tPrint(f"Dissolving {layer}")
+            union = getattr(self, layer).unary_union
+            if self.persist_unions:
+                if not os.path.exists(os.path.dirname(union_file)):
+                    os.makedirs(os.path.dirname(union_file))
+                with open(union_file, 'wb') as out_file:
+                    out_file.write(shapely.to_wkb(union))
+        self.unions[layer] = [geom_hash, union]
+        return(union)
             
-    def run_all(self, run_h3_summary=False, run_comparison=False, run_zonal=False, big_thresh=1000, h3_level=6,
+    def run_all(self, run_h3_summary=False, run_comparison=False, run_zonal=False, big_thresh=1000, h3_level=6, h3_match_method='strtree',
+                    checkpoint=False, simplify_tolerance=None, simplify_grid_size=None, ntl_files=None, h3_stream=False,
                     esa_dataset = "/home/public/Data/GLOBAL/LANDCOVER/GLOBCOVER/2015/ESACCI-LC-L4-LCCS-Map-300m-P1Y-2015-v2.0.7.tif",
                     esa_legend = "/home/public/Data/GLOBAL/LANDCOVER/GLOBCOVER/2015/GLOBCOVER_LEGEND.csv"
             ):
@@ -59,6 +167,12 @@ class country_boundary():
             :type run_h3_summary: boolean, optional
             :param h3_level: Level of h3 grid to create, default is 6
             :type h3_level: int, optional
+            :param h3_match_method: method used by match_datasets to attach boundary IDs to the h3 grid; 'centroid' 
+                is much faster and only differs from 'strtree' in the percentages of cells inside one admin (1.0), default is 'strtree'
+            :type h3_match_method: string, optional
+            :param h3_stream: generate the h3 grid in chunks written to out_folder/h3_stream with stream_h3_grid, 
+                instead of holding it in h3_data, default is False
+            :type h3_stream: boolean, optional
             
             :param run_comparison: Run sliver comparison between boundary1 and boundary2, defaults is False
             :type run_comparison: boolean, optional
@@ -71,71 +185,356 @@ class country_boundary():
             :type esa_dataset: string, optional
             :param esa_legend: path to csv describing ESA landcover datasets, default is JNB local
             :type esa_legend: string, optional 
+            :param ntl_files: listing of nighttime lights files from ntl.aws_search_ntl, default is None (searched 
+                on every run); batch runs search once and pass the listing to every country
+            :type ntl_files: list of strings, optional
+            
+            :param checkpoint: store the results of each stage in out_folder/checkpoints, keyed by a hash of the 
+                stage inputs and parameters; stages with unchanged inputs are loaded instead of rerun, default is False
+            :type checkpoint: boolean, optional
+            
+            :param simplify_tolerance: simplify both input boundaries with this tolerance before any other stage 
+                (see simplify_inputs), default is None (no simplification)
+            :type simplify_tolerance: float, optional
+            :param simplify_grid_size: snap the simplified boundaries to a precision grid of this size, default is None
+            :type simplify_grid_size: float, optional
         
         '''
+        if (simplify_tolerance is not None or simplify_grid_size is not None) and len(self.original_bounds) == 0:
+            self.simplify_inputs(tolerance=simplify_tolerance, grid_size=simplify_grid_size)
+        self.checkpoints = checkpoint_store(os.path.join(self.out_folder, 'checkpoints')) if checkpoint else None
+        self.run_params = {'big_thresh':big_thresh, 'h3_level':h3_level, 'h3_match_method':h3_match_method, 'zonal_inputs':[]}
+        if run_zonal:
+            if ntl_files is None:
+                ntl_files = ntl.aws_search_ntl()
+            inL = pd.read_csv(esa_legend, quotechar='"')
+            # Define the raster datasets to summarize within the admin boundaries
+            file_defs = [
+                [ntl_files[-1], 'NTL', 'N'],
+                [esa_dataset, 'LC', 'C', inL['Value'].values],
+            ]
+            self.zonal_defs = file_defs
+            self.run_params['zonal_inputs'] = [file_signature(ntl_files[-1]), file_signature(esa_dataset), file_signature(esa_legend)]
+        # identify the input datasets by their geometries and ids; hashing them is only needed for checkpoints
+        stage_keys = self.stage_keys(**self.run_params) if checkpoint else {}
+        
         if not "geo_match_id" in self.geoBounds.columns:
-            # Attach medium resolution ID to high resolution dataset
-            self.geoBounds = self.match_datasets(self.geoBounds, self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Matching bounds2 to bounds 1")
+            if not self.restore_checkpoint('match', stage_keys.get('match')):
+                # Attach medium resolution ID to high resolution dataset
+                self.geoBounds = self.match_datasets(self.geoBounds, self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Matching bounds2 to bounds 1")
+                self.save_checkpoint('match', stage_keys.get('match'), self.stage_outputs['match'])
 
         # map difference between boundary 1 and boundary 2
         if run_comparison:
-            xx = self.generate_boundary_difference(big_thresh=big_thresh)
+            if not self.restore_checkpoint('slivers', stage_keys.get('slivers')):
+                xx = self.generate_boundary_difference(big_thresh=big_thresh)
+                self.save_checkpoint('slivers', stage_keys.get('slivers'), self.stage_outputs['slivers'])
         
-        if run_h3_summary:
-            try:
-                h3_shape = self.h3_data.shape
-            except:
-                bounds1 = self.wb_bounds
-                bounds2 = self.geoBounds
-                
+        if run_h3_summary and h3_stream:
+            if not hasattr(self, 'h3_summary'):
+                self.stream_h3_grid(level=h3_level, method=h3_match_method)
+        elif run_h3_summary:
+            if not hasattr(self, 'h3_data') and not self.restore_checkpoint('h3', stage_keys.get('h3')):
                 # Generate h3 grid
                 h3_data = self.generate_h3_grid(level=h3_level)
-                # Attach medium resolution IDs to h3 grid
-                h3_data = self.match_datasets(h3_data, bounds1, 'shape_id', self.wb_id_col, label="Matching h3 to bounds 1")
-                h3_data.columns = ['geometry', 'shape_id', 'med_id', 'med_per'] 
-                # Attach high resolution IDs to h3 grid
-                h3_data = self.match_datasets(h3_data, bounds2, 'shape_id', "geo_match_id", label="Matching h3 to bounds 2")
-                self.h3_data = h3_data
+                self.h3_data = self.match_h3(h3_data, method=h3_match_method)
+                self.save_checkpoint('h3', stage_keys.get('h3'), self.stage_outputs['h3'])
             
         if run_zonal:
-            ntl_files = ntl.aws_search_ntl()
-            inR = rasterio.open(esa_dataset)
-            inL = pd.read_csv(esa_legend, quotechar='"')
-            # Define the raster datasets to summarize within the admin boundaries
-            file_defs = [
-                [ntl_files[-1], 'NTL', 'N'],
-                [inR, 'LC', 'C', inL['Value'].values],
-            ]
-            zonal_res = self.run_zonal(file_defs, z_geoB=True, z_wbB=True, z_corB=False)
-            # Join the zonal res to the WB coarse boundaries
-            wb_mapped = self.wb_bounds.copy()
-            wb_mapped['NTL'] = zonal_res['NTL']['wbB']['NTL_SUM']
+            if not self.restore_checkpoint('zonal', stage_keys.get('zonal')):
+                self.zonal_res = self.run_zonal(self.zonal_defs, z_geoB=True, z_wbB=True, z_corB=False)
+                self.wb_mapped = self.map_zonal_results()
+                self.save_checkpoint('zonal', stage_keys.get('zonal'), self.stage_outputs['zonal'])
+    
+    def stage_keys(self, big_thresh=1000, h3_level=6, h3_match_method='strtree', zonal_inputs=[]):
+        ''' checkpoint keys of each stage of run_all for the current boundaries and the given parameters
+        
+            :param zonal_inputs: signatures of the raster and legend files summarized in the zonal stage
+            :type zonal_inputs: list of strings, optional
+            :return: key of each stage
+            :rtype: dict
+        '''
+        wb_key = [self.geometry_hash('wb_bounds'), self.wb_id_col, column_hash(self.wb_bounds, self.wb_id_col)]
+        geo_key = [self.geometry_hash('geoBounds'), self.geoBounds_id_col, column_hash(self.geoBounds, self.geoBounds_id_col)]
+        return({'match':checkpoint_key(wb_key, geo_key),
+                'slivers':checkpoint_key(wb_key, geo_key, big_thresh),
+                'h3':checkpoint_key(wb_key, geo_key, h3_level, h3_match_method),
+                'zonal':checkpoint_key(wb_key, geo_key, *zonal_inputs)})
+    
+    @instrumented_stage('update_wb_bounds', inputs=lambda self: [self.wb_bounds])
+    def update_wb_bounds(self, new_wb_bounds):
+        ''' Replace the official boundaries with an edited version and update the results of run_all without 
+            rerunning it. Features are compared by id and geometry hash; only geoBounds and h3 cells intersecting 
+            an added, removed or edited WB unit are rematched, and zonal statistics are only recalculated for the 
+            edited WB units and new h3 cells. Slivers are left as they are if the national boundary did not change, 
+            otherwise they are regenerated for the whole country. Updated stages are stored in self.checkpoints.
+        
+            :param new_wb_bounds: new version of the official bounds, with the same id column and crs
+            :type new_wb_bounds: class:`geopandas.GeoDataFrame`
+            :return: ids of added, removed, changed and unchanged WB units
+            :rtype: dict of lists
+        '''
+        if new_wb_bounds.crs != self.geoBounds.crs:
+            raise(ValueError("CRS do not match between Geoboundaris and official boundaries"))
+        if hasattr(self, 'zonal_res') and getattr(self, 'zonal_defs', None) is None:
+            raise(ValueError("zonal_res cannot be updated without the raster definitions used to create it (self.zonal_defs)"))
+        old_wb = self.wb_bounds
+        diff = diff_bounds(old_wb, new_wb_bounds, self.wb_id_col)
+        if self.verbose:
+            tPrint(f"Updating WB bounds: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed")
+        if len(diff['added']) + len(diff['removed']) + len(diff['changed']) == 0:
+            self.wb_bounds = new_wb_bounds
+            return(diff)
+        
+        old_geoms = np.asarray(old_wb['geometry'])[old_wb[self.wb_id_col].isin(diff['removed'] + diff['changed']).values]
+        new_geoms = np.asarray(new_wb_bounds['geometry'])[new_wb_bounds[self.wb_id_col].isin(diff['added'] + diff['changed']).values]
+        edited_geoms = np.concatenate([old_geoms, new_geoms])
+        # the national boundary only changes if the edited units cover a different area
+        boundary_changed = not shapely.equals(shapely.union_all(old_geoms), shapely.union_all(new_geoms))
+        old_union = self.unions.get('wb_bounds')
+        self.wb_bounds = new_wb_bounds
+        if not boundary_changed and old_union is not None:
+            self.unions['wb_bounds'] = [self.geometry_hash('wb_bounds'), old_union[1]]
+        
+        # Rematch the geoBounds intersecting any edited WB unit
+        relabelled = np.array([], dtype=int)
+        if "geo_match_id" in self.geoBounds.columns:
+            geo_geoms = np.asarray(self.geoBounds['geometry'])
+            sel = np.unique(shapely.STRtree(geo_geoms).query(edited_geoms, predicate='intersects')[1])
+            sub = self.geoBounds.iloc[sel].loc[:,[self.geoBounds_id_col, 'geometry']].copy()
+            sub = self.match_datasets(sub, self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Rematching edited bounds")
+            geoBounds = self.geoBounds.copy()
+            match_id = geoBounds['geo_match_id'].values.astype(object)
+            match_per = geoBounds['geo_match_per'].values.astype(float)
+            relabelled = sel[match_id[sel].astype(str) != sub['geo_match_id'].values.astype(str)]
+            match_id[sel] = sub['geo_match_id'].values
+            match_per[sel] = sub['geo_match_per'].values
+            geoBounds['geo_match_id'] = pd.to_numeric(pd.Series(match_id, index=geoBounds.index), errors='ignore')
+            geoBounds['geo_match_per'] = match_per
+            self.geoBounds = geoBounds
+        
+        # Slivers are the parts of the national boundary outside the geoBounds
+        if hasattr(self, 'corrected_geo'):
+            if boundary_changed:
+                self.generate_boundary_difference(big_thresh=self.run_params['big_thresh'] if hasattr(self, 'run_params') else 1000)
+            elif "geo_match_id" in self.geoBounds.columns:
+                corrected_geo = self.corrected_geo.copy()
+                corrected_geo['geo_match_id'] = self.geoBounds['geo_match_id'].values
+                corrected_geo['geo_match_per'] = self.geoBounds['geo_match_per'].values
+                self.corrected_geo = corrected_geo
+        
+        new_cells = []
+        if hasattr(self, 'h3_data'):
+            new_cells = self.update_h3_data(edited_geoms, self.geoBounds.iloc[relabelled])
+        if hasattr(self, 'zonal_res'):
+            self.update_zonal(old_wb, diff, new_cells, boundary_changed)
+        
+        if getattr(self, 'checkpoints', None) is not None and hasattr(self, 'run_params'):
+            stage_keys = self.stage_keys(**self.run_params)
+            for stage, attrs in self.stage_outputs.items():
+                if all(hasattr(self, x) for x in attrs):
+                    self.save_checkpoint(stage, stage_keys[stage], attrs)
+        return(diff)
+    
+    def update_h3_data(self, edited_geoms, relabelled_geo):
+        ''' update self.h3_data after edits to the WB bounds. Cells whose centres are in an edited area are 
+            removed and the edited area is filled again, so the grid matches polyfill of the new national boundary; 
+            new cells, and existing cells intersecting an edited WB unit or a relabelled geoBounds, are rematched
+        
+            :param edited_geoms: old and new geometries of every added, removed or edited WB unit
+            :type edited_geoms: numpy.array of shapely geometries
+            :param relabelled_geo: geoBounds features whose matched WB id changed
+            :type relabelled_geo: class:`geopandas.GeoDataFrame`
+            :return: ids of the h3 cells added to the grid
+            :rtype: list of strings
+        '''
+        h3_data = self.h3_data
+        level = self.h3_cells.level if hasattr(self, 'h3_cells') else self.run_params['h3_level']
+        method = self.run_params['h3_match_method'] if hasattr(self, 'run_params') else 'strtree'
+        edited_area = shapely.union_all(edited_geoms)
+        shapely.prepare(edited_area)
+        
+        cells = h3_cells(np.array([int(x, 16) for x in h3_data.index], dtype=np.uint64), level)
+        centres = cells.centroids()
+        keep = h3_data.loc[~shapely.contains(edited_area, centres)]
+        # Fill the edited area with cells whose centres are inside the new national boundary
+        wb_geoms = np.asarray(self.wb_bounds['geometry'])
+        sel_wb = shapely.STRtree(wb_geoms).query(edited_area, predicate='intersects')
+        fill_area = shapely.intersection(shapely.union_all(wb_geoms[sel_wb]), edited_area)
+        added = polyfill_cells(fill_area, level).to_geodataframe()
+        added = added.loc[~added.index.isin(keep.index)]
+        
+        rematch_geoms = np.concatenate([edited_geoms, np.asarray(relabelled_geo['geometry'])])
+        rematch = np.unique(shapely.STRtree(np.asarray(keep['geometry'])).query(rematch_geoms, predicate='intersects')[1])
+        to_match = pd.concat([keep.iloc[rematch].loc[:,['geometry', 'shape_id']], added])
+        matched = self.match_h3(gpd.GeoDataFrame(to_match, geometry='geometry', crs=h3_data.crs), method=method)
+        
+        h3_data = pd.concat([keep.drop(keep.index[rematch]), matched])
+        self.h3_data = gpd.GeoDataFrame(h3_data, geometry='geometry', crs=matched.crs)
+        self.h3_grid = self.h3_data.loc[:,['geometry', 'shape_id']]
+        self.h3_cells = h3_cells(np.array([int(x, 16) for x in self.h3_data.index], dtype=np.uint64), level)
+        return(added.index.tolist())
+    
+    def update_zonal(self, old_wb, diff, new_cells, boundary_changed):
+        ''' update self.zonal_res and self.wb_mapped after edits to the WB bounds, summarizing self.zonal_defs 
+            only within the added and edited WB units, the new h3 cells, and the corrected geoBounds if the 
+            national boundary changed; results for the geoBounds are unchanged
+        '''
+        first = list(self.zonal_res.values())[0]
+        wb_ids = self.wb_bounds[self.wb_id_col].values
+        recalc_wb = self.wb_bounds[self.wb_id_col].isin(diff['added'] + diff['changed']).values
+        zone_layers = {}
+        if 'wbB' in first:
+            zone_layers['wbB'] = self.wb_bounds.loc[recalc_wb]
+        if 'corB' in first and boundary_changed:
+            zone_layers['corB'] = self.corrected_geo
+        if 'h3' in first:
+            zone_layers['h3'] = self.h3_grid.loc[new_cells]
+        new_res = self.run_zonal_layers(self.zonal_defs, {x:y for x, y in zone_layers.items() if y.shape[0] > 0})
+        for name, cur_res in self.zonal_res.items():
+            # layers without any features to recalculate are not summarized
+            recalc = {x:new_res.get(name, {}).get(x, cur_res[x].iloc[:0]) for x in zone_layers.keys()}
+            if 'wbB' in cur_res:
+                cur_res['wbB'] = patch_rows(cur_res['wbB'], old_wb[self.wb_id_col].values, recalc['wbB'], wb_ids[recalc_wb], wb_ids)
+            if 'corB' in zone_layers:
+                cur_res['corB'] = recalc['corB']
+            if 'h3' in cur_res:
+                cur_res['h3'] = patch_rows(cur_res['h3'], self.zonal_h3_ids, recalc['h3'], new_cells, self.h3_grid.index)
+        if 'h3' in first:
+            self.zonal_h3_ids = self.h3_grid.index.tolist()
+        if hasattr(self, 'wb_mapped'):
+            self.wb_mapped = self.map_zonal_results()
+        return(self.zonal_res)
+    
+    def restore_checkpoint(self, stage, key):
+        ''' load the outputs of a stage from self.checkpoints and attach them to the country_boundary
+        
+            :return: True if the stage was restored, False if it needs to be run
+            :rtype: boolean
+        '''
+        if getattr(self, 'checkpoints', None) is None or key is None:
+            return(False)
+        data = self.checkpoints.load(stage, key)
+        if data is None:
+            return(False)
+        if self.verbose:
+            tPrint(f"Restoring {stage} from checkpoint {key}")
+        for attr, value in data.items():
+            setattr(self, attr, value)
+        return(True)
+    
+    def save_checkpoint(self, stage, key, attrs):
+        ''' store the listed attributes as the outputs of a stage in self.checkpoints; nothing is stored without a key
+        '''
+        if getattr(self, 'checkpoints', None) is None or key is None:
+            return(None)
+        return(self.checkpoints.save(stage, key, {x: getattr(self, x) for x in attrs}))
+    
+    @instrumented_stage('simplify_inputs', inputs=lambda self: [self.wb_bounds, self.geoBounds])
+    def simplify_inputs(self, tolerance=0.0005, grid_size=None, layers=['wb_bounds', 'geoBounds'], evaluate_matching=False):
+        ''' Reduce the vertices of the input boundaries before matching and comparison. Geometries are simplified 
+            with topology preserving simplification and optionally snapped to a precision grid; the original 
+            datasets are kept in self.original_bounds, and every call simplifies from the originals. Features are 
+            simplified independently, so shared edges can separate by up to tolerance - fine for matching IDs, 
+            but slivers from generate_boundary_difference will include these gaps.
+        
+            :param tolerance: maximum distance an edge can move, in units of the boundaries crs, default is 0.0005 (~50m in degrees)
+            :type tolerance: float, optional
+            :param grid_size: size of the precision grid vertices are snapped to, default is None (no snapping)
+            :type grid_size: float, optional
+            :param layers: datasets to simplify, default is ['wb_bounds', 'geoBounds']
+            :type layers: list of strings, optional
+            :param evaluate_matching: match geoBounds to wb_bounds using both the original and simplified datasets 
+                and report the differences in matched IDs; this runs the full original matching, default is False
+            :type evaluate_matching: boolean, optional
+            :return: vertices and area change for each layer; with evaluate_matching, the matching errors are 
+                reported in the geoBounds row
+            :rtype: class:`pandas.DataFrame`
+        '''
+        all_res = []
+        for layer in layers:
+            if not layer in self.original_bounds:
+                self.original_bounds[layer] = getattr(self, layer)
+            original = self.original_bounds[layer]
+            simple = simplify_geometries(original, tolerance, grid_size)
+            if layer == 'geoBounds':
+                # matches to the original geometries are no longer valid
+                simple = simple.drop([x for x in ['geo_match_id', 'geo_match_per'] if x in simple.columns], axis=1)
+            setattr(self, layer, simple)
+            res = simplification_error(original, simple)
+            res['layer'] = layer
+            all_res.append(res)
+            if self.verbose:
+                tPrint(f"Simplified {layer}: {res['vertices']} to {res['vertices_simplified']} vertices")
+        report = pd.DataFrame(all_res).set_index('layer')
+        
+        if evaluate_matching:
+            sel_cols = [self.geoBounds_id_col, 'geometry']
+            orig_wb = self.original_bounds.get('wb_bounds', self.wb_bounds)
+            orig_geo = self.original_bounds.get('geoBounds', self.geoBounds)
+            orig_match = self.match_datasets(orig_geo.loc[:,sel_cols].copy(), orig_wb, self.geoBounds_id_col, self.wb_id_col, label="Matching original bounds")
+            simple_match = self.match_datasets(self.geoBounds.loc[:,sel_cols].copy(), self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Matching simplified bounds")
+            for key, value in match_error(orig_match, simple_match, self.geoBounds_id_col).items():
+                report.loc['geoBounds', key] = value
+        self.simplification_report = report
+        return(report)
+    
+    def match_h3(self, h3_grid, method='strtree', indexes=None):
+        ''' attach the WB ids (med_id, med_per) and the WB ids matched to geoBounds (geo_match_id, geo_match_per) to an h3 grid
+        
+            :param h3_grid: h3 cells with geometry and shape_id columns
+            :type h3_grid: class:`geopandas.GeoDataFrame`
+            :param method: matching engine passed to match_datasets, default is 'strtree'
+            :type method: string, optional
+            :param indexes: spatial indexes of wb_bounds and geoBounds from spatial_index, keyed by layer name, 
+                reused when matching many h3 grids; default is None (indexes are built for each grid)
+            :type indexes: dict, optional
+        '''
+        indexes = {} if indexes is None else indexes
+        # Attach medium resolution IDs to h3 grid
+        h3_data = self.match_datasets(h3_grid, self.wb_bounds, 'shape_id', self.wb_id_col, label="Matching h3 to bounds 1", method=method,
+                                        index=indexes.get('wb_bounds'))
+        h3_data.columns = ['geometry', 'shape_id', 'med_id', 'med_per'] 
+        # Attach high resolution IDs to h3 grid
+        h3_data = self.match_datasets(h3_data, self.geoBounds, 'shape_id', "geo_match_id", label="Matching h3 to bounds 2", method=method,
+                                        index=indexes.get('geoBounds'))
+        return(h3_data)
+    
+    def map_zonal_results(self):
+        ''' join the NTL and landcover summaries in self.zonal_res to the WB bounds, and compare them to the 
+            summaries of the matched geoBounds
+        '''
+        zonal_res = self.zonal_res
+        # Join the zonal res to the WB coarse boundaries
+        wb_mapped = self.wb_bounds.copy()
+        wb_mapped['NTL'] = zonal_res['NTL']['wbB']['NTL_SUM'].values
 
-            wb_high = self.geoBounds.copy()
-            wb_high['NTL_High'] = zonal_res['NTL']['geoB']['NTL_SUM'].values
+        wb_high = self.geoBounds.copy()
+        wb_high['NTL_High'] = zonal_res['NTL']['geoB']['NTL_SUM'].values
 
-            # Identify the major landcover class 
-            wb_mapped['LC_MAX']    = zonal_res['LC']['wbB'].apply(lambda x: x.idxmax(), axis=1)
-            wb_high['LC_MAX_High'] = zonal_res['LC']['geoB'].apply(lambda x: x.idxmax(), axis=1).values
-            
-            wb_mapped = wb_mapped.merge(wb_high.loc[:,['geo_match_id', 'NTL_High', 'LC_MAX_High']], left_on=self.wb_id_col, right_on='geo_match_id')
-            # Determine % different in nighttime lights brightness
-            wb_mapped['PER_NTL'] = wb_mapped.apply(lambda x: (x['NTL_High'] - x['NTL'])/x['NTL'], axis=1)
-            # Determine the major Landcover class in the input dataset
-            wb_mapped['LC_Match'] = wb_mapped.apply(lambda x: x['LC_MAX'] == x['LC_MAX_High'], axis=1)
-            wb_mapped['LC_MAX'] = wb_mapped['LC_MAX'].astype(str)
-            wb_mapped['LC_MAX_High'] = wb_mapped['LC_MAX'].astype(str)
-            crs = wb_mapped.crs
-            wb_mapped = wb_mapped.apply(pd.to_numeric, errors='ignore')
-            
-            self.wb_mapped = gpd.GeoDataFrame(wb_mapped, geometry='geometry', crs=crs)
+        # Identify the major landcover class 
+        wb_mapped['LC_MAX']    = zonal_res['LC']['wbB'].apply(lambda x: x.idxmax(), axis=1).values
+        wb_high['LC_MAX_High'] = zonal_res['LC']['geoB'].apply(lambda x: x.idxmax(), axis=1).values
+        
+        wb_mapped = wb_mapped.merge(wb_high.loc[:,['geo_match_id', 'NTL_High', 'LC_MAX_High']], left_on=self.wb_id_col, right_on='geo_match_id')
+        # Determine % different in nighttime lights brightness
+        wb_mapped['PER_NTL'] = wb_mapped.apply(lambda x: (x['NTL_High'] - x['NTL'])/x['NTL'], axis=1)
+        # Determine the major Landcover class in the input dataset
+        wb_mapped['LC_Match'] = wb_mapped.apply(lambda x: x['LC_MAX'] == x['LC_MAX_High'], axis=1)
+        wb_mapped['LC_MAX'] = wb_mapped['LC_MAX'].astype(str)
+        wb_mapped['LC_MAX_High'] = wb_mapped['LC_MAX'].astype(str)
+        crs = wb_mapped.crs
+        wb_mapped = wb_mapped.apply(pd.to_numeric, errors='ignore')
+        return(gpd.GeoDataFrame(wb_mapped, geometry='geometry', crs=crs))
     
     def ntl_summary(self, table_label = 'Number of districts with NTL change (medium to high)',
                           thresholds = [-1, -0.10, -0.02, 0.02, 0.10, 0.50, 1, 100], 
                           labels = ['< -10%',  '-10% to -2%', "No change", "2% to 10%", '10% to 50%', "50% to 100%", "> 100%"],
                           colors = ['#0571B0','#63A9CF',     '#F7F7F7',   "#F5A683",   "#D7604D"   , "#B3172B"    , "#67001F"],
-                          legend_loc='upper right'):
+                          legend_loc='upper right', basemap=None):
         '''
+            :param basemap: contextily tile provider for the background, False for no basemap, default is render.BASEMAP
+            :type basemap: xyzservices.TileProvider, optional
         '''                
         ntl_change = self.wb_mapped.copy()        
         ntl_change[table_label] = pd.cut(ntl_change['PER_NTL'], thresholds, labels=labels)
@@ -150,64 +549,164 @@ class country_boundary():
             ntl_change = ntl_change.to_crs(proj)            
         #divider = make_axes_locatable(ax)
         #cax = divider.append_axes("right", size="5%", pad=0.1)
-        all_labels = []
-        for ctype, data in ntl_change.groupby(table_label)    :
-            color = color_dict[ctype]
-            if data.shape[0] > 0:
-                data.plot(color=color, ax=ax, label=ctype, linewidth=0.2)
-                cur_patch = mpatches.Patch(color=color, label=f'{ctype} [{data.shape[0]}]')
-                all_labels.append(cur_patch)
+        all_labels = draw_classes(ax, ntl_change, table_label, color_dict, linewidth=0.2)
 
-        ctx.add_basemap(ax, source=ctx.providers.Stamen.TonerBackground, crs=proj) #zorder=-10, 'EPSG:4326'
+        add_basemap(ax, proj, source=basemap)
         ax.legend(handles=all_labels, loc=legend_loc)
         ax = ax.set_axis_off()
                 
         return([ax, ntl_change.groupby([table_label])['OBJECTID'].count()])
     
-    def get_geobounds(self, geobounds_url = 'https://www.geoboundaries.org/api/current/gbOpen/{iso3}/ADM{lvl}/', lvl=2):
-        ''' access the geoboundaries al the defined level
+    @instrumented_stage('get_geobounds')
+    def get_geobounds(self, geobounds_url = 'https://www.geoboundaries.org/api/current/{release}/{iso3}/ADM{lvl}/', lvl=2, release='gbOpen'):
+        ''' access the geoboundaries al the defined level; if the country_boundary has a geobounds_cache
+            the boundaries are read from the cache when they are current
         
-            :param geobounds_url: url path to download geobounds from github, defaults to 'https://www.geoboundaries.org/api/current/gbOpen/{iso3}/ADM{lvl}/'
+            :param geobounds_url: url path to download geobounds from github, defaults to 'https://www.geoboundaries.org/api/current/{release}/{iso3}/ADM{lvl}/'
             :type geobounds_url: string, optional
             :param lvl: admin boundary to download, defaults to 2
             :type lvl: int, optional
+            :param release: geoboundaries release type, defaults to gbOpen
+            :type release: string, optional
         '''
+        if self.geobounds_cache is not None:
+            return(self.geobounds_cache.get(self.iso3, lvl=lvl, release=release, geobounds_url=geobounds_url))
         # Download adm2 from geoboundaries
-        response = urlopen(geobounds_url.format(iso3=self.iso3,lvl=lvl))
-        data_json = json.loads(response.read())
-        adm2_url = data_json['gjDownloadURL']
-
-        geoBounds = gpd.read_file(adm2_url)
-        geoBounds.to_crs(4326)
-        return(geoBounds)
+        return(download_geobounds(self.iso3, lvl=lvl, release=release, geobounds_url=geobounds_url))
         
-    def generate_h3_grid(self, level=6):
+    @instrumented_stage('generate_h3_grid', inputs=lambda self: [self.wb_bounds])
+    def generate_h3_grid(self, level=6, lazy=False):
         ''' Create the h3 hexabin grid for the selected admin datasets; join the admin datasets 
+        
+            :param level: h3 resolution of the grid, default is 6
+            :type level: int, optional
+            :param lazy: return the compact grid of h3 indexes (h3_cells) without creating polygons, default is False
+            :type lazy: boolean, optional
         '''
-        try:
-            del final_hexs
-        except:
-            pass
-
-        for cPoly in (self.wb_bounds.unary_union):
-            all_hexs = list(h3.polyfill(cPoly.__geo_interface__, level, geo_json_conformant=True))
-            try:        
-                final_hexs = final_hexs + all_hexs
-            except:
-                final_hexs = all_hexs
-                
-            final_hexs = list(set(final_hexs))
-            
-        hex_poly = lambda hex_id: Polygon(h3.h3_to_geo_boundary(hex_id, geo_json=True))
-        all_polys = gpd.GeoSeries(list(map(hex_poly, final_hexs)), index=final_hexs, crs="EPSG:4326")
-        all_polys = gpd.GeoDataFrame(all_polys, crs=4326, columns=['geometry'])
-        all_polys['shape_id'] = list(all_polys.index)
+        self.h3_cells = polyfill_cells(self.get_union('wb_bounds'), level)
+        if lazy:
+            return(self.h3_cells)
         
+        all_polys = self.h3_cells.to_geodataframe()
         self.h3_grid = all_polys
         
         return(all_polys)
 
         
+    @instrumented_stage('generate_h3_hierarchy', inputs=lambda self: [self.wb_bounds, self.geoBounds])
+    def generate_h3_hierarchy(self, start_level=5, max_level=10, method='centroid', tolerance=1e-9):
+        ''' Create a multi-resolution h3 grid of the disagreements between the datasets. The country is covered 
+            with cells at start_level; cells that straddle an admin boundary in either dataset are replaced by 
+            their children at the next level, down to max_level. Cells entirely within one WB admin and one 
+            geoBounds admin are uniform, so they are kept at their level whether or not the IDs agree.
+        
+            :param start_level: h3 resolution of the initial grid, default is 5
+            :type start_level: int, optional
+            :param max_level: finest h3 resolution; cells still straddling a boundary at this level are kept, default is 10
+            :type max_level: int, optional
+            :param method: matching engine passed to match_datasets, default is 'centroid'
+            :type method: string, optional
+            :param tolerance: cells covered by a single admin to within this fraction of their area, in both datasets, 
+                are uniform; it absorbs rounding error in the intersection areas, default is 1e-9
+            :type tolerance: float, optional
+            :return: cells of all levels with columns shape_id, level, med_id, med_per, geo_match_id, geo_match_per 
+                and h3_match (med_id == geo_match_id)
+            :rtype: class:`geopandas.GeoDataFrame`
+        '''
+        if not "geo_match_id" in self.geoBounds.columns:
+            self.geoBounds = self.match_datasets(self.geoBounds, self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Matching bounds2 to bounds 1")
+        # include the neighbours of the initial cells, so cells along the border whose centres are outside the 
+        #   country are evaluated as well
+        cells = polyfill_cells(self.get_union('wb_bounds'), start_level).neighbours(1)
+        all_res = []
+        for level in range(start_level, max_level + 1):
+            if len(cells) == 0:
+                break
+            if self.verbose:
+                tPrint(f"Evaluating {len(cells)} h3 cells at level {level}")
+            cur_res = self.match_h3(cells.to_geodataframe(), method=method)
+            # drop cells outside the WB bounds
+            inside = cur_res['med_id'].astype(str) != ''
+            cur_res = cur_res.loc[inside]
+            straddle = ((cur_res['med_per'] < 1 - tolerance) | (cur_res['geo_match_per'] < 1 - tolerance)).values
+            if level < max_level:
+                final = cur_res.loc[~straddle]
+                cells = h3_cells(np.array([int(x, 16) for x in cur_res.index[straddle]], dtype=np.uint64), level).children(level + 1)
+            else:
+                final = cur_res
+            final = final.copy()
+            final['level'] = level
+            all_res.append(final)
+        
+        h3_hierarchy = pd.concat(all_res)
+        h3_hierarchy['h3_match'] = h3_hierarchy['med_id'].astype(str).values == h3_hierarchy['geo_match_id'].astype(str).values
+        h3_hierarchy = h3_hierarchy.loc[:,['geometry', 'shape_id', 'level', 'med_id', 'med_per', 'geo_match_id', 'geo_match_per', 'h3_match']]
+        self.h3_hierarchy = gpd.GeoDataFrame(h3_hierarchy, geometry='geometry', crs=4326)
+        return(self.h3_hierarchy)
+        
+    @instrumented_stage('stream_h3_grid', inputs=lambda self: [self.wb_bounds, self.geoBounds])
+    def stream_h3_grid(self, level=7, method='centroid', out_folder=None, chunk_cells=250000):
+        ''' Generate and match the h3 grid one spatial chunk at a time, for grids too large to hold in memory 
+            (ie - level 7 and finer for large countries). The matched cells of each chunk are written to a 
+            GeoParquet part file and only running counts are kept, so memory does not grow with the grid; the 
+            cells are not stored in h3_data. Read the parts with read_h3_stream
+        
+            :param level: h3 resolution of the grid, default is 7
+            :type level: int, optional
+            :param method: matching engine passed to match_datasets, default is 'centroid'
+            :type method: string, optional
+            :param out_folder: folder for the part files, default is out_folder/h3_stream; existing parts are replaced
+            :type out_folder: string, optional
+            :param chunk_cells: approximate number of cells in each chunk, default is 250000
+            :type chunk_cells: int, optional
+            :return: number of cells, cells matched to the same WB id in both datasets (matched) or to a different 
+                id (mismatched), and cells without a geoBounds match (no_geo_match). Counts per WB admin are 
+                stored in h3_admin_summary
+            :rtype: dict
+        '''
+        out_folder = os.path.join(self.out_folder, 'h3_stream') if out_folder is None else out_folder
+        if not os.path.exists(out_folder):
+            os.makedirs(out_folder)
+        for old_file in os.listdir(out_folder):
+            if old_file.startswith('part-'):
+                os.remove(os.path.join(out_folder, old_file))
+        union = self.get_union('wb_bounds')
+        shapely.prepare(union)
+        # the admin layers are indexed once and shared by all chunks
+        indexes = {'wb_bounds':self.spatial_index(self.wb_bounds), 'geoBounds':self.spatial_index(self.geoBounds)}
+        summary = {'level':level, 'cells':0, 'matched':0, 'mismatched':0, 'no_geo_match':0}
+        admin_summary = pd.DataFrame(columns=['cells', 'mismatched'], dtype='int64')
+        n_parts = 0
+        for box in chunk_boxes(union.bounds, level, chunk_cells):
+            if not shapely.intersects(union, shapely.box(*box)):
+                continue
+            cells = polyfill_box(union, box, level)
+            if len(cells) == 0:
+                continue
+            h3_data = self.match_h3(cells.to_geodataframe(), method=method, indexes=indexes)
+            # ids are written as strings so all parts share one schema
+            for col in ['med_id', 'geo_match_id']:
+                h3_data[col] = h3_data[col].astype(str)
+            h3_data['h3_match'] = h3_data['med_id'].values == h3_data['geo_match_id'].values
+            h3_data.to_parquet(os.path.join(out_folder, f'part-{n_parts:05d}.parquet'))
+            n_parts += 1
+            
+            summary['cells'] += h3_data.shape[0]
+            summary['matched'] += int(h3_data['h3_match'].sum())
+            summary['mismatched'] += int((~h3_data['h3_match']).sum())
+            summary['no_geo_match'] += int((h3_data['geo_match_id'] == '').sum())
+            cur_admins = pd.DataFrame({'cells':1, 'mismatched':(~h3_data['h3_match']).astype('int64')}).groupby(h3_data['med_id'].values).sum()
+            admin_summary = admin_summary.add(cur_admins, fill_value=0).astype('int64')
+            if self.verbose:
+                tPrint(f"Streamed {summary['cells']} h3 cells in {n_parts} chunks")
+        self.h3_summary = summary
+        self.h3_admin_summary = admin_summary
+        with open(os.path.join(out_folder, 'summary.json'), 'w') as out_json:
+            json.dump(summary, out_json, indent=2)
+        admin_summary.to_csv(os.path.join(out_folder, 'admin_summary.csv'), index_label='med_id')
+        return(summary)
+        
+    @instrumented_stage('generate_boundary_difference', inputs=lambda self: [self.wb_bounds, self.geoBounds])
     def generate_boundary_difference(self, area_crs=3857, inGeo_id='shapeID', big_thresh=100, verbose=False):
         ''' Generate difference objects between wb_bounds and geo_bounds
         
@@ -222,51 +721,80 @@ class country_boundary():
         '''
         # Generate slivers, or holes in the geobounds that are in the WB bounds
         inGeo = self.geoBounds
-        wb_slivers = self.wb_bounds.unary_union.difference(inGeo.unary_union)
-        cnt = 0
-        all_res = []
-        for sliver in list(wb_slivers):
-            all_res.append([cnt, sliver, sliver.area])
-            
-        wb_sliver_df = gpd.GeoDataFrame(pd.DataFrame(all_res, columns=['ID','geometry','area']), geometry='geometry', crs=4326)
-        wb_sliver_df = wb_sliver_df.to_crs(area_crs)
-        wb_sliver_df['area'] = wb_sliver_df['geometry'].apply(lambda x: x.area/1000000)
-        wb_sliver_df = wb_sliver_df.to_crs(4326)
+        wb_union = self.get_union('wb_bounds')
+        wb_slivers = shapely.get_parts(wb_union.difference(self.get_union('geoBounds')))
+        wb_sliver_df = gpd.GeoDataFrame({'ID':np.arange(len(wb_slivers))}, geometry=wb_slivers, crs=4326)
+        wb_sliver_df['area'] = wb_sliver_df.to_crs(area_crs).area.values/1000000
         self.big_slivers = wb_sliver_df.loc[wb_sliver_df['area'] > big_thresh]
-        wb_sliver_df = wb_sliver_df.loc[wb_sliver_df['area'] < big_thresh ]
+        wb_sliver_df = wb_sliver_df.loc[wb_sliver_df['area'] < big_thresh].copy()
         self.wb_sliver_df = wb_sliver_df
         
-        # For each sliver, determine the admin section in in_geo to merge it into        
-        wb_sliver_df['geoID'] = ''
-        for idx, row in wb_sliver_df.iterrows():
-            sel_geo = inGeo.loc[inGeo.intersects(row['geometry'].buffer(0.01))].copy()
-            if sel_geo.shape[0] == 1: 
-                wb_sliver_df.loc[idx, 'geoID'] = sel_geo[inGeo_id].values[0]
-            elif sel_geo.shape[0] > 1:
-                # If it intersects two admins, figure out which one if intersects more
-                sel_geo['area'] = sel_geo['geometry'].apply(lambda x: x.intersection(row['geometry'].buffer(0.01)).area)
-                wb_sliver_df.loc[idx, 'geoID'] = sel_geo.sort_values('area', ascending=False).iloc[0][inGeo_id]
-            else:
-                if verbose:
-                    print(f"{idx} in slivers does not intersect geo_bounds")
-                else:
-                    pass
+        # For each sliver, determine the admin section in in_geo to merge it into; all slivers are
+        #   assigned with a single query of a spatial index on in_geo
+        geo_geoms = np.asarray(inGeo['geometry'])
+        sliver_buffers = shapely.buffer(np.asarray(wb_sliver_df['geometry']), 0.01)
+        s_idx, g_idx = shapely.STRtree(geo_geoms).query(sliver_buffers, predicate='intersects')
+        # If a sliver intersects more than one admin, figure out which one it intersects more
+        i_area = np.zeros(len(s_idx))
+        multi = np.bincount(s_idx, minlength=len(sliver_buffers))[s_idx] > 1
+        i_area[multi] = shapely.area(shapely.intersection(sliver_buffers[s_idx[multi]], geo_geoms[g_idx[multi]]))
+        pairs = pd.DataFrame({'s_idx':s_idx, 'g_idx':g_idx, 'area':i_area})
+        pairs = pairs.sort_values(['s_idx', 'area', 'g_idx'], ascending=[True, False, True]).drop_duplicates('s_idx')
+        sliver_ids = np.full(wb_sliver_df.shape[0], '', dtype=object)
+        sliver_ids[pairs['s_idx'].values] = inGeo[inGeo_id].values[pairs['g_idx'].values]
+        wb_sliver_df['geoID'] = sliver_ids
+        if verbose:
+            for idx in wb_sliver_df.index[sliver_ids == '']:
+                print(f"{idx} in slivers does not intersect geo_bounds")
                 
-        # Loop through the geo_bounds
+        # Clip the geo_bounds to the national boundary; admins entirely inside the national boundary are unchanged
+        shapely.prepare(wb_union)
+        new_geoms = geo_geoms.copy()
+        clip = ~shapely.contains_properly(wb_union, geo_geoms)
+        new_geoms[clip] = shapely.intersection(geo_geoms[clip], wb_union)
+        # Merge all slivers assigned to an admin area into that admin area
+        assigned = wb_sliver_df.loc[wb_sliver_df['geoID'] != '']
+        if assigned.shape[0] > 0:
+            sliver_union = assigned.dissolve('geoID')['geometry']
+            sliver_union = pd.Series(shapely.buffer(np.asarray(sliver_union), 0.0001), index=sliver_union.index)
+            sel_slivers = inGeo[inGeo_id].map(sliver_union).values
+            has_sliver = pd.notna(sel_slivers)
+            new_geoms[has_sliver] = shapely.union(new_geoms[has_sliver], sel_slivers[has_sliver])
         edit_geo = inGeo.copy()
-        for idx, row in edit_geo.iterrows():
-            # Clip shape to national boundary
-            new_shape = row['geometry'].intersection(self.wb_bounds.unary_union)                
-            # Select all the slivers to merge into the current admin area
-            sel_slivers = wb_sliver_df.loc[wb_sliver_df['geoID'] == row[inGeo_id]]
-            if sel_slivers.shape[0] > 0:
-                new_shape = new_shape.union(unary_union(sel_slivers['geometry']).buffer(0.0001))
-            row['geometry'] = new_shape
-            edit_geo.loc[idx] = row
+        edit_geo['geometry'] = gpd.GeoSeries(new_geoms, index=edit_geo.index, crs=edit_geo.crs)
                 
         self.corrected_geo = edit_geo
         return(edit_geo)
         
+    @instrumented_stage('generate_edge_difference', inputs=lambda self: [self.wb_bounds, self.geoBounds])
+    def generate_edge_difference(self, metric_crs=None, precision=7, max_frechet_vertices=4000000):
+        ''' Compare the boundaries of wb_bounds and geoBounds edge by edge, instead of through polygon overlays.
+            The shared-edge topology of each dataset stores every boundary between two admins once; geoBounds 
+            edges are relabelled with the matched WB ids (geo_match_id), so each WB edge is compared with the 
+            geoboundaries edge between the same pair of WB admins
+        
+            :param metric_crs: crs in which distances are measured, default is the UTM zone of wb_bounds
+            :param precision: number of decimals vertices are rounded to when identifying shared edges, default is 7
+            :type precision: int, optional
+            :param max_frechet_vertices: largest product of the numbers of vertices of two edges for which the 
+                Fréchet distance is measured, default is 4000000
+            :type max_frechet_vertices: int, optional
+            :return: one row per pair of neighbouring WB admins (id_2 is '' on the national boundary) with the 
+                length of the WB (length_1) and geoboundaries (length_2) edges, and the Hausdorff and Fréchet 
+                distance between them in metres. status is missing_1 or missing_2 where only one dataset has the edge
+            :rtype: class:`geopandas.GeoDataFrame`
+        '''
+        if metric_crs is None:
+            metric_crs = self.wb_bounds.estimate_utm_crs()
+        if not "geo_match_id" in self.geoBounds.columns:
+            self.geoBounds = self.match_datasets(self.geoBounds, self.wb_bounds, self.geoBounds_id_col, self.wb_id_col, label="Matching bounds2 to bounds 1")
+        wb_edges = build_edges(self.wb_bounds, self.wb_id_col, precision=precision)
+        geo_edges = build_edges(self.geoBounds, self.geoBounds_id_col, precision=precision)
+        geo_ids = self.geoBounds.loc[self.geoBounds['geo_match_id'] != '']
+        geo_edges = map_edges(geo_edges, pd.Series(geo_ids['geo_match_id'].values, index=geo_ids[self.geoBounds_id_col].astype(str).values))
+        self.edge_comparison = compare_edges(wb_edges, geo_edges, metric_crs, max_frechet_vertices=max_frechet_vertices)
+        return(self.edge_comparison)
+        
     def generate_summary_difference(self, area_crs=3857, verbose=True):
         ''' summarize the differences between the WB bounds and the GeoBounds:
             1. numbers of features
@@ -275,10 +803,10 @@ class country_boundary():
             4. Area in geobounds missing in WB bounds 
         '''
         wb_features = self.wb_bounds.shape[0]
-        wb_area = self.wb_bounds.unary_union.area
+        wb_area = self.get_union('wb_bounds').area
         
         geo_features = self.geoBounds.shape[0]
-        geo_area = self.geoBounds.unary_union.area
+        geo_area = self.get_union('geoBounds').area
         
         wb_per = wb_area/geo_area * 100
         
@@ -286,7 +814,7 @@ class country_boundary():
         if self.big_slivers.shape[0] > 0:
             wb_sliver_area = wb_sliver_area + self.big_slivers.to_crs(area_crs).unary_union.area
         
-        wb_holes = self.geoBounds.unary_union.difference(self.wb_bounds.unary_union)
+        wb_holes = self.get_union('geoBounds').difference(self.get_union('wb_bounds'))
         wb_holes_area = wb_holes.area
         
         self.comp_summary = [wb_area, geo_area, wb_features, geo_features, wb_sliver_area, wb_holes_area, self]
@@ -296,22 +824,75 @@ class country_boundary():
         
         return(self.comp_summary)       
     
-    def map_corrected_bounds(self, geobounds_label='GeoBounds'):
+    # layers written to vector tiles, and their style in the folium maps
+    tile_layers = {'wb_bounds':{'color':'yellow', 'weight':4, 'fill':False}, 
+                    'geoBounds':{'color':'blue', 'weight':0.5, 'fill':False},
+                    'corrected_geo':{'color':'red', 'weight':1, 'fill':False},
+                    'wb_sliver_df':{'color':'green', 'weight':5, 'fill':True},
+                    'big_slivers':{'color':'orange', 'weight':5, 'fill':True}}
+    
+    def write_map_tiles(self, out_path, min_zoom=0, max_zoom=12):
+        ''' write wb_bounds, geoBounds, corrected_geo and slivers (where they exist) as vector tiles for the 
+            folium maps. Geometries are simplified for each zoom level, so maps of large, detailed countries do not 
+            have to embed all the geometries; requires mapbox_vector_tile (pip install .[tiles])
+        
+            :param out_path: folder to write {z}/{x}/{y}.pbf tiles, or a file ending with .mbtiles
+            :type out_path: string
+            :param max_zoom: highest zoom level to create; each level has 4x more tiles, default is 12
+            :type max_zoom: int, optional
+            :return: number of tiles written
+            :rtype: int
+        '''
+        layers = {}
+        for layer in self.tile_layers.keys():
+            try:
+                layers[layer] = getattr(self, layer)
+            except AttributeError:
+                continue
+        return(write_vector_tiles(layers, out_path, min_zoom=min_zoom, max_zoom=max_zoom))
+    
+    def add_tile_layers(self, m, tile_url, layers, max_zoom=12):
+        ''' add vector tiles created by write_map_tiles to a folium map, one map layer per tile layer
+        
+            :param tile_url: url template of the tiles ie - tiles/{z}/{x}/{y}.pbf, relative to the map html
+            :type tile_url: string
+            :param layers: style of each layer to add, keyed by layer name
+            :type layers: dict
+        '''
+        for layer, style in layers.items():
+            options = {'vectorTileLayerStyles':{x:({'weight':0, 'opacity':0, 'fill':False} if x != layer else style) for x in self.tile_layers.keys()},
+                        'maxNativeZoom':max_zoom}
+            VectorGridProtobuf(tile_url, layer, options).add_to(m)
+        return(m)
+    
+    def map_corrected_bounds(self, geobounds_label='GeoBounds', tile_url=None, max_zoom=12):
         ''' generate folium map comparing boundaries
+        
+            :param tile_url: url template of vector tiles created by write_map_tiles (ie - tiles/{z}/{x}/{y}.pbf); 
+                the map references the tiles instead of embedding geometries, and also shows the corrected geoBounds 
+                and slivers, default is None
+            :type tile_url: string, optional
+            :param max_zoom: highest zoom level of the tiles, they are scaled beyond this, default is 12
+            :type max_zoom: int, optional
         '''
         selWB = self.wb_bounds
-        edit_geo = self.corrected_geo
         
         m = folium.Map(location=[selWB.centroid.y.values[0], selWB.centroid.x.values[0]], zoom_start=7, tiles="stamentoner", control_scale=True)
+        if tile_url is not None:
+            self.add_tile_layers(m, tile_url, {x:y for x, y in self.tile_layers.items() if hasattr(self, x)}, max_zoom=max_zoom)
+            folium.LayerControl(collapsed=True).add_to(m)
+            return(m)
+        edit_geo = self.corrected_geo
+        
         # add the official World Bank boundaries to the map as a single, yellow polygon
-        wb_shp = folium.GeoJson(mapping(selWB.unary_union), name='WB', style_function=lambda feature: {
+        wb_shp = folium.GeoJson(mapping(self.get_union('wb_bounds')), name='WB', style_function=lambda feature: {
             'color':'yellow',
             'weight':4
         }) 
         wb_shp.add_to(m)
 
         # add the original geobounds to the map as a blue polygon
-        in_geo_shp = folium.GeoJson(mapping(self.geoBounds.unary_union), name=geobounds_label, style_function=lambda feature: {
+        in_geo_shp = folium.GeoJson(mapping(self.get_union('geoBounds')), name=geobounds_label, style_function=lambda feature: {
             'color':'blue',
             'weight':0.5
         }) 
@@ -332,7 +913,7 @@ class country_boundary():
         }) 
         in_geo_shp.add_to(m)
         # add the correct geo_bounds one by one as red
-        geo_bounds = folium.GeoJson(mapping(edit_geo.unary_union), name=f'{geobounds_label} corrected', style_function=lambda feature: {
+        geo_bounds = folium.GeoJson(mapping(self.get_union('corrected_geo')), name=f'{geobounds_label} corrected', style_function=lambda feature: {
             'color':'red',
             'weight':1
         })
@@ -341,9 +922,17 @@ class country_boundary():
         folium.LayerControl(collapsed=True).add_to(m)
         return(m)
         
-    def map_boundary_comparison(self, start_location, zoom_level, buffer_dist=0.1):
+    def map_boundary_comparison(self, start_location, zoom_level, buffer_dist=0.1, tile_url=None, max_zoom=12):
         ''' generate folium map comparing boundaries
+        
+            :param tile_url: url template of vector tiles created by write_map_tiles; the map references the 
+                tiles instead of embedding every admin within buffer_dist, default is None
+            :type tile_url: string, optional
         '''
+        if tile_url is not None:
+            m = folium.Map(location=[start_location.y,start_location.x], zoom_start=zoom_level, tiles="stamentoner", control_scale=True)
+            return(self.add_tile_layers(m, tile_url, {'wb_bounds':{'color':'#FF2D00', 'opacity':0.7, 'weight':3, 'fill':False},
+                                                        'geoBounds':{'color':'#000AFF', 'opacity':0.5, 'weight':3, 'fill':False}}, max_zoom=max_zoom))
         bounds1 = self.wb_bounds.loc[self.wb_bounds.intersects(start_location.buffer(buffer_dist))]        
         bounds2 = self.geoBounds.loc[self.geoBounds.intersects(start_location.buffer(buffer_dist))]
         
@@ -373,8 +962,11 @@ class country_boundary():
         return(m)
 
     def static_map_lc(self, sub='', map_epsg=3857, legend_loc='upper right',
-                        esa_legend = "/home/public/Data/GLOBAL/LANDCOVER/GLOBCOVER/2015/GLOBCOVER_LEGEND.csv"):
+                        esa_legend = "/home/public/Data/GLOBAL/LANDCOVER/GLOBCOVER/2015/GLOBCOVER_LEGEND.csv", basemap=None):
         ''' generate a static map of the Landcover zonal results        
+        
+            :param basemap: contextily tile provider for the background, False for no basemap, default is render.BASEMAP
+            :type basemap: xyzservices.TileProvider, optional
         '''
         if sub == '':
             try:
@@ -387,11 +979,7 @@ class country_boundary():
             sub.crs = 4326
             sub = sub.to_crs(map_epsg)
         # Create dictionary of mapping values
-        esa_legend = "/home/public/Data/GLOBAL/LANDCOVER/GLOBCOVER/2015/GLOBCOVER_LEGEND.csv"
-        esa_data = pd.read_csv(esa_legend)
-        esa_data['Value'] = esa_data['Value'].apply(lambda x: f'LC_{x}')
-        esa_dict   = dict(zip(esa_data['Value'], esa_data['Hex']))
-        esa_labels = dict(zip(esa_data['Value'], esa_data['Shortname']))
+        esa_dict, esa_labels = read_esa_legend(esa_legend)
 
         fig, ax = plt.subplots(figsize=(15,15))
         proj = CRS.from_epsg(map_epsg)
@@ -401,22 +989,21 @@ class country_boundary():
         mismatch_color = 'pink'
         mismatch_edge = 'darkred'
         cur_patch = mpatches.Patch(facecolor=mismatch_color, edgecolor=mismatch_edge, hatch="///", label=f"Mismatch [{sel_mixed.shape[0]}]")
-        all_labels = [cur_patch]
-        for ctype, data in sub.groupby("LC_MAX")    :
-            color = esa_dict[ctype]
-            data.plot(color=color, ax=ax, label=ctype, linewidth=0.2)
-            cur_patch = mpatches.Patch(color=color, label=f'{esa_labels[ctype]} [{data.shape[0]}]')
-            all_labels.append(cur_patch)
+        all_labels = [cur_patch] + draw_classes(ax, sub, "LC_MAX", esa_dict, labels=esa_labels, linewidth=0.2)
         # Add outline of features with mismatch
-        sel_mixed.plot(color=mismatch_color, edgecolor=mismatch_edge, hatch="//////", ax=ax, label=False, linewidth=4)
+        if sel_mixed.shape[0] > 0:
+            sel_mixed.plot(color=mismatch_color, edgecolor=mismatch_edge, hatch="//////", ax=ax, label=False, linewidth=4)
         
-        ctx.add_basemap(ax, source=ctx.providers.Stamen.TonerBackground, crs=proj) #zorder=-10, 'EPSG:4326'
+        add_basemap(ax, proj, source=basemap)
         ax.legend(handles=all_labels, loc=legend_loc)
         ax = ax.set_axis_off()
         return(ax)
         
-    def static_map_h3(self, sub='', map_epsg=3857, legend_loc='upper right'):
+    def static_map_h3(self, sub='', map_epsg=3857, legend_loc='upper right', basemap=None):
         ''' generate a static map of the Landcover zonal results        
+        
+            :param basemap: contextily tile provider for the background, False for no basemap, default is render.BASEMAP
+            :type basemap: xyzservices.TileProvider, optional
         '''
         if sub == '':
             try:
@@ -425,7 +1012,7 @@ class country_boundary():
                 raise(ValueError("Need to run_zonal or proivde a DF for mapping"))
         sub = sub.to_crs(map_epsg)
         # Create dictionary of mapping values
-        sub['h3_match'] = sub.apply(lambda x: str(x['med_id'] == x['geo_match_id']), axis=1)
+        sub['h3_match'] = (sub['med_id'].values == sub['geo_match_id'].values).astype(str)
         
         h3_dict   = {'False': '#B3172B', 'True':'#FFFFFF'}       
         edge_dict = {'False': '#B3172B', 'True':'#808080'}       
@@ -433,23 +1020,106 @@ class country_boundary():
         proj = CRS.from_epsg(map_epsg)
         #divider = make_axes_locatable(ax)
         #cax = divider.append_axes("right", size="5%", pad=0.1)
-        all_labels = []
-        for ctype, data in sub.groupby("h3_match")    :
-            color = h3_dict[ctype]
-            data.plot(color=color, ax=ax, label=ctype, linewidth=0.2, edgecolor=edge_dict[ctype])
-            cur_patch = mpatches.Patch(facecolor=color, label=f'{ctype} [{data.shape[0]}]', edgecolor=edge_dict[ctype])
-            all_labels.append(cur_patch)
+        all_labels = draw_classes(ax, sub, "h3_match", h3_dict, edgecolors=edge_dict, linewidth=0.2)
 
-        ctx.add_basemap(ax, source=ctx.providers.Stamen.TonerBackground, crs=proj) #zorder=-10, 'EPSG:4326'
+        add_basemap(ax, proj, source=basemap)
         ax.legend(handles=all_labels, loc=legend_loc)
         ax = ax.set_axis_off()
         return(ax)
 
-    def match_datasets(self, inD1, inD2, inD1_col, inD2_col, label='Matching Datasets'):
+    @instrumented_stage('match_datasets')
+    def match_datasets(self, inD1, inD2, inD1_col, inD2_col, label='Matching Datasets', method='strtree', index=None):
         ''' Attach unique IDs between two admin datasets. For each dataset, identify primary match in dataset 2, and some information describing the intersection
         
             :param inD1: administrative dataset
             :type inD1: class geoPandas.GeoDataframe
+            :param method: matching engine; 'strtree' queries a spatial index of inD2 and measures all 
+                intersections in bulk, 'centroid' assigns features by their centroid and only measures 
+                intersections for features crossing a boundary in inD2, 'loop' is the original row-by-row 
+                matching, default is 'strtree'
+            :type method: string, optional
+            :param index: spatial index of inD2 from spatial_index, used by the 'strtree' and 'centroid' methods 
+                instead of building a new index, default is None
+            :type index: dict, optional
+        '''
+        if method == 'strtree':
+            inD1 = self.match_datasets_strtree(inD1, inD2, inD2_col, label=label, index=index)
+        elif method == 'centroid':
+            inD1 = self.match_datasets_centroid(inD1, inD2, inD2_col, label=label, index=index)
+        elif method == 'loop':
+            inD1 = self.match_datasets_loop(inD1, inD2, inD2_col, label=label)
+        else:
+            raise(ValueError(f"Unknown matching method {method}"))
+        crs = inD1.crs        
+        inD1 = inD1.apply(pd.to_numeric, errors='ignore')        
+        inD1 = gpd.GeoDataFrame(inD1, geometry='geometry', crs=crs)
+        return(inD1)
+
+    def spatial_index(self, inD):
+        ''' spatial indexes of the features, and of the boundaries of the features, of an admin dataset, to 
+            match many datasets against inD without rebuilding them
+        '''
+        geoms = np.asarray(inD['geometry'])
+        return({'tree':shapely.STRtree(geoms), 'boundary_tree':shapely.STRtree(shapely.boundary(geoms))})
+    
+    def match_datasets_strtree(self, inD1, inD2, inD2_col, label='Matching Datasets', index=None):
+        ''' Attach geo_match_id and geo_match_per to inD1 using a single bulk query of an STRtree built on inD2;
+            intersection areas for every candidate pair are calculated in one vectorized shapely call
+        '''
+        if self.verbose:
+            tPrint(label)
+        geoms1 = np.asarray(inD1['geometry'])
+        geoms2 = np.asarray(inD2['geometry'])
+        tree = shapely.STRtree(geoms2) if index is None else index['tree']
+        idx1, idx2 = tree.query(geoms1, predicate='intersects')
+        # percent of each inD1 feature covered by each intersecting inD2 feature
+        i_area = shapely.area(shapely.intersection(geoms1[idx1], geoms2[idx2])) / shapely.area(geoms1[idx1])
+        pairs = pd.DataFrame({'idx1':idx1, 'idx2':idx2, 'iArea':i_area})
+        pairs = pairs.sort_values(['idx1', 'iArea'], ascending=[True, False], kind='stable').drop_duplicates('idx1')
+
+        match_id = np.full(inD1.shape[0], '', dtype=object)
+        match_per = np.zeros(inD1.shape[0])
+        match_id[pairs['idx1'].values] = inD2[inD2_col].values[pairs['idx2'].values]
+        match_per[pairs['idx1'].values] = pairs['iArea'].values
+        inD1['geo_match_id'] = match_id
+        inD1['geo_match_per'] = match_per
+        return(inD1)
+
+    def match_datasets_centroid(self, inD1, inD2, inD2_col, label='Matching Datasets', index=None):
+        ''' Attach geo_match_id and geo_match_per to inD1 with a point-in-polygon query of the inD1 centroids.
+            Designed for small features such as h3 cells, most of which are entirely within one feature of inD2;
+            features that intersect a boundary of inD2 are matched with the exact overlay of match_datasets_strtree
+        '''
+        if self.verbose:
+            tPrint(label)
+        geoms1 = np.asarray(inD1['geometry'])
+        geoms2 = np.asarray(inD2['geometry'])
+        # Identify the features that straddle a boundary in inD2
+        boundary_tree = shapely.STRtree(shapely.boundary(geoms2)) if index is None else index['boundary_tree']
+        straddle = np.zeros(len(geoms1), dtype=bool)
+        straddle[boundary_tree.query(geoms1, predicate='intersects')[0]] = True
+        
+        # Features that do not cross a boundary are entirely within the inD2 feature containing their centroid
+        interior = np.where(~straddle)[0]
+        tree = shapely.STRtree(geoms2) if index is None else index['tree']
+        p_idx, g_idx = tree.query(shapely.centroid(geoms1[interior]), predicate='within')
+        pairs = pd.DataFrame({'p_idx':p_idx, 'g_idx':g_idx}).sort_values(['p_idx', 'g_idx']).drop_duplicates('p_idx')
+        match_id = np.full(len(geoms1), '', dtype=object)
+        match_per = np.zeros(len(geoms1))
+        match_id[interior[pairs['p_idx'].values]] = inD2[inD2_col].values[pairs['g_idx'].values]
+        match_per[interior[pairs['p_idx'].values]] = 1.0
+        
+        # Exact overlay for the features crossing a boundary
+        if straddle.any():
+            edge_res = self.match_datasets_strtree(inD1.iloc[straddle].copy(), inD2, inD2_col, label=label, index=index)
+            match_id[straddle] = edge_res['geo_match_id'].values
+            match_per[straddle] = edge_res['geo_match_per'].values
+        inD1['geo_match_id'] = match_id
+        inD1['geo_match_per'] = match_per
+        return(inD1)
+
+    def match_datasets_loop(self, inD1, inD2, inD2_col, label='Matching Datasets'):
+        ''' Attach geo_match_id and geo_match_per to inD1 by looping through inD1 and intersecting each row with inD2
         '''
         inD1['geo_match_id'] = ''
         inD1['geo_match_per'] = 0.0
@@ -462,30 +1132,44 @@ class country_boundary():
             selD2 = selD2.sort_values('iArea', ascending=False)
             inD1.loc[idx,'geo_match_id']  = selD2[inD2_col].iloc[0]
             inD1.loc[idx,'geo_match_per'] = selD2['iArea'].iloc[0]
-        crs = inD1.crs        
-        inD1 = inD1.apply(pd.to_numeric, errors='ignore')        
-        inD1 = gpd.GeoDataFrame(inD1, geometry='geometry', crs=crs)
         return(inD1)
     
-    def run_zonal(self, file_defs, z_geoB=True, z_wbB=True, z_corB=False, z_h3=False):
+    @instrumented_stage('run_zonal', inputs=lambda self: [self.wb_bounds, self.geoBounds])
+    def run_zonal(self, file_defs, z_geoB=True, z_wbB=True, z_corB=False, z_h3=False, engine='shared', max_memory=256*1024**2):
         ''' run zonal stats using the official WB boundaries, the original geobounds, and the corrected geobounds
         
         :param file_defs: list of raster files to process; each list item is [file_def, name, type, (optional) expected vals]
         :type file_defs: [class rasterio.io.DatasetReader, str, str, list of ints]
-        :param z_geoB, z_wbB, z_corB: boolean flags to run zonal stats on the input datasets
+        :param z_geoB, z_wbB, z_corB, z_h3: boolean flags to run zonal stats on the input datasets
+        :param engine: 'shared' reads each raster once for all selected datasets (zonal.zonal_stats_multi), 'gostrocks' 
+            runs GOSTRocks zonalStats separately for each dataset, default is 'shared'
+        :type engine: string, optional
+        :param max_memory: approximate memory in bytes for each raster block read by the shared engine, default is 256 MB
+        :type max_memory: int, optional
         '''
-        geoB = self.geoBounds
-        try:
-            corB = self.corrected_geo
-        except:
-            pass
+        zone_layers = {}
+        if z_geoB:
+            zone_layers['geoB'] = self.geoBounds
+        if z_wbB:
+            zone_layers['wbB'] = self.wb_bounds
+        if z_corB:
+            zone_layers['corB'] = self.corrected_geo
         if z_h3:
             try:
-                h3_grid = self.h3_grid
+                zone_layers['h3'] = self.h3_grid
             except:
-                h3_grid = self.generate_h3_grid()
-            
-        wbB = self.wb_bounds
+                zone_layers['h3'] = self.generate_h3_grid()
+            # zonal results are stored by position, keep the cell ids to update them later
+            self.zonal_h3_ids = zone_layers['h3'].index.tolist()
+        self.zonal_defs = file_defs
+        return(self.run_zonal_layers(file_defs, zone_layers, engine=engine, max_memory=max_memory))
+    
+    def run_zonal_layers(self, file_defs, zone_layers, engine='shared', max_memory=256*1024**2):
+        ''' run zonal statistics of every raster in file_defs for every dataset in zone_layers; see run_zonal
+        
+            :param zone_layers: datasets to summarize, keyed by label
+            :type zone_layers: dict of class:`geopandas.GeoDataFrame`
+        '''
         final = {}
         for file_def in file_defs:
             if self.verbose:
@@ -495,77 +1179,135 @@ class country_boundary():
                 curR = rasterio.open(curR)
             name = file_def[1]
             if file_def[2] == 'N':
-                if z_geoB:
-                    geo_res = rMisc.zonalStats(geoB, curR, rastType=file_def[2], reProj=True)
-                    geo_res = gpd.GeoDataFrame(geo_res, columns = [f'{name}_{x}' for x in ['SUM', 'MIN', 'MAX', 'MEAN']])
-                if z_wbB:
-                    geo_res_wb = rMisc.zonalStats(wbB, curR, rastType=file_def[2], reProj=True)
-                    geo_res_wb = gpd.GeoDataFrame(geo_res_wb, columns = [f'{name}_{x}' for x in ['SUM', 'MIN', 'MAX', 'MEAN']])
-                if z_corB:
-                    geo_res_cor = rMisc.zonalStats(corB, curR, rastType=file_def[2], reProj=True)
-                    geo_res_cor = gpd.GeoDataFrame(geo_res_cor, columns = [f'{name}_{x}' for x in ['SUM', 'MIN', 'MAX', 'MEAN']])
-                if z_h3:
-                    geo_res_h3 = rMisc.zonalStats(h3_grid, curR, rastType=file_def[2], reProj=True)
-                    geo_res_h3 = gpd.GeoDataFrame(geo_res_h3, columns = [f'{name}_{x}' for x in ['SUM', 'MIN', 'MAX', 'MEAN']])
+                unq_vals = []
+                columns = [f'{name}_{x}' for x in ['SUM', 'MIN', 'MAX', 'MEAN']]
+            else:
+                unq_vals = file_def[3]
+                columns = [f'{name}_{x}' for x in unq_vals]
+            
+            if engine == 'shared':
+                zonal_res = zonal_stats_multi(zone_layers, curR, rastType=file_def[2], unqVals=unq_vals, max_memory=max_memory)
+            elif engine == 'gostrocks':
+                zonal_res = {}
+                for label, inD in zone_layers.items():
+                    zonal_res[label] = rMisc.zonalStats(inD, curR, rastType=file_def[2], unqVals=unq_vals, reProj=True)
             else:
-                if z_geoB:
-                    geo_res = rMisc.zonalStats(geoB, curR, rastType=file_def[2], unqVals=file_def[3], reProj=True)
-                    geo_res = gpd.GeoDataFrame(geo_res, columns = [f'{name}_{x}' for x in file_def[3]])
-                if z_wbB:
-                    geo_res_wb = rMisc.zonalStats(wbB, curR, rastType=file_def[2], unqVals=file_def[3], reProj=True)
-                    geo_res_wb = gpd.GeoDataFrame(geo_res_wb, columns = [f'{name}_{x}' for x in file_def[3]])                    
-                if z_corB:
-                    geo_res_cor = rMisc.zonalStats(corB, curR, rastType=file_def[2], unqVals=file_def[3], reProj=True)
-                    geo_res_cor = gpd.GeoDataFrame(geo_res_cor, columns = [f'{name}_{x}' for x in file_def[3]])
-                if z_corB:
-                    geo_res_h3 = rMisc.zonalStats(h3_grid, curR, rastType=file_def[2], unqVals=file_def[3], reProj=True)
-                    geo_res_h3 = gpd.GeoDataFrame(geo_res_h3, columns = [f'{name}_{x}' for x in file_def[3]])
+                raise(ValueError(f"Unknown zonal engine {engine}"))
             final[name] = {}
-            try:
-                final[name]['geoB'] = geo_res
-            except:
-                pass
-            try:
-                final[name]['wbB'] = geo_res_wb
-            except:
-                pass
-            try:
-                final[name]['corB'] = geo_res_cor
-            except:
-                pass            
-            try:
-                final[name]['h3'] = geo_res_h3
-            except:
-                pass
+            for label, cur_res in zonal_res.items():
+                final[name][label] = gpd.GeoDataFrame(cur_res, columns=columns)
         return(final)
                             
-    def write_output(self, output_folder, write_slivers=True, write_base=True):
-        ''' write output data to a single folder
+    @instrumented_stage('write_output', inputs=lambda self: [getattr(self, x, None) for x in ['h3_data', 'wb_bounds', 'geoBounds', 'corrected_geo', 'wb_mapped', 'wb_sliver_df']])
+    def write_output(self, output_folder, write_slivers=True, write_base=True, out_format='geojson', max_workers=4):
+        ''' write output data to a single folder, along with the stage timings (stage_timings.json) and a 
+            description of the written layers (metadata.json) used by load_output to reload the country
+        
+            :param out_format: file format of the layers; 'geojson', 'parquet' (GeoParquet, requires pyarrow) or 
+                'fgb' (FlatGeobuf with a spatial index), default is 'geojson'
+            :type out_format: string, optional
+            :param max_workers: number of layers to write in parallel, default is 4
+            :type max_workers: int, optional
         '''
+        if not out_format in OUTPUT_FORMATS:
+            raise(ValueError(f"out_format must be one of {list(OUTPUT_FORMATS.keys())}"))
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
-        try:
-            self.h3_data.to_file(os.path.join(output_folder, 'h3_grid.geojson'), driver="GeoJSON")
-        except:
-            pass
+        # stage timings are written once this stage completes, and updated after every later stage
+        self.stage_recorder.json_file = os.path.join(output_folder, 'stage_timings.json')
         
+        layers = {'h3_grid':'h3_data', 'h3_hierarchy':'h3_hierarchy', 'GEO_CORRECTED_bounds':'corrected_geo', 'WB_bounds_zonal':'wb_mapped',
+                    'edge_comparison':'edge_comparison'}
         if write_base:
-            self.wb_bounds.to_file(os.path.join(output_folder, 'WB_bounds.geojson'), driver="GeoJSON")
-            self.geoBounds.to_file(os.path.join(output_folder, 'GEO_bounds.geojson'), driver="GeoJSON")
-        try:
-            self.corrected_geo.to_file(os.path.join(output_folder, 'GEO_CORRECTED_bounds.geojson'), driver="GeoJSON")
-        except:
-            pass
-            
-        try:
-            self.wb_mapped.to_file(os.path.join(output_folder, 'WB_bounds_zonal.geojson'), driver="GeoJSON")
-        except:
-            pass
+            layers['WB_bounds'] = 'wb_bounds'
+            layers['GEO_bounds'] = 'geoBounds'
         if write_slivers:
-            self.wb_sliver_df.to_file(os.path.join(output_folder, 'WB_slivers.geojson'), driver="GeoJSON")
-            try:
-                self.big_slivers.to_file(os.path.join(output_folder, 'BIG_slivers.geojson'), driver="GeoJSON")
-            except:
-                pass    
-            
-        
\ No newline at end of file
+            layers['WB_slivers'] = 'wb_sliver_df'
+            layers['BIG_slivers'] = 'big_slivers'
+        
+        out_files = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            all_writes = []
+            for layer_name, attr in layers.items():
+                try:
+                    inD = getattr(self, attr)
+                except AttributeError:
+                    continue
+                out_file = f'{layer_name}{OUTPUT_FORMATS[out_format][0]}'
+                all_writes.append(executor.submit(write_layer, inD, os.path.join(output_folder, out_file), out_format))
+                out_files[attr] = out_file
+            for cur_write in all_writes:
+                cur_write.result()
+        
+        metadata = {'iso3':self.iso3, 'wb_id_col':self.wb_id_col, 'geoBounds_id_col':self.geoBounds_id_col,
+                        'out_format':out_format, 'layers':out_files}
+        with open(os.path.join(output_folder, 'metadata.json'), 'w') as out_json:
+            json.dump(metadata, out_json, indent=2)
+
+# file extension and OGR driver of the formats supported by write_output
+OUTPUT_FORMATS = {
+    'geojson': ['.geojson', 'GeoJSON'],
+    'parquet': ['.parquet', None],
+    'fgb': ['.fgb', 'FlatGeobuf'],
+}
+
+# layers of write_output indexed by h3 id
+H3_LAYERS = ['h3_data', 'h3_hierarchy']
+
+def write_layer(inD, out_file, out_format='geojson'):
+    ''' write a single layer of country_boundary output
+    '''
+    if out_format == 'parquet':
+        inD.to_parquet(out_file)
+    elif out_format == 'fgb':
+        inD.to_file(out_file, driver=OUTPUT_FORMATS[out_format][1], SPATIAL_INDEX='YES')
+    else:
+        inD.to_file(out_file, driver=OUTPUT_FORMATS[out_format][1])
+    return(out_file)
+
+def read_layer(in_file):
+    ''' read a single layer written by write_layer
+    '''
+    if in_file.endswith('.parquet'):
+        return(gpd.read_parquet(in_file))
+    return(gpd.read_file(in_file))
+
+def read_h3_stream(in_folder):
+    ''' read the h3 grid written in chunks by country_boundary.stream_h3_grid; this holds the whole grid in memory
+    '''
+    in_files = sorted(x for x in os.listdir(in_folder) if x.startswith('part-'))
+    return(pd.concat([gpd.read_parquet(os.path.join(in_folder, x)) for x in in_files]))
+
+def load_output(output_folder, max_workers=4, **kwargs):
+    ''' Rebuild a country_boundary from a folder written by country_boundary.write_output, without recomputing 
+        anything. The folder must contain the base layers (write_base=True).
+    
+        :param output_folder: folder written by write_output
+        :type output_folder: string
+        :param max_workers: number of layers to read in parallel, default is 4
+        :type max_workers: int, optional
+        :param kwargs: additional arguments passed to country_boundary, ie - verbose
+        :return: country_boundary with all layers in output_folder attached
+        :rtype: class:`country_boundary`
+    '''
+    with open(os.path.join(output_folder, 'metadata.json'), 'r') as in_json:
+        metadata = json.load(in_json)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_reads = {attr: executor.submit(read_layer, os.path.join(output_folder, in_file)) for attr, in_file in metadata['layers'].items()}
+        all_layers = {attr: cur_read.result() for attr, cur_read in all_reads.items()}
+    
+    if not 'wb_bounds' in all_layers or not 'geoBounds' in all_layers:
+        raise(ValueError(f"{output_folder} was written without the base layers (write_base=False)"))
+    kwargs.setdefault('out_folder', output_folder)
+    cb = country_boundary(metadata['iso3'], all_layers.pop('wb_bounds'), metadata['wb_id_col'], 
+                            geoBounds=all_layers.pop('geoBounds'), geoBounds_id_col=metadata['geoBounds_id_col'], **kwargs)
+    for attr, inD in all_layers.items():
+        if attr in H3_LAYERS:
+            # GeoJSON and FlatGeobuf do not store the index; the h3 grid is indexed by its h3 ids
+            inD.index = inD['shape_id'].values
+        setattr(cb, attr, inD)
+    if 'h3_data' in all_layers and cb.h3_data.shape[0] > 0:
+        cb.h3_grid = cb.h3_data.loc[:,['geometry', 'shape_id']]
+        cb.h3_cells = h3_cells(np.array([int(x, 16) for x in cb.h3_data.index], dtype=np.uint64),
+                                h3.h3_get_resolution(cb.h3_data.index[0]))
+    return(cb)
@@ -0,0 +1,59 @@
+import os, json, hashlib, pickle
+
+
+def checkpoint_key(*parts):
+    ''' hash of all inputs and parameters of a processing stage
+
+        :param parts: anything with a stable string representation; ie - geometry hashes, column names, parameters
+    '''
+    return(hashlib.sha1(json.dumps([str(x) for x in parts]).encode()).hexdigest()[:16])
+
+def column_hash(inD, column):
+    ''' hash of the values in a single column of a DataFrame
+    '''
+    return(hashlib.sha1(json.dumps([str(x) for x in inD[column].values]).encode()).hexdigest())
+
+def file_signature(in_file):
+    ''' identify an input file by its path, size and modification time; things that are not local files
+        (ie - urls, open rasterio datasets) are identified by their string representation
+    '''
+    if isinstance(in_file, str) and os.path.exists(in_file):
+        return(f'{in_file}:{os.path.getsize(in_file)}:{os.path.getmtime(in_file)}')
+    return(str(in_file))
+
+
+class checkpoint_store():
+    ''' Persist the outputs of processing stages on disk, keyed by stage name and a hash of the stage inputs
+
+        :param folder: folder in which to store checkpoints
+        :type folder: string
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def path(self, stage, key):
+        return(os.path.join(self.folder, f'{stage}_{key}.pkl'))
+
+    def load(self, stage, key):
+        ''' return the stored outputs of a stage, or None if the stage has not been run with these inputs
+        '''
+        in_file = self.path(stage, key)
+        if not os.path.exists(in_file):
+            return(None)
+        with open(in_file, 'rb') as in_pkl:
+            return(pickle.load(in_pkl))
+
+    def save(self, stage, key, data):
+        ''' store the outputs of a stage; written to a temporary file and renamed so an interrupted write
+            never leaves a partial checkpoint behind
+
+            :param data: outputs of the stage keyed by attribute name
+            :type data: dict
+        '''
+        out_file = self.path(stage, key)
+        with open(f'{out_file}.tmp', 'wb') as out_pkl:
+            pickle.dump(data, out_pkl, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{out_file}.tmp', out_file)
+        return(out_file)
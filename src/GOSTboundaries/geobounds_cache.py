@@ -0,0 +1,221 @@
+import os, json, time, tempfile, threading, contextlib
+
+import geopandas as gpd
+
+from urllib.request import urlopen
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+GEOBOUNDS_URL = 'https://www.geoboundaries.org/api/current/{release}/{iso3}/ADM{lvl}/'
+# metadata fields from the geoboundaries api used to decide if a cached file is still current
+FRESHNESS_FIELDS = ['boundaryID', 'buildDate', 'gjDownloadURL']
+# the index is read, edited and rewritten by every update; threads sharing a cache (ie - prefetching) take turns
+#   on this lock, and processes sharing a cache folder (ie - batch workers) on a lock file in the folder
+INDEX_LOCK = threading.RLock()
+
+
+def fetch_metadata(iso3, lvl=2, release='gbOpen', geobounds_url=GEOBOUNDS_URL):
+    ''' query the geoboundaries api for the metadata of the selected boundary
+    '''
+    response = urlopen(geobounds_url.format(iso3=iso3, lvl=lvl, release=release))
+    return(json.loads(response.read()))
+
+def download_geobounds(iso3, lvl=2, release='gbOpen', geobounds_url=GEOBOUNDS_URL):
+    ''' download the geoboundaries for the selected country without using a cache
+
+        :param iso3: 3-character iso3 string for country
+        :type iso3: string
+        :param lvl: admin boundary level, defaults to 2
+        :type lvl: int, optional
+        :param release: geoboundaries release type (gbOpen, gbHumanitarian, gbAuthoritative), defaults to gbOpen
+        :type release: string, optional
+    '''
+    metadata = fetch_metadata(iso3, lvl, release, geobounds_url)
+    return(gpd.read_file(metadata['gjDownloadURL']))
+
+
+class geobounds_cache():
+    ''' On-disk cache of geoboundaries downloads, stored as GeoParquet and keyed by iso3, admin level and release
+
+        :param cache_folder: folder in which to store the cached boundaries
+        :type cache_folder: string
+        :param max_size: maximum total size of the cache in bytes; least recently used entries are removed
+            once the cache grows beyond this size, default is 2 GB
+        :type max_size: int, optional
+        :param offline: never touch the network; only boundaries already in the cache can be returned, default is False
+        :type offline: boolean, optional
+        :param max_age: number of seconds a cached entry is trusted without checking the api metadata;
+            None always checks the metadata, default is None
+        :type max_age: int, optional
+    '''
+    def __init__(self, cache_folder, max_size=2*1024**3, offline=False, max_age=None):
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self.offline = offline
+        self.max_age = max_age
+        self.index_file = os.path.join(cache_folder, 'index.json')
+        self.lock_file = os.path.join(cache_folder, 'index.lock')
+        self.lock_depth = 0
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+
+    def cache_key(self, iso3, lvl, release):
+        return(f'{iso3}_ADM{lvl}_{release}')
+
+    def read_index(self):
+        if not os.path.exists(self.index_file):
+            return({})
+        with open(self.index_file, 'r') as in_file:
+            return(json.load(in_file))
+
+    def write_index(self, index):
+        ''' replace the index; readers see either the old or the new index, never a partial file
+        '''
+        def write(out_file):
+            with open(out_file, 'w') as out_json:
+                json.dump(index, out_json)
+        self.replace_file(self.index_file, write)
+
+    def replace_file(self, out_file, write):
+        ''' write a file under a unique temporary name in the cache folder and move it into place, so
+            processes writing the same file do not corrupt it
+        '''
+        handle, tmp_file = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        os.close(handle)
+        try:
+            write(tmp_file)
+            os.replace(tmp_file, out_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    @contextlib.contextmanager
+    def index_lock(self):
+        ''' hold the index across threads and processes while it is read, edited and rewritten
+        '''
+        with INDEX_LOCK:
+            if self.lock_depth > 0:
+                self.lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self.lock_depth -= 1
+                return
+            with open(self.lock_file, 'a+') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                self.lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self.lock_depth = 0
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+                    else:
+                        lock.seek(0)
+                        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def fetch_metadata(self, iso3, lvl, release, geobounds_url=GEOBOUNDS_URL):
+        ''' query the geoboundaries api for the metadata of the selected boundary
+        '''
+        return(fetch_metadata(iso3, lvl, release, geobounds_url))
+
+    def get(self, iso3, lvl=2, release='gbOpen', geobounds_url=GEOBOUNDS_URL):
+        ''' return the geoboundaries for the selected country, from the cache if it is current, otherwise
+            downloaded and added to the cache
+
+            :param iso3: 3-character iso3 string for country
+            :type iso3: string
+            :param lvl: admin boundary level, defaults to 2
+            :type lvl: int, optional
+            :param release: geoboundaries release type (gbOpen, gbHumanitarian, gbAuthoritative), defaults to gbOpen
+            :type release: string, optional
+            :param geobounds_url: url template for the geoboundaries api
+            :type geobounds_url: string, optional
+        '''
+        key = self.cache_key(iso3, lvl, release)
+        index = self.read_index()
+        entry = index.get(key)
+        if entry is not None and not os.path.exists(os.path.join(self.cache_folder, entry['file'])):
+            entry = None
+
+        if self.offline:
+            if entry is None:
+                raise(ValueError(f"{key} is not in the geoboundaries cache and offline is set"))
+            return(self.load(key))
+
+        if entry is not None and self.max_age is not None and (time.time() - entry['fetched']) < self.max_age:
+            return(self.load(key))
+
+        metadata = self.fetch_metadata(iso3, lvl, release, geobounds_url)
+        metadata = {x:metadata.get(x) for x in FRESHNESS_FIELDS}
+        if entry is not None and entry['metadata'] == metadata:
+            entry['fetched'] = time.time()
+            self.update_entry(key, entry)
+            return(self.load(key))
+
+        geoBounds = gpd.read_file(metadata['gjDownloadURL'])
+        self.store(key, geoBounds, metadata)
+        return(geoBounds)
+
+    def load(self, key):
+        ''' read a cached boundary and mark it as recently used
+        '''
+        entry = self.read_index()[key]
+        geoBounds = gpd.read_parquet(os.path.join(self.cache_folder, entry['file']))
+        with self.index_lock():
+            # another process may have evicted or replaced the entry in the meantime
+            index = self.read_index()
+            if key in index:
+                index[key]['last_access'] = time.time()
+                self.write_index(index)
+        return(geoBounds)
+
+    def store(self, key, geoBounds, metadata):
+        ''' write a boundary to the cache and evict least recently used entries to stay below max_size
+        '''
+        out_file = f'{key}.parquet'
+        self.replace_file(os.path.join(self.cache_folder, out_file), geoBounds.to_parquet)
+        cur_time = time.time()
+        entry = {'file':out_file, 'metadata':metadata, 'fetched':cur_time, 'last_access':cur_time,
+                    'size':os.path.getsize(os.path.join(self.cache_folder, out_file))}
+        self.update_entry(key, entry)
+        self.evict(keep=key)
+
+    def update_entry(self, key, entry):
+        with self.index_lock():
+            index = self.read_index()
+            index[key] = entry
+            self.write_index(index)
+
+    def evict(self, keep=None):
+        ''' remove least recently used entries until the cache is smaller than max_size
+
+            :param keep: key of entry never to remove, ie - the entry that was just written
+            :type keep: string, optional
+        '''
+        with self.index_lock():
+            index = self.read_index()
+            total_size = sum(x['size'] for x in index.values())
+            for key, entry in sorted(index.items(), key=lambda x: x[1]['last_access']):
+                if total_size <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.cache_folder, entry['file']))
+                except FileNotFoundError:
+                    pass
+                total_size = total_size - entry['size']
+                del index[key]
+            self.write_index(index)
+            return(total_size)
@@ -0,0 +1,133 @@
+import shapely
+
+import numpy as np
+import geopandas as gpd
+
+from h3.api import numpy_int as h3_int
+
+
+class h3_cells():
+    ''' Compact h3 grid stored as an array of uint64 h3 indexes; polygons are only created when requested
+
+        :param cells: h3 indexes of the cells in the grid
+        :type cells: numpy.array of uint64
+        :param level: h3 resolution of the cells
+        :type level: int
+    '''
+    def __init__(self, cells, level):
+        self.cells = np.asarray(cells, dtype=np.uint64)
+        self.level = level
+
+    def __len__(self):
+        return(len(self.cells))
+
+    def subset(self, sel):
+        ''' return a new h3_cells with the cells selected by a boolean mask or array of positions
+        '''
+        return(h3_cells(self.cells[sel], self.level))
+
+    def children(self, level):
+        ''' return the children of every cell at a finer level as a new h3_cells
+        '''
+        if len(self.cells) == 0:
+            return(h3_cells([], level))
+        return(h3_cells(np.concatenate([h3_int.h3_to_children(x, level) for x in self.cells.tolist()]), level))
+
+    def neighbours(self, k=1):
+        ''' return the cells, and all cells within k steps of them, as a new h3_cells
+        '''
+        if len(self.cells) == 0:
+            return(h3_cells([], self.level))
+        return(h3_cells(np.unique(np.concatenate([h3_int.k_ring(x, k) for x in self.cells.tolist()])), self.level))
+
+    def ids(self):
+        ''' h3 indexes as hexadecimal strings, as used in the shape_id column of the h3 grid
+        '''
+        return(np.array([format(x, 'x') for x in self.cells.tolist()], dtype=object))
+
+    def centroids(self):
+        ''' centre of each cell as an array of shapely points
+        '''
+        coords = np.array([h3_int.h3_to_geo(x) for x in self.cells.tolist()]).reshape(-1, 2)
+        return(shapely.points(coords[:,1], coords[:,0]))
+
+    def polygons(self):
+        ''' boundary of each cell as an array of shapely polygons. Polygons are built in bulk for all
+            cells with the same number of vertices (hexagons, pentagons and cells with distortion vertices)
+        '''
+        boundaries = [h3_int.h3_to_geo_boundary(x, geo_json=True) for x in self.cells.tolist()]
+        n_vertices = np.array([len(x) for x in boundaries])
+        polys = np.empty(len(boundaries), dtype=object)
+        for cur_n in np.unique(n_vertices):
+            sel = np.where(n_vertices == cur_n)[0]
+            coords = np.array([boundaries[x] for x in sel])
+            polys[sel] = shapely.polygons(coords)
+        return(polys)
+
+    def to_geodataframe(self):
+        ''' h3 grid as a GeoDataFrame indexed by h3 id, with geometry and shape_id columns
+        '''
+        ids = self.ids()
+        h3_grid = gpd.GeoDataFrame({'geometry':self.polygons()}, index=ids, geometry='geometry', crs=4326)
+        h3_grid['shape_id'] = ids
+        return(h3_grid)
+
+def polyfill_cells(geom, level):
+    ''' Generate the h3 cells whose centres are inside a (multi)polygon
+
+        :param geom: area to fill with h3 cells
+        :type geom: shapely.Polygon, shapely.MultiPolygon or shapely.GeometryCollection
+        :param level: h3 resolution of the grid
+        :type level: int
+        :return: unique h3 cells covering geom
+        :rtype: class:`h3_cells`
+    '''
+    # collections (ie - from an intersection) can contain multipolygons and lines; only polygons are filled
+    parts = shapely.get_parts(shapely.get_parts(geom))
+    parts = parts[shapely.get_type_id(parts) == 3]
+    all_cells = [h3_int.polyfill(shapely.geometry.mapping(cPoly), level, geo_json_conformant=True) for cPoly in parts]
+    if len(all_cells) == 0:
+        return(h3_cells([], level))
+    # Parts of a multipolygon can share cells along their edges; deduplicate once after all parts are filled
+    return(h3_cells(np.unique(np.concatenate(all_cells)), level))
+
+def chunk_boxes(bounds, level, chunk_cells=250000):
+    ''' Split an area into square boxes that each contain about chunk_cells h3 cells at level (fewer away
+        from the equator)
+
+        :param bounds: [xmin, ymin, xmax, ymax] of the area in degrees
+        :type bounds: list of floats
+        :return: [xmin, ymin, xmax, ymax] of each box; boxes extend past the maximum bounds
+        :rtype: numpy.array
+    '''
+    # degrees are about 111.32 km at the equator
+    size = np.sqrt(chunk_cells * h3_int.hex_area(level, 'km^2')) / 111.32
+    xs = bounds[0] + size * np.arange(int(np.floor((bounds[2] - bounds[0]) / size)) + 1)
+    ys = bounds[1] + size * np.arange(int(np.floor((bounds[3] - bounds[1]) / size)) + 1)
+    xmin, ymin = [x.ravel() for x in np.meshgrid(xs, ys)]
+    return(np.c_[xmin, ymin, xmin + size, ymin + size])
+
+def polyfill_box(geom, box, level):
+    ''' Generate the h3 cells whose centres are inside geom and inside box. Boxes are half-open (a centre on
+        the maximum edges belongs to the next box), so the cells of adjacent boxes never overlap and together
+        equal polyfill_cells of geom
+
+        :param geom: prepared area to fill with h3 cells
+        :type geom: shapely.Polygon or shapely.MultiPolygon
+        :param box: [xmin, ymin, xmax, ymax] of the box
+        :type box: list of floats
+        :rtype: class:`h3_cells`
+    '''
+    xmin, ymin, xmax, ymax = box
+    # fill a slightly larger box, so centres on the edges of box are never left out by polyfill
+    margin = (xmax - xmin) * 0.01
+    fill_box = shapely.box(xmin - margin, ymin - margin, xmax + margin, ymax + margin)
+    cells = h3_cells(h3_int.polyfill(shapely.geometry.mapping(fill_box), level, geo_json_conformant=True), level)
+    if len(cells) == 0:
+        return(cells)
+    centres = cells.centroids()
+    x, y = shapely.get_x(centres), shapely.get_y(centres)
+    inside = (x >= xmin) & (x < xmax) & (y >= ymin) & (y < ymax)
+    if not shapely.contains_properly(geom, shapely.box(xmin, ymin, xmax, ymax)):
+        inside = inside & shapely.contains_xy(geom, x, y)
+    return(cells.subset(inside))
@@ -0,0 +1,56 @@
+import hashlib, shapely
+
+import numpy as np
+import pandas as pd
+
+
+def feature_hashes(inD, id_col):
+    ''' hash of the geometry of every feature in an admin dataset
+
+        :return: sha1 of the WKB of each geometry, indexed by id_col
+        :rtype: class:`pandas.Series`
+    '''
+    wkb = shapely.to_wkb(np.asarray(inD['geometry']))
+    return(pd.Series([hashlib.sha1(x).hexdigest() for x in wkb], index=inD[id_col].values))
+
+def diff_bounds(old_bounds, new_bounds, id_col):
+    ''' Identify the features that were added, removed or edited between two versions of an admin dataset;
+        features are compared by id and the hash of their geometry
+
+        :param old_bounds: previous version of the admin dataset
+        :type old_bounds: class:`geopandas.GeoDataFrame`
+        :param new_bounds: new version of the admin dataset
+        :type new_bounds: class:`geopandas.GeoDataFrame`
+        :param id_col: column with a unique id in both datasets
+        :type id_col: string
+        :return: ids of added, removed, changed and unchanged features
+        :rtype: dict of lists
+    '''
+    old_hash = feature_hashes(old_bounds, id_col)
+    new_hash = feature_hashes(new_bounds, id_col)
+    common = old_hash.index.intersection(new_hash.index)
+    edited = old_hash.loc[common] != new_hash.loc[common]
+    return({'added':new_hash.index.difference(old_hash.index).tolist(),
+                'removed':old_hash.index.difference(new_hash.index).tolist(),
+                'changed':common[edited.values].tolist(),
+                'unchanged':common[~edited.values].tolist()})
+
+def patch_rows(old_res, old_ids, new_res, new_res_ids, final_ids):
+    ''' Combine results calculated for the unchanged features of a dataset with results recalculated for the
+        edited features. Zonal results are stored by position; this re-orders them to match the new dataset
+
+        :param old_res: results for every feature of the previous dataset, in the order of old_ids
+        :type old_res: class:`pandas.DataFrame`
+        :param new_res: results for the recalculated features, in the order of new_res_ids
+        :type new_res: class:`pandas.DataFrame`
+        :param final_ids: ids of the new dataset, defining the order of the output
+        :return: results for every feature in final_ids
+        :rtype: class:`pandas.DataFrame`
+    '''
+    old_res = old_res.copy()
+    old_res.index = old_ids
+    new_res = new_res.copy()
+    new_res.index = new_res_ids
+    keep = old_res.loc[~old_res.index.isin(new_res.index)]
+    combined = pd.concat([keep, new_res])
+    return(combined.loc[final_ids].reset_index(drop=True))
@@ -0,0 +1,289 @@
+import os, io, json, time, threading, functools, cProfile, pstats
+
+import shapely
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+try:
+    import psutil
+except ImportError:
+    # without psutil, memory is only measured where /proc/self/statm exists (linux)
+    psutil = None
+
+# writing 5 to clear_refs resets the high-water mark of resident memory (VmHWM) to the current usage
+CLEAR_REFS = '/proc/self/clear_refs'
+PROC_STATUS = '/proc/self/status'
+PROC_STATM = '/proc/self/statm'
+
+
+def proc_status_mb(field):
+    ''' value of a memory field of /proc/self/status (ie - VmRSS, VmHWM) in MB, None if it cannot be read
+    '''
+    try:
+        with open(PROC_STATUS) as in_status:
+            for line in in_status:
+                if line.startswith(f'{field}:'):
+                    return(int(line.split()[1]) / 1024)
+    except OSError:
+        pass
+    return(None)
+
+def rss_mb():
+    ''' current resident memory of this process in MB, None if it cannot be measured
+    '''
+    try:
+        # the second field of statm is the number of resident pages
+        with open(PROC_STATM) as in_statm:
+            return(int(in_statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2)
+    except (OSError, AttributeError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        return(psutil.Process().memory_info().rss / 1024**2)
+    return(None)
+
+def reset_peak_rss():
+    ''' reset the high-water mark of resident memory to the current usage. This is process wide: ru_maxrss
+        and any outside monitoring of the peak memory of the process are reset as well
+
+        :return: False where this is not supported
+        :rtype: boolean
+    '''
+    try:
+        with open(CLEAR_REFS, 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return(False)
+    return(proc_status_mb('VmHWM') is not None)
+
+def data_size(inD):
+    ''' number of rows and vertices in a (Geo)DataFrame, or summed over a list or dict of them
+
+        :return: [rows, vertices]; vertices is 0 for tables without geometry
+    '''
+    if isinstance(inD, gpd.GeoSeries):
+        return([len(inD), int(shapely.get_num_coordinates(np.asarray(inD)).sum())])
+    if isinstance(inD, gpd.GeoDataFrame) and inD._geometry_column_name in inD.columns:
+        return(data_size(inD.geometry))
+    if isinstance(inD, pd.DataFrame):
+        return([inD.shape[0], 0])
+    if hasattr(inD, 'cells'):
+        # compact h3 grid (h3_helper.h3_cells)
+        return([len(inD), 0])
+    if isinstance(inD, dict):
+        inD = list(inD.values())
+    if isinstance(inD, (list, tuple)):
+        sizes = [data_size(x) for x in inD]
+        return([sum(x[0] for x in sizes), sum(x[1] for x in sizes)])
+    return([0, 0])
+
+def instrumented_stage(stage, inputs=None):
+    ''' decorator recording a country_boundary method as a stage in its stage_recorder
+
+        :param stage: name of the stage
+        :type stage: string
+        :param inputs: function returning the input datasets of the stage from the country_boundary; by default
+            the (Geo)DataFrames passed as arguments are used
+        :type inputs: function, optional
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            recorder = getattr(self, 'stage_recorder', None)
+            if recorder is None:
+                return(func(self, *args, **kwargs))
+            if inputs is None:
+                in_data = [x for x in list(args) + list(kwargs.values()) if isinstance(x, pd.DataFrame)]
+            else:
+                in_data = inputs(self)
+            return(recorder.run(stage, func, self, args, kwargs, in_data))
+        return(wrapper)
+    return(decorator)
+
+
+class stage_recorder():
+    ''' Record wall time, peak memory, and input/output row and vertex counts for each stage of a country_boundary.
+        Memory is recorded as the resident memory at the start of the stage (start_rss_mb) and the increase of the
+        peak during the stage over it (peak_rss_increase_mb). The peak is sampled every memory_interval seconds in
+        a background thread, so allocations shorter than the interval can be missed
+
+        :param callbacks: functions called with the record (dict) of every completed stage
+        :type callbacks: list of functions, optional
+        :param profiler: profile each top level stage with 'cprofile' or 'pyinstrument', default is None (no profiling)
+        :type profiler: string, optional
+        :param profile_folder: folder to write profiles; if None, text summaries of the profiles are kept in self.profiles
+        :type profile_folder: string, optional
+        :param memory_interval: seconds between samples of resident memory, default is 0.05
+        :type memory_interval: float, optional
+        :param reset_peak: on linux, read the exact peak from the kernel high-water mark, reset through
+            /proc/self/clear_refs at the start of every stage, instead of sampling. This resets the peak memory
+            of the whole process (ru_maxrss, VmHWM) seen by any other monitoring, default is False
+        :type reset_peak: boolean, optional
+    '''
+    def __init__(self, callbacks=None, profiler=None, profile_folder=None, memory_interval=0.05, reset_peak=False):
+        self.callbacks = [] if callbacks is None else list(callbacks)
+        self.profiler = profiler
+        self.profile_folder = profile_folder
+        self.records = []
+        self.profiles = {}
+        self.json_file = None
+        self.depth = 0
+        self.memory_interval = memory_interval
+        self.use_hwm = None if reset_peak else False
+        # peak resident memory of each running stage, outermost stage first
+        self.peaks = []
+        self.peak_lock = threading.Lock()
+        self.sampler = None
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def run(self, stage, func, cb, args, kwargs, in_data):
+        ''' run a single stage, recording its performance
+        '''
+        in_size = self.measure(in_data)
+        record = {'iso3':getattr(cb, 'iso3', ''), 'stage':stage, 'depth':self.depth, 'start':time.time(),
+                    'input_rows':in_size[0], 'input_vertices':in_size[1]}
+        profiler = self.start_profile() if self.depth == 0 else None
+        self.depth = self.depth + 1
+        start_rss = self.start_memory()
+        start = time.perf_counter()
+        try:
+            res = func(cb, *args, **kwargs)
+            record['status'] = 'complete'
+        except Exception as e:
+            record['status'] = f'failed: {type(e).__name__}'
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['start_rss_mb'] = None if start_rss is None else round(start_rss, 2)
+            record['peak_rss_increase_mb'] = self.stop_memory(start_rss)
+            self.depth = self.depth - 1
+            if profiler is not None:
+                record['profile'] = self.stop_profile(profiler, stage, len(self.records))
+            if record['status'] == 'complete':
+                out_size = self.measure(res)
+                record['output_rows'] = out_size[0]
+                record['output_vertices'] = out_size[1]
+            self.add_record(record)
+        return(res)
+
+    def measure(self, inD):
+        ''' data_size of the inputs or outputs of a stage; failing to measure them does not fail the stage
+        '''
+        try:
+            return(data_size(inD))
+        except Exception:
+            return([None, None])
+
+    def start_memory(self):
+        ''' start tracking the peak resident memory of a stage
+
+            :return: resident memory at the start of the stage in MB, None if it cannot be measured
+        '''
+        rss = rss_mb()
+        if rss is None:
+            return(None)
+        if self.use_hwm is None:
+            self.use_hwm = reset_peak_rss()
+        with self.peak_lock:
+            if self.use_hwm:
+                # the high-water mark so far belongs to the stages already running; keep it before it is reset
+                hwm = proc_status_mb('VmHWM')
+                self.peaks = [max(x, hwm) for x in self.peaks]
+                reset_peak_rss()
+            self.peaks.append(rss)
+        if not self.use_hwm and self.sampler is None:
+            stop = threading.Event()
+            self.sampler = [threading.Thread(target=self.sample_memory, args=(stop,), daemon=True), stop]
+            self.sampler[0].start()
+        return(rss)
+
+    def stop_memory(self, start_rss):
+        ''' stop tracking the innermost running stage
+
+            :return: increase of the peak resident memory during the stage over start_rss, in MB
+        '''
+        if start_rss is None:
+            return(None)
+        with self.peak_lock:
+            peak = self.peaks.pop()
+            cur_peak = proc_status_mb('VmHWM') if self.use_hwm else rss_mb()
+            if cur_peak is not None:
+                peak = max(peak, cur_peak)
+            if len(self.peaks) > 0:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            stop_sampler = len(self.peaks) == 0 and self.sampler is not None
+        if stop_sampler:
+            self.sampler[1].set()
+            self.sampler[0].join()
+            self.sampler = None
+        return(round(peak - start_rss, 2))
+
+    def sample_memory(self, stop):
+        while not stop.wait(self.memory_interval):
+            rss = rss_mb()
+            if rss is None:
+                continue
+            with self.peak_lock:
+                self.peaks = [max(x, rss) for x in self.peaks]
+
+    def add_record(self, record):
+        self.records.append(record)
+        for callback in self.callbacks:
+            callback(record)
+        if self.json_file is not None and record['depth'] == 0:
+            self.to_json(self.json_file)
+
+    def start_profile(self):
+        if self.profiler is None:
+            return(None)
+        if self.profiler == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            raise(ValueError(f"Unknown profiler {self.profiler}"))
+        return(profiler)
+
+    def stop_profile(self, profiler, stage, stage_idx):
+        ''' stop profiling a stage and store the profile; returns the path of the written profile or the
+            key of the profile in self.profiles
+        '''
+        key = f'{stage_idx:03d}_{stage}'
+        if self.profiler == 'cprofile':
+            profiler.disable()
+        else:
+            profiler.stop()
+        if self.profile_folder is None:
+            if self.profiler == 'cprofile':
+                out_stream = io.StringIO()
+                pstats.Stats(profiler, stream=out_stream).sort_stats('cumulative').print_stats(30)
+                self.profiles[key] = out_stream.getvalue()
+            else:
+                self.profiles[key] = profiler.output_text()
+            return(key)
+        
+        if not os.path.exists(self.profile_folder):
+            os.makedirs(self.profile_folder)
+        if self.profiler == 'cprofile':
+            out_file = os.path.join(self.profile_folder, f'{key}.prof')
+            profiler.dump_stats(out_file)
+        else:
+            out_file = os.path.join(self.profile_folder, f'{key}.html')
+            with open(out_file, 'w') as out_html:
+                out_html.write(profiler.output_html())
+        return(out_file)
+
+    def summary(self):
+        ''' recorded stages as a DataFrame
+        '''
+        return(pd.DataFrame(self.records))
+
+    def to_json(self, out_file):
+        with open(out_file, 'w') as out_json:
+            json.dump(self.records, out_json, indent=2)
@@ -0,0 +1,181 @@
+import os, json, itertools
+
+import pandas as pd
+
+from GOSTRocks.misc import tPrint
+
+from GOSTboundaries.boundary_helper import country_boundary, write_layer, OUTPUT_FORMATS
+from GOSTboundaries.instrument import instrumented_stage
+
+
+class multi_boundary():
+    ''' Compare any number of admin datasets for a country against a reference dataset, ie - the WB medium
+        resolution bounds, IMA high resolution bounds, and geoboundaries snapped to either. The h3 grid, the
+        spatial index of each dataset and the raster reads of the zonal statistics are shared by all
+        datasets, instead of repeating them for every pair in country_boundary
+
+        :param iso3: 3-character iso3 string for country (ie - KEN for Kenya)
+        :type iso3: string
+        :param datasets: admin datasets to compare, keyed by name
+        :type datasets: dict of class:`geopandas.GeoDataFrame`
+        :param id_cols: column with unique id in each dataset, keyed by name
+        :type id_cols: dict of strings
+        :param reference: name of the dataset all others are matched to, default is the first dataset
+        :type reference: string, optional
+        :param recorder: records time, memory and data sizes of each processing stage
+        :type recorder: class:`GOSTboundaries.instrument.stage_recorder`, optional
+    '''
+    def __init__(self, iso3, datasets, id_cols, reference=None, out_folder="/home/wb411133/projects/BOUNDARIES/{sel_iso3}",
+                    verbose=False, recorder=None):
+        self.iso3 = iso3
+        self.datasets = dict(datasets)
+        self.id_cols = dict(id_cols)
+        self.reference = list(self.datasets.keys())[0] if reference is None else reference
+        if not self.reference in self.datasets:
+            raise(ValueError(f"reference {self.reference} is not one of the datasets"))
+        ref_data = self.datasets[self.reference]
+        for name, inD in self.datasets.items():
+            if inD.crs != ref_data.crs:
+                raise(ValueError(f"CRS of {name} does not match {self.reference}"))
+        self.verbose = verbose
+        # the matching, h3 and zonal tools of country_boundary are used with the reference as wb_bounds
+        self.base = country_boundary(iso3, ref_data, self.id_cols[self.reference], out_folder=out_folder, geoBounds=ref_data,
+                                        geoBounds_id_col=self.id_cols[self.reference], verbose=verbose, recorder=recorder)
+        self.out_folder = self.base.out_folder
+        self.stage_recorder = self.base.stage_recorder
+        self.indexes = {}
+
+    def spatial_index(self, name):
+        ''' spatial index of a dataset, built on first use and shared by every match against it
+        '''
+        if not name in self.indexes:
+            self.indexes[name] = self.base.spatial_index(self.datasets[name])
+        return(self.indexes[name])
+
+    def match_all(self, method='strtree'):
+        ''' Attach the id of the reference feature each feature of every other dataset is matched to (ref_match_id)
+            and the percent of the feature it covers (ref_match_per)
+        '''
+        ref_data = self.datasets[self.reference]
+        for name, inD in self.datasets.items():
+            if name == self.reference or 'ref_match_id' in inD.columns:
+                continue
+            res = self.base.match_datasets(inD.copy(), ref_data, self.id_cols[name], self.id_cols[self.reference],
+                                            label=f"Matching {name} to {self.reference}", method=method, index=self.spatial_index(self.reference))
+            inD = inD.copy()
+            inD['ref_match_id'] = res['geo_match_id'].astype(str).values
+            inD['ref_match_per'] = res['geo_match_per'].values
+            self.datasets[name] = inD
+
+    def ref_ids(self, name):
+        ''' reference id of every feature of a dataset, keyed by the feature id as a string
+        '''
+        inD = self.datasets[name]
+        ids = inD[self.id_cols[name]].astype(str).values
+        if name == self.reference:
+            return(pd.Series(ids, index=ids))
+        return(pd.Series(inD['ref_match_id'].values, index=ids))
+
+    @instrumented_stage('generate_multi_h3', inputs=lambda self: list(self.datasets.values()))
+    def generate_h3_grid(self, level=6, method='strtree'):
+        ''' Create one h3 grid over the reference dataset and attach every dataset to it. For each dataset,
+            {name}_id is the reference id of the feature covering most of the cell (for the reference
+            itself, its own id) and {name}_per the percent of the cell covered by that feature
+
+            :param level: h3 resolution of the grid, default is 6
+            :type level: int, optional
+            :param method: matching engine passed to match_datasets, default is 'strtree'
+            :type method: string, optional
+        '''
+        self.match_all(method=method)
+        h3_grid = self.base.generate_h3_grid(level=level)
+        h3_data = h3_grid.loc[:,['geometry', 'shape_id']].copy()
+        for name, inD in self.datasets.items():
+            res = self.base.match_datasets(h3_grid.loc[:,['geometry', 'shape_id']].copy(), inD, 'shape_id', self.id_cols[name],
+                                            label=f"Matching h3 to {name}", method=method, index=self.spatial_index(name))
+            ref_ids = self.ref_ids(name)
+            ids = res['geo_match_id'].astype(str)
+            h3_data[f'{name}_id'] = ids.map(ref_ids).fillna('').values
+            h3_data[f'{name}_per'] = res['geo_match_per'].values
+        self.h3_data = h3_data
+        return(h3_data)
+
+    def agreement(self):
+        ''' Agreement between every pair of datasets, as the share of h3 cells assigned to the same reference
+            unit, for each unit of the reference dataset (admin_agreement) and for the whole country (agreement_matrix)
+
+            :return: reference features with an agree_{name1}_{name2} column for each pair of datasets
+            :rtype: class:`geopandas.GeoDataFrame`
+        '''
+        if not hasattr(self, 'h3_data'):
+            raise(ValueError("Need to run generate_h3_grid before calculating agreement"))
+        names = list(self.datasets.keys())
+        ref_col = f'{self.reference}_id'
+        matrix = pd.DataFrame(1.0, index=names, columns=names)
+        per_unit = pd.DataFrame(index=pd.Index(self.h3_data[ref_col].unique(), name=ref_col))
+        for name1, name2 in itertools.combinations(names, 2):
+            same = pd.Series(self.h3_data[f'{name1}_id'].values == self.h3_data[f'{name2}_id'].values)
+            matrix.loc[name1, name2] = matrix.loc[name2, name1] = same.mean()
+            per_unit[f'agree_{name1}_{name2}'] = same.groupby(self.h3_data[ref_col].values).mean()
+        per_unit['h3_cells'] = self.h3_data.groupby(ref_col).size()
+        self.agreement_matrix = matrix
+        ref_data = self.datasets[self.reference]
+        admin_agreement = ref_data.loc[:,[self.id_cols[self.reference], 'geometry']].copy()
+        unit_res = per_unit.reindex(ref_data[self.id_cols[self.reference]].astype(str).values)
+        for col in unit_res.columns:
+            admin_agreement[col] = unit_res[col].values
+        self.admin_agreement = admin_agreement
+        return(admin_agreement)
+
+    @instrumented_stage('run_multi_zonal', inputs=lambda self: list(self.datasets.values()))
+    def run_zonal(self, file_defs, engine='shared', max_memory=256*1024**2):
+        ''' run zonal statistics of every raster for every dataset; with the shared engine each raster is read
+            once for all datasets. See country_boundary.run_zonal for file_defs
+
+            :return: zonal results by raster name and dataset name
+            :rtype: dict
+        '''
+        self.zonal_res = self.base.run_zonal_layers(file_defs, self.datasets, engine=engine, max_memory=max_memory)
+        return(self.zonal_res)
+
+    def compare_zonal(self, raster_name, column):
+        ''' sum a zonal statistic of every dataset by reference unit, ie - the nighttime lights (NTL, NTL_SUM)
+            of the features matched to each reference unit
+
+            :return: one row per reference unit, one column per dataset
+            :rtype: class:`pandas.DataFrame`
+        '''
+        self.match_all()
+        comp = {}
+        for name in self.datasets.keys():
+            values = pd.Series(self.zonal_res[raster_name][name][column].values, index=self.ref_ids(name).values)
+            comp[name] = values.groupby(level=0).sum()
+        comp = pd.DataFrame(comp)
+        return(comp.loc[comp.index != ''])
+
+    def run_all(self, h3_level=6, h3_match_method='strtree', file_defs=None, engine='shared'):
+        ''' match all datasets to the reference, attach them to one h3 grid and calculate their agreement;
+            zonal statistics are calculated if file_defs is defined
+        '''
+        self.match_all(method=h3_match_method)
+        self.generate_h3_grid(level=h3_level, method=h3_match_method)
+        self.agreement()
+        if file_defs is not None:
+            self.run_zonal(file_defs, engine=engine)
+        if self.verbose:
+            tPrint(f"{self.iso3}: mean agreement\n{self.agreement_matrix}")
+
+    def write_output(self, output_folder, out_format='geojson'):
+        ''' write the h3 grid, the agreement of each reference unit and the country agreement matrix (agreement.csv)
+        '''
+        if not out_format in OUTPUT_FORMATS:
+            raise(ValueError(f"out_format must be one of {list(OUTPUT_FORMATS.keys())}"))
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        for layer_name, attr in {'h3_multi':'h3_data', 'admin_agreement':'admin_agreement'}.items():
+            if hasattr(self, attr):
+                write_layer(getattr(self, attr), os.path.join(output_folder, f'{layer_name}{OUTPUT_FORMATS[out_format][0]}'), out_format)
+        if hasattr(self, 'agreement_matrix'):
+            self.agreement_matrix.to_csv(os.path.join(output_folder, 'agreement.csv'))
+        with open(os.path.join(output_folder, 'multi_metadata.json'), 'w') as out_json:
+            json.dump({'iso3':self.iso3, 'reference':self.reference, 'id_cols':self.id_cols}, out_json, indent=2)
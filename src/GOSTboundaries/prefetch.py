@@ -0,0 +1,47 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from GOSTboundaries.geobounds_cache import GEOBOUNDS_URL, download_geobounds
+
+
+def prefetch(items, fetch, max_workers=4, ahead=None):
+    ''' Call fetch on each item in a pool of threads while the caller works on earlier items. Results are
+        yielded in the order of items; at most ahead calls are started before their result is consumed, which
+        bounds both the number of open connections and the downloads held in memory
+
+        :param items: items to fetch, in the order they will be processed
+        :type items: iterable
+        :param fetch: function called with each item
+        :type fetch: function
+        :param max_workers: number of concurrent calls to fetch, default is 4
+        :type max_workers: int, optional
+        :param ahead: number of items fetched ahead of the item being processed, default is 2 * max_workers
+        :type ahead: int, optional
+        :return: generator of [item, future]; the future raises the error of fetch, if any, when its result is read
+    '''
+    ahead = 2 * max_workers if ahead is None else max(ahead, 1)
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            for item in items:
+                pending.append([item, executor.submit(fetch, item)])
+                return(True)
+            return(False)
+
+        while len(pending) < ahead and submit_next():
+            pass
+        while len(pending) > 0:
+            item, fut = pending.popleft()
+            # keep ahead downloads running while the caller works on this item
+            submit_next()
+            yield([item, fut])
+
+def geobounds_fetcher(lvl=2, release='gbOpen', geobounds_url=GEOBOUNDS_URL, cache=None):
+    ''' function returning the geoboundaries of an iso3 code, read through cache if it is defined, for use with prefetch
+    '''
+    def fetch(iso3):
+        if cache is not None:
+            return(cache.get(iso3, lvl=lvl, release=release, geobounds_url=geobounds_url))
+        return(download_geobounds(iso3, lvl=lvl, release=release, geobounds_url=geobounds_url))
+    return(fetch)
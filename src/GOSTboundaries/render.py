@@ -0,0 +1,149 @@
+import os, functools, traceback, multiprocessing
+
+import contextily as ctx
+import matplotlib.patches as mpatches
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from GOSTRocks.misc import tPrint
+
+# Stamen basemaps are now served by Stadia and need an api key; CartoDB Positron is a similar, open background
+BASEMAP = ctx.providers.CartoDB.PositronNoLabels
+# maps that can be rendered for a country by render_country, and the country_boundary layer each one needs
+STATIC_MAPS = {'lc':'wb_mapped', 'h3':'h3_data', 'ntl':'wb_mapped'}
+
+
+def set_basemap_cache(cache_folder):
+    ''' store basemap tiles downloaded by contextily in cache_folder; tiles are reused across maps, runs and
+        processes, and maps of areas already in the cache render without network access
+    '''
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    ctx.set_cache_dir(cache_folder)
+
+def add_basemap(ax, crs, source=None):
+    ''' add a basemap to ax; maps are still created without a basemap if the tiles cannot be fetched (ie - offline
+        and not in the basemap cache)
+
+        :param source: contextily tile provider, default is BASEMAP; False to skip the basemap
+        :return: True if the basemap was added
+        :rtype: boolean
+    '''
+    if source is False:
+        return(False)
+    try:
+        ctx.add_basemap(ax, source=BASEMAP if source is None else source, crs=crs)
+        return(True)
+    except Exception as e:
+        tPrint(f"Basemap not added: {type(e).__name__}: {e}")
+        return(False)
+
+@functools.lru_cache(maxsize=8)
+def read_esa_legend(esa_legend):
+    ''' colours and labels of the ESA landcover classes, keyed by LC_{value}; each legend file is read once per
+        process, the returned dictionaries are shared and should not be edited
+    '''
+    esa_data = pd.read_csv(esa_legend)
+    esa_data['Value'] = esa_data['Value'].apply(lambda x: f'LC_{x}')
+    esa_dict   = dict(zip(esa_data['Value'], esa_data['Hex']))
+    esa_labels = dict(zip(esa_data['Value'], esa_data['Shortname']))
+    return(esa_dict, esa_labels)
+
+def draw_classes(ax, inD, class_col, colors, labels=None, edgecolors=None, linewidth=0.2, **kwargs):
+    ''' draw all features of inD with a single collection, coloured by class, instead of one plot per class
+
+        :param class_col: column in inD with the class of each feature
+        :type class_col: string
+        :param colors: fill colour of each class
+        :type colors: dict
+        :param labels: legend label of each class, default is the class
+        :type labels: dict, optional
+        :param edgecolors: edge colour of each class, default is the fill colour
+        :type edgecolors: dict, optional
+        :return: legend patches with the number of features in each class, in the order of the categories or sorted classes
+        :rtype: list of class:`matplotlib.patches.Patch`
+    '''
+    inD = inD.loc[inD[class_col].notna()]
+    if inD.shape[0] == 0:
+        return([])
+    classes = inD[class_col].astype(object)
+    face = classes.map(colors).values
+    edge = face if edgecolors is None else classes.map(edgecolors).values
+    inD.plot(ax=ax, color=face, edgecolor=edge, linewidth=linewidth, **kwargs)
+    counts = inD[class_col].value_counts(sort=False)
+    if not isinstance(inD[class_col].dtype, pd.CategoricalDtype):
+        counts = counts.sort_index()
+    all_labels = []
+    for ctype, count in counts.loc[counts > 0].items():
+        label = ctype if labels is None else labels[ctype]
+        edgecolor = colors[ctype] if edgecolors is None else edgecolors[ctype]
+        all_labels.append(mpatches.Patch(facecolor=colors[ctype], edgecolor=edgecolor, label=f'{label} [{count}]'))
+    return(all_labels)
+
+def render_country(output_folder, out_folder=None, maps=['lc', 'h3', 'ntl'], dpi=100, basemap_cache=None, map_kwargs={}):
+    ''' render the static maps of a country written by country_boundary.write_output to PNG files
+
+        :param output_folder: folder written by write_output
+        :type output_folder: string
+        :param out_folder: folder to write PNGs, default is output_folder
+        :type out_folder: string, optional
+        :param maps: maps to render from STATIC_MAPS; maps whose layer was not written are skipped
+        :type maps: list of strings, optional
+        :param map_kwargs: additional arguments for each map, keyed by map name
+        :type map_kwargs: dict, optional
+        :return: paths of the PNGs written
+        :rtype: list of strings
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from GOSTboundaries.boundary_helper import load_output
+
+    if basemap_cache is not None:
+        set_basemap_cache(basemap_cache)
+    out_folder = output_folder if out_folder is None else out_folder
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    cb = load_output(output_folder)
+    out_files = []
+    for map_name in maps:
+        if not hasattr(cb, STATIC_MAPS[map_name]):
+            continue
+        cur_kwargs = map_kwargs.get(map_name, {})
+        if map_name == 'lc':
+            ax = cb.static_map_lc(**cur_kwargs)
+        elif map_name == 'h3':
+            ax = cb.static_map_h3(**cur_kwargs)
+        else:
+            ax = cb.ntl_summary(**cur_kwargs)[0]
+        out_file = os.path.join(out_folder, f'{cb.iso3}_{map_name}.png')
+        plt.gcf().savefig(out_file, dpi=dpi, bbox_inches='tight')
+        plt.close('all')
+        out_files.append(out_file)
+    return(out_files)
+
+def render_countries(output_folders, out_folder=None, maps=['lc', 'h3', 'ntl'], dpi=100, basemap_cache=None, max_workers=None, map_kwargs={}):
+    ''' render the static maps of many countries to PNG in a process pool; all processes share the basemap cache
+
+        :param output_folders: folders written by write_output, one per country
+        :type output_folders: list of strings
+        :param out_folder: folder to write all PNGs, default is the output folder of each country
+        :type out_folder: string, optional
+        :param max_workers: number of processes, default is the number of cpus
+        :type max_workers: int, optional
+        :return: PNGs written for each country, or the error if rendering failed
+        :rtype: dict
+    '''
+    results = {}
+    # matplotlib and the threads started by pyarrow and GDAL are not safe to fork, workers are started fresh
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        all_jobs = {executor.submit(render_country, folder, out_folder=out_folder, maps=maps, dpi=dpi,
+                        basemap_cache=basemap_cache, map_kwargs=map_kwargs): folder for folder in output_folders}
+        for cur_job in as_completed(all_jobs):
+            folder = all_jobs[cur_job]
+            try:
+                results[folder] = cur_job.result()
+            except Exception:
+                results[folder] = traceback.format_exc()
+                tPrint(f"Rendering {folder} failed")
+    return(results)
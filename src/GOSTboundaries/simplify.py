@@ -0,0 +1,76 @@
+import shapely
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+
+def simplify_geometries(inD, tolerance, grid_size=None):
+    ''' Reduce the vertices of an admin dataset with topology preserving simplification, optionally followed
+        by snapping all vertices to a grid. Features are simplified independently, so edges shared by
+        neighbouring features can move apart by up to tolerance; features that would collapse to an empty
+        geometry keep their original geometry.
+
+        :param inD: admin dataset to simplify
+        :type inD: class:`geopandas.GeoDataFrame`
+        :param tolerance: maximum distance, in the units of the crs of inD, that any edge can move
+        :type tolerance: float
+        :param grid_size: size of the precision grid vertices are snapped to (shapely set_precision), in the
+            units of the crs of inD, default is None (no snapping)
+        :type grid_size: float, optional
+        :return: copy of inD with simplified geometries
+        :rtype: class:`geopandas.GeoDataFrame`
+    '''
+    geoms = np.asarray(inD['geometry'])
+    simple = geoms
+    if tolerance is not None and tolerance > 0:
+        simple = shapely.simplify(simple, tolerance, preserve_topology=True)
+    if grid_size is not None and grid_size > 0:
+        simple = shapely.set_precision(simple, grid_size)
+    collapsed = shapely.is_empty(simple) & ~shapely.is_empty(geoms)
+    simple = np.where(collapsed, geoms, simple)
+    outD = inD.copy()
+    outD['geometry'] = gpd.GeoSeries(simple, index=inD.index, crs=inD.crs)
+    return(outD)
+
+def simplification_error(original, simplified):
+    ''' Summarize the change in vertices and area between an admin dataset and its simplified version
+
+        :return: number of features, vertices before and after, ratio of vertices kept, and the mean and
+            maximum change in area of a single feature as a percent of its original area
+        :rtype: dict
+    '''
+    geoms = np.asarray(original['geometry'])
+    simple = np.asarray(simplified['geometry'])
+    v_before = int(shapely.get_num_coordinates(geoms).sum())
+    v_after = int(shapely.get_num_coordinates(simple).sum())
+    area = shapely.area(geoms)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        area_change = np.abs(shapely.area(simple) - area) / area * 100
+    area_change = area_change[area > 0]
+    return({'features':len(geoms), 'vertices':v_before, 'vertices_simplified':v_after,
+                'vertices_kept':round(v_after / v_before, 4) if v_before > 0 else np.nan,
+                'area_change_mean_pct':area_change.mean() if len(area_change) > 0 else 0.0,
+                'area_change_max_pct':area_change.max() if len(area_change) > 0 else 0.0})
+
+def match_error(original_match, simplified_match, id_col, match_col='geo_match_id', per_col='geo_match_per'):
+    ''' Compare the ids matched to an admin dataset before and after simplification
+
+        :param original_match: result of country_boundary.match_datasets on the original datasets
+        :type original_match: class:`geopandas.GeoDataFrame`
+        :param simplified_match: result of country_boundary.match_datasets on the simplified datasets
+        :type simplified_match: class:`geopandas.GeoDataFrame`
+        :param id_col: column identifying features in both results
+        :type id_col: string
+        :return: number and percent of features matched to a different id, and the mean and maximum change
+            in the matched percent
+        :rtype: dict
+    '''
+    comp = pd.merge(original_match.loc[:,[id_col, match_col, per_col]], simplified_match.loc[:,[id_col, match_col, per_col]],
+                        on=id_col, suffixes=['', '_simplified'])
+    changed = comp[match_col].astype(str) != comp[f'{match_col}_simplified'].astype(str)
+    per_change = (comp[per_col] - comp[f'{per_col}_simplified']).abs()
+    return({'id_mismatch':int(changed.sum()),
+                'id_mismatch_pct':changed.mean() * 100 if comp.shape[0] > 0 else 0.0,
+                'match_per_change_mean':per_change.mean() if comp.shape[0] > 0 else 0.0,
+                'match_per_change_max':per_change.max() if comp.shape[0] > 0 else 0.0})
@@ -0,0 +1,168 @@
+import sys, os, glob, argparse
+
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import geopandas as gpd
+
+from GOSTRocks.misc import tPrint
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+
+def require_pyogrio():
+    ''' file_source and partition_boundaries read a subset of the global file through pyogrio; without it
+        every read would load the whole file
+    '''
+    if pyogrio is None:
+        raise(ImportError("Reading boundaries by country requires pyogrio; install with pip install .[sources]"))
+
+
+class boundary_source(ABC):
+    ''' Global admin boundaries from which the features of one country are read at a time, instead of reading
+        the global dataset and filtering it for every country. Sources can be passed to country_boundary and
+        the batch runner in place of the boundaries; they only store paths, so they are cheap to send to
+        worker processes
+
+        :param iso_col: column with the iso3 code of each feature, default is 'ISO_A3'
+        :type iso_col: string, optional
+    '''
+    def __init__(self, iso_col='ISO_A3'):
+        self.iso_col = iso_col
+
+    @abstractmethod
+    def read(self, iso3):
+        ''' return the features of the selected country
+        '''
+
+    @abstractmethod
+    def sizes(self):
+        ''' estimate of the size of each country, used to schedule the largest countries first
+
+            :rtype: class:`pandas.Series` indexed by iso3
+        '''
+
+
+class file_source(boundary_source):
+    ''' Boundaries in a single file readable by geopandas (ie - WB_GAD_ADM2.shp); each country is read with
+        an attribute filter on iso_col, so only its features are parsed and held in memory; requires pyogrio
+
+        :param in_file: path to the global boundaries
+        :type in_file: string
+        :param layer: layer to read from in_file, default is the first layer
+        :type layer: string, optional
+    '''
+    def __init__(self, in_file, iso_col='ISO_A3', layer=None):
+        require_pyogrio()
+        super().__init__(iso_col)
+        self.in_file = in_file
+        self.layer = layer
+
+    def read(self, iso3):
+        iso3 = iso3.replace("'", "''")
+        return(pyogrio.read_dataframe(self.in_file, layer=self.layer, where=f"\"{self.iso_col}\" = '{iso3}'"))
+
+    def sizes(self):
+        ''' number of features in each country; only the iso_col attribute is read
+        '''
+        iso = pyogrio.read_dataframe(self.in_file, layer=self.layer, columns=[self.iso_col], read_geometry=False)[self.iso_col]
+        return(iso.value_counts())
+
+
+class parquet_source(boundary_source):
+    ''' Boundaries partitioned by country into GeoParquet files by partition_boundaries; reading a country
+        only opens the files in its partition, {in_folder}/{iso_col}={iso3}/part-*.parquet
+
+        :param in_folder: folder written by partition_boundaries
+        :type in_folder: string
+    '''
+    def __init__(self, in_folder, iso_col='ISO_A3'):
+        super().__init__(iso_col)
+        self.in_folder = in_folder
+
+    def partition_files(self, iso3):
+        return(sorted(glob.glob(os.path.join(self.in_folder, f'{self.iso_col}={iso3}', 'part-*.parquet'))))
+
+    def read(self, iso3):
+        in_files = self.partition_files(iso3)
+        if len(in_files) == 0:
+            raise(ValueError(f"{iso3} is not a partition of {self.in_folder}"))
+        return(pd.concat([gpd.read_parquet(x) for x in in_files], ignore_index=True))
+
+    def sizes(self):
+        ''' size on disk of each country, in bytes
+        '''
+        all_sizes = {}
+        for folder in glob.glob(os.path.join(self.in_folder, f'{self.iso_col}=*')):
+            iso3 = os.path.basename(folder).split('=', 1)[1]
+            all_sizes[iso3] = sum(os.path.getsize(x) for x in self.partition_files(iso3))
+        return(pd.Series(all_sizes, dtype='int64'))
+
+
+def open_source(path, iso_col='ISO_A3'):
+    ''' open global boundaries as a source; folders written by partition_boundaries are read as a
+        parquet_source, and anything else as a file_source
+    '''
+    if os.path.isdir(path) and len(glob.glob(os.path.join(path, f'{iso_col}=*'))) > 0:
+        return(parquet_source(path, iso_col=iso_col))
+    return(file_source(path, iso_col=iso_col))
+
+def partition_boundaries(in_file, out_folder, iso_col='ISO_A3', layer=None, chunk_size=100000, verbose=False):
+    ''' Split global boundaries into one GeoParquet partition per country, to be read with parquet_source.
+        The input is read chunk_size features at a time, so memory is proportional to the chunk rather than
+        the global file; each chunk adds one part file to the partition of every country it contains
+
+        :param in_file: path to the global boundaries, readable by geopandas
+        :type in_file: string
+        :param out_folder: folder in which to create the partitions; existing partitions are replaced
+        :type out_folder: string
+        :param iso_col: column in in_file with the iso3 code of each feature, default is 'ISO_A3'
+        :type iso_col: string, optional
+        :param chunk_size: number of features read at a time, default is 100000
+        :type chunk_size: int, optional
+        :return: number of features written for each country
+        :rtype: class:`pandas.Series`
+    '''
+    require_pyogrio()
+    for old_file in glob.glob(os.path.join(out_folder, f'{iso_col}=*', 'part-*.parquet')):
+        os.remove(old_file)
+    counts = pd.Series(dtype='int64')
+    chunk = 0
+    while True:
+        inD = pyogrio.read_dataframe(in_file, layer=layer, skip_features=chunk * chunk_size, max_features=chunk_size)
+        if inD.shape[0] == 0:
+            break
+        for iso3, iso_features in inD.groupby(iso_col):
+            iso_folder = os.path.join(out_folder, f'{iso_col}={iso3}')
+            if not os.path.exists(iso_folder):
+                os.makedirs(iso_folder)
+            iso_features.reset_index(drop=True).to_parquet(os.path.join(iso_folder, f'part-{chunk:05d}.parquet'))
+            counts.loc[iso3] = counts.get(iso3, 0) + iso_features.shape[0]
+        if verbose:
+            tPrint(f"Partitioned {chunk * chunk_size + inD.shape[0]} features")
+        if inD.shape[0] < chunk_size:
+            break
+        chunk += 1
+    return(counts)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Partition global boundaries into one GeoParquet file per country')
+    parser.add_argument('--in_file', required=True, help='path to global boundaries, ie - WB_GAD_ADM2.shp')
+    parser.add_argument('--out_folder', required=True, help='folder for the partitioned dataset')
+    parser.add_argument('--iso_col', default='ISO_A3', help='column in in_file with iso3 code')
+    parser.add_argument('--layer', default=None, help='layer to read from in_file')
+    parser.add_argument('--chunk_size', type=int, default=100000, help='number of features read at a time')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(args)
+
+    counts = partition_boundaries(args.in_file, args.out_folder, iso_col=args.iso_col, layer=args.layer,
+                                    chunk_size=args.chunk_size, verbose=args.verbose)
+    if args.verbose:
+        tPrint(f"Wrote {counts.shape[0]} countries, {counts.sum()} features")
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import os, json, gzip, sqlite3
+
+import shapely
+
+import numpy as np
+import pandas as pd
+
+try:
+    import mapbox_vector_tile, mercantile
+except ImportError:
+    mapbox_vector_tile = None
+    mercantile = None
+
+# circumference of the earth in web mercator (EPSG:3857) metres
+WORLD_SIZE = 2 * np.pi * 6378137
+
+
+def tile_tolerance(zoom, extent=4096):
+    ''' size of one unit of the tile grid at zoom, in metres; geometries are simplified to this tolerance
+        as smaller details cannot be drawn
+    '''
+    return(WORLD_SIZE / 2**zoom / extent)
+
+def tile_properties(inD):
+    ''' attributes of each feature as a list of dicts of python types accepted by the vector tile encoder;
+        missing values are dropped
+    '''
+    attributes = inD.drop(columns=inD.geometry.name)
+    records = []
+    for row in attributes.astype(object).itertuples(index=False):
+        cur_props = {}
+        for col, val in zip(attributes.columns, row):
+            if val is None or (isinstance(val, float) and np.isnan(val)):
+                continue
+            if isinstance(val, np.generic):
+                val = val.item()
+            if not isinstance(val, (int, float, str, bool)):
+                val = str(val)
+            cur_props[str(col)] = val
+        records.append(cur_props)
+    return(records)
+
+def quantize_geometries(geoms, bounds, extent=4096):
+    ''' convert geometries to the integer grid of the tiles they belong to; this is done for all geometries
+        at once instead of one at a time in the vector tile encoder
+
+        :param geoms: clipped geometries in web mercator
+        :type geoms: numpy.array of shapely geometries
+        :param bounds: web mercator bounds of the tile of each geometry
+        :type bounds: numpy.array with a row of [xmin, ymin, xmax, ymax] for each geometry
+    '''
+    coords, coord_idx = shapely.get_coordinates(geoms, return_index=True)
+    cur_bounds = bounds[coord_idx]
+    scale = extent / (cur_bounds[:,2:] - cur_bounds[:,:2])
+    return(shapely.set_coordinates(geoms.copy(), np.round((coords - cur_bounds[:,:2]) * scale)))
+
+def orient_polygons(geoms):
+    ''' orient exterior rings clockwise and interior rings counter-clockwise, the winding order vector tiles
+        expect before the y axis is flipped. Polygonal geometries are returned as multipolygons; geometries
+        without any polygons are returned as None
+    '''
+    parts, part_idx = shapely.get_parts(geoms, return_index=True)
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    parts, part_idx = parts[keep], part_idx[keep]
+    out = np.full(len(geoms), None, dtype=object)
+    if len(parts) == 0:
+        return(out)
+    rings, ring_idx = shapely.get_rings(parts, return_index=True)
+    # the first ring of each polygon is the exterior
+    exterior = np.r_[True, ring_idx[1:] != ring_idx[:-1]]
+    flip = shapely.is_ccw(rings) == exterior
+    rings[flip] = shapely.reverse(rings[flip])
+    return(shapely.multipolygons(shapely.polygons(rings, indices=ring_idx), indices=part_idx, out=out))
+
+def generate_tiles(layers, min_zoom=0, max_zoom=12, extent=4096, buffer=64):
+    ''' Generate Mapbox vector tiles for several layers. At every zoom the geometries are simplified to the
+        resolution of the tile grid, and each tile only contains the clipped features intersecting it
+
+        :param layers: datasets to include in the tiles, keyed by layer name
+        :type layers: dict of class:`geopandas.GeoDataFrame`
+        :param min_zoom: lowest zoom level to create, default is 0
+        :type min_zoom: int, optional
+        :param max_zoom: highest zoom level to create, default is 12
+        :type max_zoom: int, optional
+        :param extent: size of the tile grid, default is 4096
+        :type extent: int, optional
+        :param buffer: features are clipped this many grid units outside each tile, default is 64
+        :type buffer: int, optional
+        :return: generator of [z, x, y, encoded tile]
+    '''
+    if mapbox_vector_tile is None or mercantile is None:
+        raise(ImportError("Writing vector tiles requires mapbox_vector_tile and mercantile; install with pip install .[tiles]"))
+    prepared = {}
+    for name, inD in layers.items():
+        inD = inD.loc[~inD.geometry.is_empty & inD.geometry.notna()].to_crs(3857)
+        prepared[name] = [np.asarray(inD.geometry), tile_properties(inD)]
+    all_bounds = np.array([shapely.total_bounds(x[0]) for x in prepared.values() if len(x[0]) > 0])
+    if len(all_bounds) == 0:
+        return
+    west, south = mercantile.lnglat(all_bounds[:,0].min(), all_bounds[:,1].min())
+    east, north = mercantile.lnglat(all_bounds[:,2].max(), all_bounds[:,3].max())
+    # geometries are quantized and oriented before encoding
+    encode_options = {'extents':extent, 'quantize_bounds':None, 'check_winding_order':False}
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        tolerance = tile_tolerance(zoom, extent)
+        tiles = list(mercantile.tiles(west, south, east, north, zoom))
+        tile_bounds = np.array([mercantile.xy_bounds(x) for x in tiles])
+        clip_bounds = tile_bounds + np.array([-1, -1, 1, 1]) * buffer * tolerance
+        clip_boxes = shapely.box(*clip_bounds.T)
+        tile_features = {}
+        for name, (geoms, props) in prepared.items():
+            simple = shapely.simplify(geoms, tolerance)
+            feat_idx = np.where(~shapely.is_empty(simple))[0]
+            if len(feat_idx) == 0:
+                continue
+            t_idx, f_idx = shapely.STRtree(simple[feat_idx]).query(clip_boxes, predicate='intersects')
+            # group the pairs by tile once, so each tile clips a contiguous slice of them
+            order = np.argsort(t_idx, kind='stable')
+            t_idx, f_idx = t_idx[order], feat_idx[f_idx[order]]
+            tile_ids, starts = np.unique(t_idx, return_index=True)
+            ends = np.r_[starts[1:], len(t_idx)]
+            # clip_by_rect is faster than intersection and does not fail on geometries made invalid by simplification
+            clipped = np.empty(len(t_idx), dtype=object)
+            for cur_t, start, end in zip(tile_ids, starts, ends):
+                clipped[start:end] = shapely.clip_by_rect(simple[f_idx[start:end]], *clip_bounds[cur_t])
+            clipped = orient_polygons(quantize_geometries(clipped, tile_bounds[t_idx], extent))
+            for cur_t, cur_f, geom in zip(t_idx, f_idx, clipped):
+                if geom is None or geom.is_empty:
+                    continue
+                tile_features.setdefault(cur_t, {}).setdefault(name, []).append({'geometry':geom, 'properties':props[cur_f]})
+        for cur_t, cur_layers in tile_features.items():
+            tile_layers = [{'name':name, 'features':features} for name, features in cur_layers.items()]
+            data = mapbox_vector_tile.encode(tile_layers, default_options=encode_options)
+            tile = tiles[cur_t]
+            yield([tile.z, tile.x, tile.y, data])
+
+def write_vector_tiles(layers, out_path, min_zoom=0, max_zoom=12, extent=4096):
+    ''' Write vector tiles of several layers to a folder of {z}/{x}/{y}.pbf files, or to an MBTiles file if
+        out_path ends with .mbtiles. A folder can be served next to a map html file as static files; MBTiles
+        need a tile server
+
+        :param layers: datasets to include in the tiles, keyed by layer name
+        :type layers: dict of class:`geopandas.GeoDataFrame`
+        :param out_path: folder or .mbtiles file to create
+        :type out_path: string
+        :return: number of tiles written
+        :rtype: int
+    '''
+    tiles = generate_tiles(layers, min_zoom=min_zoom, max_zoom=max_zoom, extent=extent)
+    bounds = np.array([x.to_crs(4326).total_bounds for x in layers.values() if x.shape[0] > 0])
+    metadata = {'name':os.path.basename(out_path), 'format':'pbf', 'minzoom':str(min_zoom), 'maxzoom':str(max_zoom),
+                    'bounds':','.join(str(x) for x in [bounds[:,0].min(), bounds[:,1].min(), bounds[:,2].max(), bounds[:,3].max()]),
+                    'json':json.dumps({'vector_layers':[{'id':name, 'fields':{}, 'minzoom':min_zoom, 'maxzoom':max_zoom} for name in layers.keys()]})}
+    n_tiles = 0
+    if out_path.endswith('.mbtiles'):
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        conn = sqlite3.connect(out_path)
+        conn.execute('CREATE TABLE metadata (name text, value text)')
+        conn.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        conn.execute('CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)')
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)', list(metadata.items()))
+        for z, x, y, data in tiles:
+            # MBTiles rows are numbered from the bottom (TMS), and vector tiles are gzipped
+            conn.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)', (z, x, 2**z - 1 - y, gzip.compress(data)))
+            n_tiles += 1
+        conn.commit()
+        conn.close()
+    else:
+        for z, x, y, data in tiles:
+            tile_folder = os.path.join(out_path, str(z), str(x))
+            if not os.path.exists(tile_folder):
+                os.makedirs(tile_folder)
+            with open(os.path.join(tile_folder, f'{y}.pbf'), 'wb') as out_file:
+                out_file.write(data)
+            n_tiles += 1
+        with open(os.path.join(out_path, 'metadata.json'), 'w') as out_file:
+            json.dump(metadata, out_file, indent=2)
+    return(n_tiles)
@@ -0,0 +1,161 @@
+import shapely
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+# id of the neighbour of edges on the outside of a dataset, ie - the national boundary
+OUTSIDE = ''
+
+
+def polygon_segments(geoms):
+    ''' split the rings of polygons into single segments
+
+        :param geoms: polygons and multipolygons
+        :type geoms: numpy.array of shapely geometries
+        :return: start and end coordinates of every segment, the index in geoms of the polygon it belongs to
+            and the index of its ring
+        :rtype: list of numpy.array
+    '''
+    parts, part_idx = shapely.get_parts(geoms, return_index=True)
+    keep = shapely.get_type_id(parts) == 3
+    parts, part_idx = parts[keep], part_idx[keep]
+    rings, ring_idx = shapely.get_rings(parts, return_index=True)
+    coords, coord_idx = shapely.get_coordinates(rings, return_index=True)
+    same_ring = coord_idx[:-1] == coord_idx[1:]
+    ring = coord_idx[:-1][same_ring]
+    return([coords[:-1][same_ring], coords[1:][same_ring], part_idx[ring_idx[ring]], ring])
+
+def order_ids(id_1, id_2):
+    ''' put each pair of ids in the order used by every edge table: the smaller id (as a string) is id_1, and
+        the outside is always id_2, so edges of different datasets can be joined on the pair
+
+        :type id_1: numpy.array of strings
+        :type id_2: numpy.array of strings
+        :return: reordered id_1 and id_2
+        :rtype: list of numpy.array
+    '''
+    swap = (id_1 == OUTSIDE) | ((id_2 != OUTSIDE) & (id_2 < id_1))
+    return([np.where(swap, id_2, id_1), np.where(swap, id_1, id_2)])
+
+def build_edges(inD, id_col, precision=7):
+    ''' Build the shared-edge topology of an admin dataset: every boundary between two neighbouring admins, and
+        between each admin and the outside, is stored once as a (multi)linestring keyed by the ids on either side.
+        As in TopoJSON, segments are shared when their end points are identical after rounding to precision, so
+        no polygon overlays are needed; boundaries of neighbours that do not share vertices become two edges
+        with the outside.
+
+        :param inD: admin dataset
+        :type inD: class:`geopandas.GeoDataFrame`
+        :param id_col: column in inD with unique id
+        :type id_col: string
+        :param precision: number of decimals end points are rounded to before they are compared, default is 7
+        :type precision: int, optional
+        :return: edges with the ids of the admins on either side in id_1 and id_2, ordered by order_ids; id_2 is
+            '' for the outside
+        :rtype: class:`geopandas.GeoDataFrame`
+    '''
+    start, end, owner, ring = polygon_segments(np.asarray(inD['geometry']))
+    ids = inD[id_col].astype(str).values.astype(object)
+    r_start, r_end = np.round(start, precision), np.round(end, precision)
+    # segments are compared independent of direction
+    flip = (r_start[:,0] > r_end[:,0]) | ((r_start[:,0] == r_end[:,0]) & (r_start[:,1] > r_end[:,1]))
+    keys = np.where(flip[:,None], np.c_[r_end, r_start], np.c_[r_start, r_end])
+    valid = np.where((keys[:,0] != keys[:,2]) | (keys[:,1] != keys[:,3]))[0]
+    keys, owner = keys[valid], owner[valid]
+    order = np.lexsort((owner, keys[:,3], keys[:,2], keys[:,1], keys[:,0]))
+    keys, owner, valid = keys[order], owner[order], valid[order]
+    new_key = np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)]
+    # drop segments repeated within one admin, ie - where two parts of a multipolygon touch
+    keep = new_key | np.r_[True, owner[1:] != owner[:-1]]
+    keys, owner, valid, new_key = keys[keep], owner[keep], valid[keep], new_key[keep]
+    # a segment shared by more than two admins is an overlap in the dataset; the first two owners are kept
+    first = np.where(new_key)[0]
+    has_second = np.r_[~new_key[1:], False][first]
+    id_1 = ids[owner[first]]
+    id_2 = np.full(len(first), OUTSIDE, dtype=object)
+    id_2[has_second] = ids[owner[first[has_second] + 1]]
+    id_1, id_2 = order_ids(id_1, id_2)
+    # consecutive segments of a ring between the same admins are joined into lines before creating geometries
+    seg = valid[first]
+    order = np.argsort(seg)
+    seg, id_1, id_2 = seg[order], id_1[order], id_2[order]
+    pair = pd.DataFrame({'id_1':id_1, 'id_2':id_2}).groupby(['id_1', 'id_2']).ngroup().values
+    new_run = np.r_[True, (seg[1:] != seg[:-1] + 1) | (ring[seg[1:]] != ring[seg[:-1]]) | (pair[1:] != pair[:-1])]
+    run_id = np.cumsum(new_run) - 1
+    last = np.r_[np.where(new_run)[0][1:] - 1, len(seg) - 1]
+    coords = np.concatenate([start[seg], end[seg[last]]])
+    coord_run = np.concatenate([run_id, run_id[last]])
+    coord_order = np.argsort(np.concatenate([np.arange(len(seg)), last + 0.5]), kind='stable')
+    lines = shapely.linestrings(coords[coord_order], indices=coord_run[coord_order])
+    return(merge_lines(lines, id_1[new_run], id_2[new_run], inD.crs))
+
+def merge_lines(lines, id_1, id_2, crs):
+    ''' combine lines with the same pair of ids into a single edge
+
+        :param lines: linestrings or multilinestrings
+        :type lines: numpy.array of shapely geometries
+        :return: one edge per pair of ids
+        :rtype: class:`geopandas.GeoDataFrame`
+    '''
+    pairs = pd.DataFrame({'id_1':id_1, 'id_2':id_2})
+    pair_idx = pairs.groupby(['id_1', 'id_2'], sort=True).ngroup().values
+    parts, part_idx = shapely.get_parts(lines, return_index=True)
+    part_pair = pair_idx[part_idx]
+    order = np.argsort(part_pair, kind='stable')
+    edges = shapely.line_merge(shapely.multilinestrings(parts[order], indices=part_pair[order]))
+    pairs = pairs.drop_duplicates().sort_values(['id_1', 'id_2']).reset_index(drop=True)
+    return(gpd.GeoDataFrame(pairs, geometry=edges, crs=crs))
+
+def map_edges(edges, id_map):
+    ''' relabel the edges of one dataset with the ids of another dataset, ie - geoboundaries edges with the
+        WB id matched to each geoboundary. Edges between admins mapped to the same id are inside that admin
+        and are dropped; edges mapped to the same pair of ids are merged
+
+        :param edges: result of build_edges
+        :type edges: class:`geopandas.GeoDataFrame`
+        :param id_map: new id of each original id
+        :type id_map: dict or class:`pandas.Series`
+    '''
+    id_map = pd.Series(id_map).astype(str)
+    id_map.loc[OUTSIDE] = OUTSIDE
+    new_1 = edges['id_1'].map(id_map).fillna(OUTSIDE).values
+    new_2 = edges['id_2'].map(id_map).fillna(OUTSIDE).values
+    id_1, id_2 = order_ids(new_1, new_2)
+    keep = id_1 != id_2
+    return(merge_lines(np.asarray(edges['geometry'])[keep], id_1[keep], id_2[keep], edges.crs))
+
+def compare_edges(edges_1, edges_2, metric_crs, max_frechet_vertices=4000000):
+    ''' Compare the edges of two datasets with the same ids, edge by edge
+
+        :param edges_1: edges of the reference dataset
+        :type edges_1: class:`geopandas.GeoDataFrame`
+        :param edges_2: edges of the compared dataset, mapped to the ids of edges_1 with map_edges
+        :type edges_2: class:`geopandas.GeoDataFrame`
+        :param metric_crs: crs in which distances and lengths are measured, in metres
+        :param max_frechet_vertices: the Fréchet distance of two edges needs memory proportional to the product
+            of their numbers of vertices; pairs above this product are not measured, default is 4000000
+        :type max_frechet_vertices: int, optional
+        :return: one row per pair of ids in either dataset, with the length of each edge, the Hausdorff and
+            discrete Fréchet distance between them and the geometry of edges_1 (edges_2 where it is missing)
+        :rtype: class:`geopandas.GeoDataFrame`
+    '''
+    comp = pd.merge(pd.DataFrame(edges_1.to_crs(metric_crs)), pd.DataFrame(edges_2.to_crs(metric_crs)),
+                        on=['id_1', 'id_2'], how='outer', suffixes=['', '_2'])
+    geoms_1 = np.asarray(comp['geometry'], dtype=object)
+    geoms_2 = np.asarray(comp['geometry_2'], dtype=object)
+    matched = pd.notna(geoms_1) & pd.notna(geoms_2)
+    comp['status'] = np.where(matched, 'matched', np.where(pd.notna(geoms_1), 'missing_2', 'missing_1'))
+    comp['length_1'] = shapely.length(geoms_1)
+    comp['length_2'] = shapely.length(geoms_2)
+    comp['hausdorff'] = np.nan
+    comp.loc[matched, 'hausdorff'] = shapely.hausdorff_distance(geoms_1[matched], geoms_2[matched])
+    # edges are not oriented, so the Fréchet distance is the smaller of both directions
+    comp['frechet'] = np.nan
+    size = shapely.get_num_coordinates(geoms_1) * shapely.get_num_coordinates(geoms_2)
+    sel = matched & (size <= max_frechet_vertices)
+    comp.loc[sel, 'frechet'] = np.minimum(shapely.frechet_distance(geoms_1[sel], geoms_2[sel]),
+                                            shapely.frechet_distance(geoms_1[sel], shapely.reverse(geoms_2[sel])))
+    geoms = np.where(pd.notna(geoms_1), geoms_1, geoms_2)
+    comp = comp.drop(columns=['geometry', 'geometry_2'])
+    return(gpd.GeoDataFrame(comp, geometry=geoms, crs=metric_crs).to_crs(edges_1.crs))
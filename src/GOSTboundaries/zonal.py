@@ -0,0 +1,116 @@
+import rasterio, shapely
+
+import numpy as np
+
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from shapely.geometry import box
+
+
+def zonal_stats_multi(zone_layers, inR, rastType='N', unqVals=[], band=1, max_memory=256*1024**2, all_touched=False, nodata=None):
+    ''' Run zonal statistics for several zone layers with a single pass through the raster. The raster is read
+        in blocks of rows; every zone layer is rasterized against each block and summarized with bincount, so
+        each pixel is read once no matter how many layers are summarized. Features within a layer are expected
+        not to overlap; where they do, pixels are attributed to the last feature.
+
+        :param zone_layers: zone datasets to summarize, keyed by layer name
+        :type zone_layers: dict of class:`geopandas.GeoDataFrame`
+        :param inR: raster to summarize
+        :type inR: string path to file or rasterio.DatasetReader
+        :param rastType: 'N' for numerical (SUM, MIN, MAX, MEAN) or 'C' for categorical (count of unqVals), default is 'N'
+        :type rastType: string, optional
+        :param unqVals: list of categories to count in a categorical raster
+        :type unqVals: list of ints, optional
+        :param band: band of raster to summarize, default is 1
+        :type band: int, optional
+        :param max_memory: approximate maximum memory in bytes used for one block of raster and zone data, default is 256 MB
+        :type max_memory: int, optional
+        :param all_touched: include all pixels touched by a feature, passed to rasterio rasterize, default is False
+        :type all_touched: boolean, optional
+        :param nodata: pixel value to exclude from calculations; NaN pixels are always excluded, default is None
+        :type nodata: number, optional
+        :return: array of zonal results per layer - one row for every feature; SUM, MIN, MAX, MEAN for numerical
+            rasters (NaN for features without pixels) or the count of each of unqVals for categorical rasters
+        :rtype: dict of numpy.array
+    '''
+    if isinstance(inR, str):
+        inR = rasterio.open(inR)
+    unqVals = np.asarray(unqVals)
+    n_cats = len(unqVals)
+    cat_order = np.argsort(unqVals)
+    sorted_cats = unqVals[cat_order]
+
+    # Reproject the zones to the raster, and set up a spatial index for selecting features in each block
+    layers = {}
+    for name, inD in zone_layers.items():
+        if inD.crs != inR.crs:
+            inD = inD.to_crs(inR.crs)
+        geoms = np.asarray(inD['geometry'])
+        n = len(geoms)
+        layer = {'geoms':geoms, 'tree':shapely.STRtree(geoms), 'bounds':shapely.total_bounds(geoms)}
+        if rastType == 'N':
+            layer['sum'] = np.zeros(n + 1)
+            layer['count'] = np.zeros(n + 1)
+            layer['min'] = np.full(n + 1, np.inf)
+            layer['max'] = np.full(n + 1, -np.inf)
+        else:
+            layer['count'] = np.zeros((n + 1) * n_cats, dtype=np.int64)
+        layers[name] = layer
+    if len(layers) == 0:
+        return({})
+
+    # Identify the window of the raster covering all zone layers
+    all_bounds = np.array([x['bounds'] for x in layers.values()])
+    c0, r0 = ~inR.transform * (np.nanmin(all_bounds[:,0]), np.nanmax(all_bounds[:,3]))
+    c1, r1 = ~inR.transform * (np.nanmax(all_bounds[:,2]), np.nanmin(all_bounds[:,1]))
+    col_off, col_end = int(max(0, np.floor(min(c0, c1)))), int(min(inR.width, np.ceil(max(c0, c1))))
+    row_off, row_end = int(max(0, np.floor(min(r0, r1)))), int(min(inR.height, np.ceil(max(r0, r1))))
+    width = max(0, col_end - col_off)
+
+    # bytes per pixel: raster value, validity mask, and an int32 label array for each zone layer
+    pixel_bytes = np.dtype(inR.dtypes[band - 1]).itemsize + 1 + 4 * len(layers)
+    block_rows = int(max(1, max_memory // (pixel_bytes * max(width, 1))))
+    for block_off in range(row_off, row_end if width > 0 else row_off, block_rows):
+        cur_window = Window(col_off, block_off, width, min(block_rows, row_end - block_off))
+        block_transform = inR.window_transform(cur_window)
+        block_box = box(*rasterio.windows.bounds(cur_window, inR.transform))
+        data = inR.read(band, window=cur_window)
+        valid = np.ones(data.shape, dtype=bool)
+        if np.issubdtype(data.dtype, np.floating):
+            valid = ~np.isnan(data)
+        if nodata is not None:
+            valid = valid & (data != nodata)
+        vals = data[valid]
+        if rastType == 'C':
+            # position of each pixel value in unqVals; values not in unqVals are dropped
+            cat_idx = np.clip(np.searchsorted(sorted_cats, vals), 0, max(n_cats - 1, 0))
+            in_cats = sorted_cats[cat_idx] == vals if n_cats > 0 else np.zeros(len(vals), dtype=bool)
+            cat_idx = cat_order[cat_idx]
+        for layer in layers.values():
+            sel = layer['tree'].query(block_box, predicate='intersects')
+            if len(sel) == 0:
+                continue
+            labels = rasterize(zip(layer['geoms'][sel], sel + 1), out_shape=data.shape, transform=block_transform,
+                                fill=0, all_touched=all_touched, dtype=np.int32)[valid]
+            n_labels = len(layer['geoms']) + 1
+            if rastType == 'N':
+                layer['sum'] += np.bincount(labels, weights=vals, minlength=n_labels)
+                layer['count'] += np.bincount(labels, minlength=n_labels)
+                np.minimum.at(layer['min'], labels, vals)
+                np.maximum.at(layer['max'], labels, vals)
+            else:
+                combined = labels[in_cats].astype(np.int64) * n_cats + cat_idx[in_cats]
+                layer['count'] += np.bincount(combined, minlength=n_labels * n_cats)
+
+    final = {}
+    for name, layer in layers.items():
+        if rastType == 'N':
+            # label 0 is the background outside all features
+            count = layer['count'][1:]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                res = np.column_stack([layer['sum'][1:], layer['min'][1:], layer['max'][1:], layer['sum'][1:] / count])
+            res[count == 0] = np.nan
+        else:
+            res = layer['count'].reshape(-1, n_cats)[1:]
+        final[name] = res
+    return(final)
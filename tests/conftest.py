@@ -0,0 +1,55 @@
+import json, threading
+
+import geopandas as gpd
+import pytest
+
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from shapely.geometry import box
+
+
+class geoboundaries_server():
+    ''' local stand-in for the geoboundaries api: the metadata of each country is served from
+        api/{release}/{iso3}/ADM{lvl}/ and the boundaries from {iso3}.geojson. Every request is recorded in hits
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        self.hits = []
+        hits = self.hits
+        class handler(SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                hits.append(self.path)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=str(folder)))
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.geobounds_url = self.url + '/api/{release}/{iso3}/ADM{lvl}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_country(self, iso3, build_date='2023', n=4, lvl=2, release='gbOpen'):
+        ''' publish n square admins for a country
+        '''
+        inD = gpd.GeoDataFrame({'shapeID':[f'{iso3}_{x}' for x in range(n)]},
+                                geometry=[box(x, 0, x + 1, 1) for x in range(n)], crs=4326)
+        inD.to_file(self.folder / f'{iso3}.geojson', driver='GeoJSON')
+        api_folder = self.folder / 'api' / release / iso3 / f'ADM{lvl}'
+        api_folder.mkdir(parents=True, exist_ok=True)
+        metadata = {'boundaryID':f'{iso3}-ADM{lvl}', 'buildDate':build_date, 'gjDownloadURL':f'{self.url}/{iso3}.geojson'}
+        with open(api_folder / 'index.html', 'w') as out_json:
+            json.dump(metadata, out_json)
+        return(inD)
+
+    def downloads(self, iso3=None):
+        ''' number of boundary files served, for one country or all of them
+        '''
+        return(len([x for x in self.hits if x.endswith('.geojson') and (iso3 is None or x == f'/{iso3}.geojson')]))
+
+    def metadata_requests(self):
+        return(len([x for x in self.hits if x.startswith('/api/')]))
+
+@pytest.fixture
+def geoboundaries(tmp_path):
+    folder = tmp_path / 'srv'
+    folder.mkdir()
+    srv = geoboundaries_server(folder)
+    yield srv
+    srv.server.shutdown()
+    srv.server.server_close()
@@ -0,0 +1,98 @@
+import os, multiprocessing
+
+import geopandas as gpd
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+from shapely.geometry import box
+
+from GOSTboundaries.geobounds_cache import geobounds_cache
+
+
+def cached_keys(cache):
+    return(sorted(cache.read_index().keys()))
+
+def test_fill_and_hit(geoboundaries, tmp_path):
+    expected = geoboundaries.add_country('KEN')
+    cache = geobounds_cache(str(tmp_path / 'cache'))
+
+    geoBounds = cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    assert list(geoBounds['shapeID']) == list(expected['shapeID'])
+    assert geoboundaries.downloads('KEN') == 1
+    assert os.path.exists(os.path.join(cache.cache_folder, 'KEN_ADM2_gbOpen.parquet'))
+
+    # the metadata is unchanged, so the cached file is used
+    geoBounds = cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    assert list(geoBounds['shapeID']) == list(expected['shapeID'])
+    assert geoboundaries.downloads('KEN') == 1
+    assert geoboundaries.metadata_requests() == 2
+
+    # within max_age the api is not queried at all
+    hits = len(geoboundaries.hits)
+    geobounds_cache(cache.cache_folder, max_age=3600).get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    assert len(geoboundaries.hits) == hits
+
+def test_new_release_is_downloaded(geoboundaries, tmp_path):
+    geoboundaries.add_country('KEN', build_date='2023')
+    cache = geobounds_cache(str(tmp_path / 'cache'))
+    cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+
+    expected = geoboundaries.add_country('KEN', build_date='2024', n=6)
+    geoBounds = cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    assert geoboundaries.downloads('KEN') == 2
+    assert geoBounds.shape[0] == expected.shape[0]
+    assert cache.read_index()['KEN_ADM2_gbOpen']['metadata']['buildDate'] == '2024'
+
+def test_lru_eviction(geoboundaries, tmp_path):
+    for iso3 in ['KEN', 'UGA', 'TZA']:
+        geoboundaries.add_country(iso3)
+    cache = geobounds_cache(str(tmp_path / 'cache'), max_age=3600)
+    cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    cache.get('UGA', geobounds_url=geoboundaries.geobounds_url)
+    # room for the two cached countries only
+    cache.max_size = sum(x['size'] for x in cache.read_index().values())
+    # reading KEN makes UGA the least recently used entry
+    cache.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    cache.get('TZA', geobounds_url=geoboundaries.geobounds_url)
+
+    assert cached_keys(cache) == ['KEN_ADM2_gbOpen', 'TZA_ADM2_gbOpen']
+    assert not os.path.exists(os.path.join(cache.cache_folder, 'UGA_ADM2_gbOpen.parquet'))
+    assert geoboundaries.downloads('KEN') == 1
+
+def test_offline(geoboundaries, tmp_path):
+    expected = geoboundaries.add_country('KEN')
+    cache_folder = str(tmp_path / 'cache')
+    geobounds_cache(cache_folder).get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    hits = len(geoboundaries.hits)
+
+    offline = geobounds_cache(cache_folder, offline=True)
+    geoBounds = offline.get('KEN', geobounds_url=geoboundaries.geobounds_url)
+    assert list(geoBounds['shapeID']) == list(expected['shapeID'])
+    assert len(geoboundaries.hits) == hits
+    with pytest.raises(ValueError):
+        offline.get('UGA', geobounds_url=geoboundaries.geobounds_url)
+    assert len(geoboundaries.hits) == hits
+
+def store_countries(cache_folder, worker, n):
+    ''' store and reload n countries from a separate process
+    '''
+    cache = geobounds_cache(cache_folder)
+    for x in range(n):
+        key = cache.cache_key(f'W{worker}{x}', 2, 'gbOpen')
+        geoBounds = gpd.GeoDataFrame({'shapeID':[key]}, geometry=[box(x, worker, x + 1, worker + 1)], crs=4326)
+        cache.store(key, geoBounds, {'boundaryID':key})
+        assert list(cache.load(key)['shapeID']) == [key]
+
+def test_shared_by_processes(tmp_path):
+    cache_folder = str(tmp_path / 'cache')
+    geobounds_cache(cache_folder)
+    n_workers, n = 4, 15
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        for res in [executor.submit(store_countries, cache_folder, x, n) for x in range(n_workers)]:
+            res.result()
+
+    cache = geobounds_cache(cache_folder)
+    assert len(cache.read_index()) == n_workers * n
+    for key, entry in cache.read_index().items():
+        assert list(gpd.read_parquet(os.path.join(cache_folder, entry['file']))['shapeID']) == [key]
+    assert not [x for x in os.listdir(cache_folder) if x.endswith('.tmp')]
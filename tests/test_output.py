@@ -0,0 +1,40 @@
+import numpy as np
+import geopandas as gpd
+import pytest
+
+from shapely.geometry import box
+
+pytest.importorskip('GOSTRocks')
+from GOSTboundaries.boundary_helper import country_boundary, load_output, OUTPUT_FORMATS
+
+
+def admin_grid(prefix, id_col, shift=0.0, n=3, size=0.3):
+    ''' n x n grid of square admins, shifted to create disagreement between datasets
+    '''
+    geoms = [box(36 + x * size + shift, y * size + shift, 36 + (x + 1) * size + shift, (y + 1) * size + shift)
+                for x in range(n) for y in range(n)]
+    return(gpd.GeoDataFrame({id_col:[f'{prefix}_{x}' for x in range(len(geoms))]}, geometry=geoms, crs=4326))
+
+@pytest.fixture
+def boundaries(tmp_path):
+    cb = country_boundary('KEN', admin_grid('WB', 'WB_ID'), 'WB_ID', out_folder=str(tmp_path / 'run'),
+                            geoBounds=admin_grid('GEO', 'shapeID', shift=0.02))
+    cb.run_all(run_h3_summary=True, run_comparison=False, run_zonal=False, h3_level=6)
+    return(cb)
+
+@pytest.mark.parametrize('out_format', list(OUTPUT_FORMATS.keys()))
+def test_load_output_update_h3(boundaries, tmp_path, out_format):
+    out_folder = str(tmp_path / out_format)
+    boundaries.write_output(out_folder, out_format=out_format)
+    cb = load_output(out_folder)
+
+    assert list(cb.h3_data.index) == list(cb.h3_data['shape_id'])
+    assert set(cb.h3_data.index) == set(boundaries.h3_data.index)
+    assert cb.h3_cells.level == 6
+
+    edited_geoms = np.array([boundaries.wb_bounds.geometry.iloc[0]])
+    relabelled_geo = cb.geoBounds.iloc[:0]
+    expected = boundaries.update_h3_data(edited_geoms, boundaries.geoBounds.iloc[:0])
+    added = cb.update_h3_data(edited_geoms, relabelled_geo)
+    assert sorted(added) == sorted(expected)
+    assert set(cb.h3_data.index) == set(boundaries.h3_data.index)
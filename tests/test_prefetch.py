@@ -0,0 +1,128 @@
+import json, threading, time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+import rasterio
+
+from urllib.request import urlopen
+from rasterio.transform import from_origin
+
+from GOSTboundaries.prefetch import prefetch
+from GOSTboundaries.geobounds_cache import geobounds_cache
+
+ISO3_LIST = ['KEN', 'UGA', 'TZA']
+
+
+def test_prefetch_order_and_ahead():
+    started = []
+    def fetch(x):
+        started.append(x)
+        time.sleep(0.01)
+        return(x * 2)
+
+    res = []
+    for item, fut in prefetch(range(10), fetch, max_workers=2, ahead=3):
+        # never more than ahead fetches are started beyond the item being processed
+        assert len(started) <= item + 1 + 3
+        res.append([item, fut.result()])
+    assert res == [[x, x * 2] for x in range(10)]
+
+def test_prefetch_errors_are_raised_on_result():
+    def fetch(x):
+        if x == 1:
+            raise(ValueError(x))
+        return(x)
+
+    res = list(prefetch(range(3), fetch, max_workers=2))
+    assert [x[0] for x in res] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        res[1][1].result()
+    assert res[2][1].result() == 2
+
+def write_raster(out_file, bounds, values, resolution=0.1):
+    xmin, ymin, xmax, ymax = bounds
+    height, width = int(round((ymax - ymin) / resolution)), int(round((xmax - xmin) / resolution))
+    data = np.resize(np.asarray(values), height * width).reshape(height, width)
+    with rasterio.open(out_file, 'w', driver='GTiff', height=height, width=width, count=1, dtype=data.dtype,
+                        crs='EPSG:4326', transform=from_origin(xmin, ymax, resolution, resolution)) as out_r:
+        out_r.write(data, 1)
+    return(str(out_file))
+
+def search_listing(url):
+    ''' stand-in for ntl.aws_search_ntl, reading the nighttime lights listing from the local server
+    '''
+    with urlopen(url) as response:
+        return(json.loads(response.read()))
+
+def admin_datasets(geoboundaries, iso3_list):
+    ''' publish the geoboundaries of each country and return matching WB boundaries for all of them
+    '''
+    all_wb = []
+    for iso3 in iso3_list:
+        wb = geoboundaries.add_country(iso3).rename(columns={'shapeID':'WB_ID'})
+        wb['WB_ID'] = 'WB_' + wb['WB_ID']
+        wb['ISO_A3'] = iso3
+        all_wb.append(wb)
+    return(gpd.GeoDataFrame(pd.concat(all_wb, ignore_index=True), crs=4326))
+
+def test_batch_uses_prefetched_downloads(geoboundaries, tmp_path, monkeypatch):
+    pytest.importorskip('GOSTRocks')
+    from GOSTboundaries import batch
+    wb_bounds = admin_datasets(geoboundaries, ISO3_LIST)
+    bounds = [-0.5, -0.5, 4.5, 1.5]
+    ntl_file = write_raster(tmp_path / 'ntl.tif', bounds, np.arange(5, dtype=np.float32))
+    lc_file = write_raster(tmp_path / 'lc.tif', bounds, np.array([10, 20], dtype=np.uint8))
+    legend = tmp_path / 'legend.csv'
+    legend.write_text('Value,Label\n10,Cropland\n20,Forest\n')
+    (geoboundaries.folder / 'ntl_listing.json').write_text(json.dumps([ntl_file]))
+
+    searches = []
+    def aws_search_ntl():
+        searches.append(threading.get_ident())
+        return(search_listing(f'{geoboundaries.url}/ntl_listing.json'))
+    monkeypatch.setattr(batch.ntl, 'aws_search_ntl', aws_search_ntl)
+
+    out_folder = tmp_path / 'out'
+    run_kwargs = {'run_zonal':True, 'esa_dataset':lc_file, 'esa_legend':str(legend)}
+    summary = batch.run_batch(ISO3_LIST, wb_bounds, 'WB_ID', str(out_folder / '{sel_iso3}'), str(out_folder / 'summary.csv'),
+                                max_workers=2, run_kwargs=run_kwargs, write_output=False, prefetch_workers=2,
+                                geobounds_url=geoboundaries.geobounds_url)
+
+    assert sorted(summary['ISO3']) == sorted(ISO3_LIST)
+    assert (summary['status'] == 'complete').all(), summary['error'].tolist()
+    # the listing is searched once for the whole batch and every country is downloaded once, by the prefetch
+    assert len(searches) == 1
+    assert len([x for x in geoboundaries.hits if x == '/ntl_listing.json']) == 1
+    for iso3 in ISO3_LIST:
+        assert geoboundaries.downloads(iso3) == 1
+    assert geoboundaries.metadata_requests() == len(ISO3_LIST)
+    assert (summary['geo_features'] == 4).all()
+    # run_kwargs of the caller are not modified
+    assert not 'ntl_files' in run_kwargs
+
+def test_batch_workers_share_cache(geoboundaries, tmp_path):
+    pytest.importorskip('GOSTRocks')
+    from GOSTboundaries import batch
+    iso3_list = ISO3_LIST + ['RWA', 'BDI', 'SSD']
+    wb_bounds = admin_datasets(geoboundaries, iso3_list)
+    cache = geobounds_cache(str(tmp_path / 'cache'))
+
+    # without prefetching, every worker process downloads its own countries into the shared cache
+    out_folder = tmp_path / 'out'
+    summary = batch.run_batch(iso3_list, wb_bounds, 'WB_ID', str(out_folder / '{sel_iso3}'), str(out_folder / 'summary.csv'),
+                                max_workers=3, write_output=False, cache=cache, prefetch_workers=0,
+                                geobounds_url=geoboundaries.geobounds_url)
+    assert (summary['status'] == 'complete').all(), summary['error'].tolist()
+    assert sorted(cache.read_index().keys()) == sorted(cache.cache_key(x, 2, 'gbOpen') for x in iso3_list)
+    for iso3 in iso3_list:
+        assert geoboundaries.downloads(iso3) == 1
+
+    # a second batch reads every country from the cache
+    out_folder = tmp_path / 'out2'
+    summary = batch.run_batch(iso3_list, wb_bounds, 'WB_ID', str(out_folder / '{sel_iso3}'), str(out_folder / 'summary.csv'),
+                                max_workers=3, write_output=False, cache=cache, prefetch_workers=0,
+                                geobounds_url=geoboundaries.geobounds_url)
+    assert (summary['status'] == 'complete').all(), summary['error'].tolist()
+    assert geoboundaries.downloads() == len(iso3_list)
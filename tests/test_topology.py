@@ -0,0 +1,33 @@
+import geopandas as gpd
+import pandas as pd
+
+from shapely.geometry import box
+
+from GOSTboundaries.topology import OUTSIDE, build_edges, map_edges, compare_edges
+
+
+def admin_grid(ids, n=4, size=0.25):
+    ''' n x n grid of square admins; ids are assigned in row order
+    '''
+    geoms = [box(x * size, y * size, (x + 1) * size, (y + 1) * size) for y in range(n) for x in range(n)]
+    return(gpd.GeoDataFrame({'ID':ids}, geometry=geoms, crs=4326))
+
+def test_pairs_are_ordered():
+    # in row order WB_9 comes before WB_10, as strings it comes after
+    edges = build_edges(admin_grid([f'WB_{x}' for x in range(16)]), 'ID')
+    inside = edges['id_2'] != OUTSIDE
+    assert (edges.loc[inside, 'id_1'] < edges.loc[inside, 'id_2']).all()
+    assert not (edges['id_1'] == OUTSIDE).any()
+    assert ((edges['id_1'] == 'WB_10') & (edges['id_2'] == 'WB_9')).sum() == 1
+
+def test_identical_tilings_match():
+    wb = admin_grid([f'WB_{x}' for x in range(16)])
+    geo = admin_grid([str(x) for x in range(16)])
+    wb_edges = build_edges(wb, 'ID')
+    geo_edges = map_edges(build_edges(geo, 'ID'), pd.Series(wb['ID'].values, index=geo['ID'].values))
+    comp = compare_edges(wb_edges, geo_edges, 3857)
+
+    assert (comp['status'] == 'matched').all()
+    # 24 boundaries between neighbours and 12 admins on the national boundary
+    assert comp.shape[0] == 24 + 12
+    assert comp['hausdorff'].max() < 1e-6